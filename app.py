@@ -7,12 +7,15 @@ from pathlib import Path
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from src.ocr.ocr import ocr_file
-from src.qa.unified import unified_form_query
-from src.utils.storage import save_form, load_all_forms_with_names
-from src.llm.gemini import call_gemini, SUMMARY_SYSTEM
-import json
+from src.ocr.ocr import ocr_path
+from src.qa.unified import FormQuerySession
+from src.utils.storage import (save_form, spool_upload, list_forms, count_forms, get_form_preview, get_form_text,
+                               get_duplicate_of, get_form_filename, semantic_search)
+from src.qa.summary import summarize_forms
+from src.llm.replay import record_from_env
 
+# With GEMINI_RECORD_PATH set, LLM calls are logged for offline replay (python -m src.llm.replay)
+record_from_env()
 
 st.set_page_config(
     page_title="Intelligent Form Agent",
@@ -53,13 +56,24 @@ if page == "Upload Forms":
                 if st.button(f"Process {uploaded_file.name}", key=f"process_{idx}"):
                     try:
                         with st.spinner("Running OCR..."):
-                            file_bytes = uploaded_file.read()
-                            ocr_text = ocr_file(file_bytes, uploaded_file.name)
+                            # Stream to disk and OCR page by page instead of reading the whole file
+                            uploaded_file.seek(0)
+                            spooled, file_sha, _ = spool_upload(uploaded_file)
+                            try:
+                                ocr_text = ocr_path(spooled, uploaded_file.name, file_sha=file_sha)
+                            except Exception:
+                                spooled.unlink(missing_ok=True)
+                                raise
                             
-                            # Save form
-                            form_id = save_form(file_bytes, uploaded_file.name, ocr_text)
+                            # Save form (moves the spooled file into the store)
+                            form_id = save_form(None, uploaded_file.name, ocr_text,
+                                                file_path=spooled, file_sha=file_sha)
                             
                             st.success(f"✅ Form processed and saved! Form ID: {form_id}")
+                            duplicate_of = get_duplicate_of(form_id)
+                            if duplicate_of:
+                                st.warning(f"⚠️ Near-duplicate of {get_form_filename(duplicate_of)} "
+                                           f"({duplicate_of}); it is excluded from queries.")
                             st.session_state[f'ocr_{idx}'] = ocr_text
                             st.session_state[f'form_id_{idx}'] = form_id
                     
@@ -78,55 +92,100 @@ if page == "Upload Forms":
 
 elif page == "Ask Questions":
     st.header("Ask Questions")
-    # Load all forms with filenames
-    forms_with_names = load_all_forms_with_names()
+    total_forms = count_forms()
     
-    if not forms_with_names:
+    if not total_forms:
         st.info("No forms found. Please upload forms first using the 'Upload Forms' page.")
     else:
-        st.text(f"Found {len(forms_with_names)} saved form(s).")
+        st.text(f"Found {total_forms} saved form(s).")
         
-        # Create a mapping for easier access
-        form_id_to_filename = {form_id: info['filename'] for form_id, info in forms_with_names.items()}
-        forms_dict = {form_id: info['ocr_text'] for form_id, info in forms_with_names.items()}
+        # Selection persists across pages: {form_id: filename}
+        selection = st.session_state.setdefault('selected_forms', {})
         
-        # Display forms with filenames
-        with st.expander("View Saved Forms"):
-            for form_id, info in forms_with_names.items():
-                filename = info['filename']
-                ocr_text = info['ocr_text']
-                st.text(f"📄 {filename}")
-                st.text_area(
-                    f"OCR Text Preview",
-                    ocr_text[:500] + "..." if len(ocr_text) > 500 else ocr_text,
-                    height=100,
-                    key=f"preview_{form_id}",
-                    disabled=True
-                )
+        # Browse one page at a time; only the page in view is fetched
+        col1, col2, col3 = st.columns([3, 1, 1])
+        with col1:
+            filter_text = st.text_input("Filter by filename or content:")
+        with col2:
+            sort = st.selectbox("Sort by", ["created", "filename"],
+                                format_func=lambda x: "Newest first" if x == "created" else "Filename")
+        with col3:
+            page_size = st.selectbox("Page size", [25, 50, 100])
         
-        # Form selection dropdown - show filenames
-        form_list = list(forms_dict.keys())
+        listing_key = (filter_text, sort, page_size)
+        if st.session_state.get('listing_key') != listing_key:
+            st.session_state['listing_key'] = listing_key
+            st.session_state['page_cursors'] = [None]  # cursor of each visited page
+        cursors = st.session_state['page_cursors']
         
-        selected_forms = st.multiselect(
-            "Select form(s) to query:",
-            options=form_list,
-            format_func=lambda x: f"{form_id_to_filename[x]}",
-            default=form_list if len(form_list) > 0 else []
-        )
+        page_items, next_cursor = list_forms(cursor=cursors[-1], limit=page_size, sort=sort,
+                                             query=filter_text or None)
         
-        # Filter forms_dict based on selection
-        if selected_forms:
-            filtered_forms_dict = {form_id: forms_dict[form_id] for form_id in selected_forms}
-        else:
-            filtered_forms_dict = forms_dict  # If nothing selected, use all forms
+        with st.expander("View Saved Forms", expanded=True):
+            if not page_items:
+                st.text("No forms match the filter.")
+            for item in page_items:
+                form_id, filename = item['form_id'], item['filename']
+                col1, col2 = st.columns([4, 1])
+                with col1:
+                    checked = st.checkbox(f"📄 {filename}", value=form_id in selection, key=f"select_{form_id}")
+                    if checked:
+                        selection[form_id] = filename
+                    else:
+                        selection.pop(form_id, None)
+                with col2:
+                    show_preview = st.checkbox("Preview", key=f"show_preview_{form_id}")
+                if show_preview:
+                    st.text_area(
+                        f"OCR Text Preview",
+                        get_form_preview(form_id, 500),
+                        height=100,
+                        key=f"preview_{form_id}",
+                        disabled=True
+                    )
+            
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col1:
+                if st.button("◀ Previous", disabled=len(cursors) == 1):
+                    cursors.pop()
+                    st.rerun()
+            with col2:
+                st.text(f"Page {len(cursors)}")
+            with col3:
+                if st.button("Next ▶", disabled=next_cursor is None):
+                    cursors.append(next_cursor)
+                    st.rerun()
+        
+        st.text(f"{len(selection)} form(s) selected.")
+        if selection and st.button("Clear selection"):
+            for form_id in selection:
+                st.session_state.pop(f"select_{form_id}", None)
+            selection.clear()
+            st.rerun()
+        
+        # Only the selected forms' text is loaded
+        form_id_to_filename = dict(selection)
+        filtered_forms_dict = {form_id: get_form_text(form_id) or "" for form_id in selection}
         
         # Question input
         question = st.text_input("Enter your question:")
         
+        # Semantic retrieval picks the forms that go into the prompt
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            auto_select = st.checkbox(
+                "Pick the most relevant forms for the question (semantic search"
+                + (" within the selection)" if selection else " over all forms)"),
+                value=not selection
+            )
+        with col2:
+            retrieve_k = st.number_input("Forms to use", min_value=1, max_value=50, value=5, disabled=not auto_select)
+        
         # Action buttons
         col1, col2 = st.columns(2)
         with col1:
-            ask_button = st.button("Ask Question", disabled=not question or not filtered_forms_dict, use_container_width=True)
+            ask_button = st.button("Ask Question", disabled=not question or not (filtered_forms_dict or auto_select),
+                                   use_container_width=True)
         with col2:
             summary_button = st.button("Generate Summary", disabled=not filtered_forms_dict, use_container_width=True)
         
@@ -136,11 +195,28 @@ elif page == "Ask Questions":
         if ask_button:
             with st.spinner("Analyzing forms..."):
                 try:
-                    # Use filtered_forms_dict based on user selection
-                    result = unified_form_query(filtered_forms_dict, question)
+                    if auto_select:
+                        hits = semantic_search([question], top_k=int(retrieve_k),
+                                               form_ids=list(selection) if selection else None)[0]
+                        if not hits:
+                            st.warning("No form text matches the question.")
+                            st.stop()
+                        filtered_forms_dict = {hit['form_id']: get_form_text(hit['form_id']) or "" for hit in hits}
+                        form_id_to_filename = {hit['form_id']: get_form_filename(hit['form_id']) for hit in hits}
+                        st.caption("Using: " + ", ".join(f"{form_id_to_filename[hit['form_id']]} ({hit['score']:.2f})"
+                                                         for hit in hits))
+                    
+                    # Reuse one session per selection so follow-up questions only send the question
+                    session_key = tuple(sorted(filtered_forms_dict))
+                    if st.session_state.get('qa_session_key') != session_key:
+                        st.session_state['qa_session'] = FormQuerySession(filtered_forms_dict)
+                        st.session_state['qa_session_key'] = session_key
+                    result = st.session_state['qa_session'].ask(question)
                     
                     if result["success"]:
                         st.success("✅ Analysis complete!")
+                        if result.get("source") == "template":
+                            st.caption("Answered locally from a template learned on earlier forms of this type.")
                         
                         # Display formatted result
                         if isinstance(result["result"], dict) and result["result"].get("mode") == "single":
@@ -167,7 +243,8 @@ elif page == "Ask Questions":
                                 for ev in result["result"]["evidence"]:
                                     ev_file = ev.get('file', 'Unknown')
                                     ev_display = form_id_to_filename.get(ev_file, ev_file)
-                                    st.write(f"**{ev_display}**: `{ev.get('snippet', '')}`")
+                                    unverified = " ⚠️ not found in the form text" if ev.get("match", True) is None else ""
+                                    st.write(f"**{ev_display}**: `{ev.get('snippet', '')}`{unverified}")
                             
                             # Note if present
                             if result["result"].get("note"):
@@ -202,7 +279,8 @@ elif page == "Ask Questions":
                                     if item.get("evidence"):
                                         st.markdown("**Evidence:**")
                                         for ev in item["evidence"]:
-                                            st.write(f"- `{ev.get('snippet', '')}`")
+                                            unverified = " ⚠️ not found in the form text" if ev.get("match", True) is None else ""
+                                            st.write(f"- `{ev.get('snippet', '')}`{unverified}")
                         
                         # Show raw JSON if toggle is on
                         if show_json:
@@ -221,49 +299,9 @@ elif page == "Ask Questions":
         if summary_button:
             with st.spinner("Generating summary..."):
                 try:
-                    # Build summary prompt
-                    if len(filtered_forms_dict) == 1:
-                        # Single form summary
-                        form_id = list(filtered_forms_dict.keys())[0]
-                        ocr_text = list(filtered_forms_dict.values())[0]
-                        filename = form_id_to_filename.get(form_id, form_id)
-                        user_prompt = f"""Form: {filename}
-
-                                        OCR Text:
-                                        {ocr_text}
-
-                                        Generate a comprehensive summary of this form."""
-                    else:
-                        # Multi-form summary
-                        labeled_forms = []
-                        for form_id, ocr_text in filtered_forms_dict.items():
-                            filename = form_id_to_filename.get(form_id, form_id)
-                            # Use full OCR text for better summaries (no truncation)
-                            labeled_forms.append(f"--- Form: {filename} ---\n{ocr_text}\n")
-                        
-                        user_prompt = f"""Multiple Forms:
-
-                                        {''.join(labeled_forms)}
-
-                                        Generate a comprehensive summary for each form."""
-                    
-                    # Call Gemini with summary system prompt
-                    raw_summary = call_gemini(SUMMARY_SYSTEM, user_prompt)
-                    
-                    # Try to parse JSON
-                    try:
-                        summary_data = json.loads(raw_summary)
-                    except:
-                        # Try to extract JSON from markdown or tags
-                        import re
-                        json_match = re.search(r'\{.*\}', raw_summary, re.DOTALL)
-                        if json_match:
-                            try:
-                                summary_data = json.loads(json_match.group(0))
-                            except:
-                                summary_data = {"summary": raw_summary, "raw": True}
-                        else:
-                            summary_data = {"summary": raw_summary, "raw": True}
+                    # Per-form summaries are cached by OCR text hash and merged hierarchically,
+                    # so only new/changed forms cost a full summary call
+                    summary_data = summarize_forms(filtered_forms_dict, names=form_id_to_filename)
                     
                     # Display summary
                     st.success("✅ Summary generated!")
@@ -271,7 +309,7 @@ elif page == "Ask Questions":
                     if summary_data.get("raw"):
                         # If not JSON, show as plain text
                         st.markdown("### 📄 Summary")
-                        st.info(summary_data.get("summary", raw_summary))
+                        st.info(summary_data.get("summary", ""))
                     else:
                         # Display structured summary
                         st.markdown("### 📄 Summary")
@@ -297,6 +335,13 @@ elif page == "Ask Questions":
                         form_type = summary_data.get("form_type")
                         if form_type:
                             st.markdown(f"**Form Type:** {form_type}")
+                        
+                        # Per-form summaries (multi-form selections)
+                        if summary_data.get("forms"):
+                            with st.expander(f"Per-form summaries ({len(summary_data['forms'])})"):
+                                for form_summary in summary_data["forms"]:
+                                    st.markdown(f"**📄 {form_summary.get('file')}**")
+                                    st.write(form_summary.get("summary", ""))
                     
                     # Show raw JSON if toggle is on
                     if show_json:
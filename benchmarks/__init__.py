@@ -0,0 +1 @@
+"""Offline benchmark suite (synthetic forms + fake Gemini backend)."""
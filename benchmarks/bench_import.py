@@ -0,0 +1,97 @@
+"""
+Import-time benchmark and budget check (`python -X importtime`).
+
+Usage (from the project root):
+    python benchmarks/bench_import.py                  # exits 1 if over budget
+    python benchmarks/bench_import.py --budget-ms 80 --runs 7
+
+Each run imports the library modules in a fresh interpreter and sums the
+cumulative import time of the top-level `src.*` imports. The check also fails
+if any heavy dependency is pulled in at import time.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODULES = ["src.llm.gemini", "src.ocr.ocr", "src.qa.unified", "src.utils.storage"]
+HEAVY_MODULES = ["fitz", "PIL", "pytesseract", "google.generativeai", "dotenv", "numpy", "streamlit"]
+DEFAULT_BUDGET_MS = 60.0
+
+
+def measure_import(modules=None):
+    """
+    Import `modules` in a fresh interpreter with -X importtime.
+    Returns (total_ms, set_of_imported_module_names).
+    """
+    modules = modules or MODULES
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    total_us = 0
+    imported = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # header line
+        name = parts[2].rstrip()[1:]  # drop the separator space, keep nesting indent
+        stripped = name.strip()
+        imported.add(stripped)
+        # Top-level entries (no indentation) carry the cumulative time of their subtree
+        if name == stripped and stripped.split(".")[0] == "src":
+            total_us += int(parts[1])
+    return total_us / 1000.0, imported
+
+
+def check_import_budget(budget_ms=DEFAULT_BUDGET_MS, runs=5, modules=None):
+    """
+    Measure import time `runs` times and compare the median against `budget_ms`.
+    Returns a dict with the measurements and a list of violations (empty = pass).
+    """
+    samples = []
+    imported = set()
+    for _ in range(runs):
+        total_ms, imported = measure_import(modules)
+        samples.append(total_ms)
+    median_ms = statistics.median(samples)
+    heavy = sorted(m for m in HEAVY_MODULES if m in imported)
+    violations = []
+    if median_ms > budget_ms:
+        violations.append(f"median import time {median_ms:.1f} ms exceeds budget {budget_ms:.1f} ms")
+    if heavy:
+        violations.append(f"heavy modules imported eagerly: {', '.join(heavy)}")
+    return {
+        "median_ms": round(median_ms, 3),
+        "min_ms": round(min(samples), 3),
+        "max_ms": round(max(samples), 3),
+        "budget_ms": budget_ms,
+        "heavy_modules": heavy,
+        "violations": violations,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check library import time against a budget.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    result = check_import_budget(args.budget_ms, args.runs)
+    print(f"Import time: median {result['median_ms']} ms "
+          f"(min {result['min_ms']}, max {result['max_ms']}), budget {result['budget_ms']} ms")
+    for violation in result["violations"]:
+        print(f"  ✗ {violation}")
+    if result["violations"]:
+        sys.exit(1)
+    print("  ✓ within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Peak memory of ingesting one large upload: whole-file bytes vs. streaming.
+
+Usage (from the project root):
+    python benchmarks/bench_upload.py                  # 8, 32 and 128 MB scans
+    python benchmarks/bench_upload.py --sizes-mb 16 256 --all-pages
+
+Each measurement runs in a fresh interpreter and reports its peak RSS
+(VmHWM; ru_maxrss survives exec on Linux and would include this runner's
+peak), so the numbers include PyMuPDF's and PIL's own buffers:
+- "bytes":  read the file, render from the in-memory PDF, save_form(file_bytes)
+- "stream": spool in chunks, render pages from the spooled path, save_form(file_path)
+Tesseract itself is not run (its memory does not depend on the file size).
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PAGE_WIDTH, PAGE_HEIGHT, SCAN_DPI = 595, 842, 300
+
+
+def make_large_scan(path, size_mb, seed=0):
+    """Write an image-only PDF of noisy 300 DPI JPEG pages (noise resists compression) of about `size_mb`."""
+    import fitz  # PyMuPDF
+    import io
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    width, height = PAGE_WIDTH * SCAN_DPI // 72, PAGE_HEIGHT * SCAN_DPI // 72
+    doc = fitz.open()
+    written = 0
+    while written < size_mb * 1024 * 1024:
+        pixels = rng.integers(0, 256, size=(height, width), dtype=np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(pixels, "L").save(buf, format="JPEG", quality=90)
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_image(page.rect, stream=buf.getvalue())
+        written += buf.tell()
+    pages = doc.page_count
+    doc.save(path)
+    doc.close()
+    return pages
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def _worker(mode, path, store, max_pages):
+    """Ingest `path` into `store` in this process; prints a JSON result line."""
+    import fitz  # PyMuPDF; imported up front so its start-up is in the baseline
+    from PIL import Image  # noqa: F401
+
+    sys.path.insert(0, str(ROOT))
+    from src.ocr import ocr
+    from src.utils import storage
+
+    storage.FORMS_DB_DIR = Path(store)
+    baseline_mb = _peak_rss_mb()
+    t0 = time.perf_counter()
+    pages = 0
+    if mode == "bytes":
+        with open(path, "rb") as f:
+            data = f.read()
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            count = doc.page_count if max_pages is None else min(doc.page_count, max_pages)
+            for page_no in range(count):
+                ocr.render_pdf_page(data, page_no, doc=doc)
+                pages += 1
+        storage.save_form(data, Path(path).name, f"bench upload {mode}")
+    else:
+        with open(path, "rb") as f:
+            spooled, sha, _ = storage.spool_upload(f)
+        for _ in ocr.iter_page_images(spooled, path, max_pages=max_pages, file_sha=sha):
+            pages += 1
+        storage.save_form(None, Path(path).name, f"bench upload {mode}", file_path=spooled, file_sha=sha)
+    print(json.dumps({
+        "pages": pages,
+        "seconds": round(time.perf_counter() - t0, 3),
+        "peak_rss_mb": _peak_rss_mb(),
+        "baseline_rss_mb": baseline_mb,
+    }))
+
+
+def measure_upload(mode, path, max_pages=1):
+    """Run one ingest in a fresh interpreter; returns its result dict."""
+    with tempfile.TemporaryDirectory(prefix="form_bench_upload_") as store:
+        proc = subprocess.run(
+            [sys.executable, __file__, "--worker", mode, str(path), store,
+             "all" if max_pages is None else str(max_pages)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def bench_upload(sizes_mb=(8, 32, 128), all_pages=False):
+    """Peak RSS of both ingest modes for each file size; returns a dict keyed by size."""
+    result = {}
+    with tempfile.TemporaryDirectory(prefix="form_bench_scan_") as tmp:
+        for size_mb in sizes_mb:
+            path = Path(tmp) / f"scan_{size_mb}mb.pdf"
+            pages = make_large_scan(path, size_mb)
+            entry = {"file_mb": round(path.stat().st_size / 1024.0 / 1024.0, 1), "file_pages": pages}
+            for mode in ("bytes", "stream"):
+                entry[mode] = measure_upload(mode, path, max_pages=None if all_pages else 1)
+            result[f"{size_mb}mb"] = entry
+            path.unlink()
+    return result
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "--worker":
+        mode, path, store, max_pages = argv[1:5]
+        _worker(mode, path, store, None if max_pages == "all" else int(max_pages))
+        return 0
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", nargs="*", type=int, default=[8, 32, 128])
+    parser.add_argument("--all-pages", action="store_true", help="Render every page, not just the first")
+    args = parser.parse_args(argv)
+    print(json.dumps(bench_upload(args.sizes_mb, args.all_pages), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
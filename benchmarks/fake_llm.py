@@ -0,0 +1,109 @@
+"""Deterministic fake Gemini backend for offline benchmarks."""
+
+import hashlib
+import json
+import random
+import re
+import time
+
+_FILE_LABEL = re.compile(r"^\s*--- (?:FILE|Form|Summary): (.+?) ---\s*$", re.MULTILINE)
+_BATCH_QUESTION = re.compile(r"^\[(Q\d+)\] (.+)$", re.MULTILINE)
+
+
+class FakeGemini:
+    """
+    Drop-in replacement for call_gemini (install with src.llm.gemini.set_backend).
+
+    Answers are derived from the prompt only, so the same prompt always gets the
+    same response. Latency is `latency_ms` plus up to `jitter_ms` of seeded jitter,
+    plus `latency_per_kchar_ms` for every 1000 prompt characters actually sent.
+    Explicit context caching is emulated: cached prefixes are not counted as sent.
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, seed=0, latency_per_kchar_ms=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.latency_per_kchar_ms = latency_per_kchar_ms
+        self._rng = random.Random(seed)
+        self._caches = {}
+        self.calls = 0
+        self.prompt_chars = 0
+
+    def create_cached_context(self, system_prompt, static_prompt, **kwargs):
+        name = "cachedContents/fake-" + hashlib.sha256(
+            (system_prompt + "\0" + static_prompt).encode("utf-8")).hexdigest()[:16]
+        self._caches[name] = (system_prompt, static_prompt)
+        return name
+
+    def delete_cached_context(self, cached_content):
+        self._caches.pop(cached_content, None)
+
+    def __call__(self, system_prompt, user_prompt, model="gemini-flash-lite-latest",
+                 max_output_tokens=1024, cached_content=None, **kwargs):
+        self.calls += 1
+        sent = len(user_prompt) if cached_content else len(system_prompt) + len(user_prompt)
+        self.prompt_chars += sent
+        if cached_content:
+            system_prompt, static_prompt = self._caches[cached_content]
+            user_prompt = static_prompt + "\n" + user_prompt
+        delay = self.latency_ms + self._rng.random() * self.jitter_ms + sent / 1000.0 * self.latency_per_kchar_ms
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if '"summary"' in system_prompt:
+            return json.dumps(self._summary(user_prompt))
+        return "<JSON>\n" + json.dumps(self._answer(user_prompt)) + "\n</JSON>"
+
+    @staticmethod
+    def _sections(user_prompt):
+        """Split the prompt into [(file_label, text)] using the FILE/Form markers."""
+        matches = list(_FILE_LABEL.finditer(user_prompt))
+        sections = []
+        for i, m in enumerate(matches):
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(user_prompt)
+            sections.append((m.group(1), user_prompt[m.end():end]))
+        return sections
+
+    @staticmethod
+    def _field_lines(text):
+        return [line.strip() for line in text.splitlines() if ":" in line and line.strip()]
+
+    def _answer(self, user_prompt):
+        if "---QUESTIONS---" in user_prompt:
+            prefix, batch = user_prompt.split("---QUESTIONS---", 1)
+            return {"answers": [{"id": qid, "result": self._answer(f"{prefix}---QUESTION---\n{q}")}
+                                for qid, q in _BATCH_QUESTION.findall(batch)]}
+        sections = self._sections(user_prompt)
+        if not sections:
+            return []
+        question = user_prompt.split("---QUESTION---", 1)[-1]
+        digest = int(hashlib.sha256(question.encode("utf-8")).hexdigest(), 16)
+        fname, text = sections[digest % len(sections)]
+        lines = self._field_lines(text) or [text.strip()[:80]]
+        # A question naming a field label ("What is the loan amount?") gets that field
+        asked = set(re.findall(r"[a-z]+", question.lower()))
+        named = [l for l in lines if ":" in l and set(re.findall(r"[a-z]+", l.split(":", 1)[0].lower())) <= asked]
+        line = named[0] if named else lines[digest % len(lines)]
+        answer = line.split(":", 1)[-1].strip() if ":" in line else line
+        return {
+            "mode": "single",
+            "file": fname,
+            "answer": answer or None,
+            "evidence": [{"file": fname, "snippet": line[:120]}],
+            "confidence": "HIGH",
+        }
+
+    def _summary(self, user_prompt):
+        sections = self._sections(user_prompt)
+        text = sections[0][1] if sections else user_prompt
+        lines = self._field_lines(text)
+        key_fields = {}
+        for line in lines[:6]:
+            label, value = line.split(":", 1)
+            key_fields[label.strip().lower().replace(" ", "_")] = value.strip() or None
+        first = next((line.strip() for line in text.splitlines() if line.strip()), None)
+        return {
+            "summary": f"Synthetic summary covering {max(len(sections), 1)} form(s).",
+            "key_fields": key_fields,
+            "warnings": [],
+            "form_type": first,
+        }
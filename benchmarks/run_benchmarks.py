@@ -0,0 +1,712 @@
+"""
+Offline benchmark runner.
+
+Usage (from the project root):
+    python benchmarks/run_benchmarks.py                      # quick run, writes JSON
+    python benchmarks/run_benchmarks.py --sizes 100 1000 10000
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<old>.json
+
+No network access or API key is needed: Gemini calls go to FakeGemini.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.fake_llm import FakeGemini  # noqa: E402
+from benchmarks.synthetic import make_corpus  # noqa: E402
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def _percentiles(samples):
+    """Return p50/p90/p99/mean (milliseconds) for a list of durations in seconds."""
+    ms = sorted(s * 1000.0 for s in samples)
+    if not ms:
+        return {}
+
+    def pick(q):
+        return round(ms[min(len(ms) - 1, int(q * len(ms)))], 4)
+
+    return {"p50_ms": pick(0.50), "p90_ms": pick(0.90), "p99_ms": pick(0.99),
+            "mean_ms": round(statistics.fmean(ms), 4), "n": len(ms)}
+
+
+def _timed(fn, repeat):
+    """Run fn `repeat` times and return the list of durations (seconds)."""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+class _TempStore:
+    """Point src.utils.storage at a throwaway directory for the duration of a block."""
+
+    def __enter__(self):
+        from src.utils import storage
+
+        self._storage = storage
+        self._tmp = tempfile.TemporaryDirectory(prefix="form_bench_")
+        self._previous = storage.FORMS_DB_DIR
+        storage.FORMS_DB_DIR = Path(self._tmp.name) / "forms_db"
+        return storage
+
+    def __exit__(self, *exc):
+        self._storage.FORMS_DB_DIR = self._previous
+        self._tmp.cleanup()
+
+
+def bench_ocr(args):
+    """Rasterization and OCR throughput on synthetic PDFs and images."""
+    from src.ocr import ocr as ocr_mod
+
+    pdfs = make_corpus(args.ocr_docs, seed=1, kind="pdf", pages=args.pages)
+    result = {"docs": len(pdfs), "raster": _bench_raster(args, ocr_mod)}
+
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except Exception as exc:
+        result["ocr"] = {"skipped": f"tesseract unavailable: {exc.__class__.__name__}"}
+        return result
+
+    images = make_corpus(args.ocr_docs, seed=2, kind="png")
+    for label, docs in (("pdf", pdfs), ("png", images)):
+        t0 = time.perf_counter()
+        for fname, data, _ in docs:
+            ocr_mod.ocr_file(data, fname)
+        elapsed = time.perf_counter() - t0
+        result[f"ocr_{label}_pages_per_s"] = round(len(docs) / elapsed, 2)
+    return result
+
+
+def _bench_raster(args, ocr_mod):
+    """Fixed zoom=2.0 RGB vs. adaptive-DPI grayscale rendering, and the raster cache."""
+    from benchmarks.synthetic import make_form_pdf, make_form_text
+
+    docs = {
+        "text_a4": make_corpus(args.ocr_docs, seed=1, kind="pdf"),
+        "scan_a4_150dpi": make_corpus(args.ocr_docs, seed=3, kind="scan"),
+        "text_a0": [("a0.pdf", make_form_pdf(make_form_text(5), width=2384, height=3370), "")],
+    }
+    result = {}
+    for name, corpus in docs.items():
+        t0 = time.perf_counter()
+        legacy_bytes = 0
+        for _, data, _ in corpus:
+            img = ocr_mod.pdf_first_page_to_pil(data, zoom=2.0)
+            legacy_bytes += len(img.tobytes())
+        legacy_s = time.perf_counter() - t0
+        ocr_mod.reset_render_stats()
+        dpis = [ocr_mod.render_pdf_page(data, 0)[1]["dpi"] for _, data, _ in corpus]
+        stats = ocr_mod.get_render_stats()
+        result[name] = {
+            "legacy_ms_per_page": round(legacy_s * 1000.0 / len(corpus), 2),
+            "legacy_bytes_per_page": legacy_bytes // len(corpus),
+            "adaptive_ms_per_page": round(stats["render_s"] * 1000.0 / len(corpus), 2),
+            "adaptive_bytes_per_page": stats["bitmap_bytes"] // len(corpus),
+            "dpi": sorted(set(dpis)),
+            "bytes_saved": stats["bytes_saved"],
+        }
+
+    with tempfile.TemporaryDirectory(prefix="form_bench_raster_") as tmp:
+        corpus = docs["scan_a4_150dpi"]
+        cache = {}
+        for name in ("cold", "warm"):
+            ocr_mod.reset_render_stats()
+            for _, data, _ in corpus:
+                ocr_mod.render_pdf_page(data, 0, cache_dir=tmp)
+            stats = ocr_mod.get_render_stats()
+            cache[name] = {"ms_per_page": round(stats["render_s"] * 1000.0 / len(corpus), 2),
+                           "renders": stats["renders"], "cache_hits": stats["cache_hits"]}
+        result["cache"] = cache
+
+        # Streaming path (files opened by path, no file_sha given) with the cache switched on globally
+        paths = []
+        for fname, data, _ in corpus:
+            path = Path(tmp) / fname
+            path.write_bytes(data)
+            paths.append(path)
+        previous_dir = ocr_mod.RASTER_CACHE_DIR
+        ocr_mod.RASTER_CACHE_DIR = Path(tmp) / "stream_cache"
+        try:
+            stream = {}
+            for name in ("cold", "warm"):
+                ocr_mod.reset_render_stats()
+                for path in paths:
+                    for _ in ocr_mod.iter_page_images(path, path.name):
+                        pass
+                stats = ocr_mod.get_render_stats()
+                stream[name] = {"renders": stats["renders"], "cache_hits": stats["cache_hits"]}
+        finally:
+            ocr_mod.RASTER_CACHE_DIR = previous_dir
+        result["cache_stream"] = stream
+    return result
+
+
+def bench_ingest(args):
+    """save_form throughput into an empty store."""
+    corpus = make_corpus(args.ingest_docs, seed=3, kind="text")
+    total_bytes = sum(len(data) + len(text) for _, data, text in corpus)
+    with _TempStore() as storage:
+        t0 = time.perf_counter()
+        for fname, data, text in corpus:
+            storage.save_form(data, fname, text)
+        elapsed = time.perf_counter() - t0
+        footprint = _disk_footprint(storage.FORMS_DB_DIR)
+    return {"docs": len(corpus), "forms_per_s": round(len(corpus) / elapsed, 2),
+            "mb_per_s": round(total_bytes / elapsed / 1e6, 3),
+            "input_bytes": total_bytes, **footprint}
+
+
+def _ingest_worker(job):
+    """Process-pool worker: save a slice of the synthetic corpus into a shared store."""
+    root, docs = job
+    from src.utils import storage
+
+    storage.FORMS_DB_DIR = Path(root)
+    for fname, data, text in docs:
+        storage.save_form(data, fname, text, on_duplicate="keep")
+    return len(docs)
+
+
+def bench_ingest_parallel(args):
+    """Several processes ingesting into one store, followed by a deep fsck."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    corpus = make_corpus(args.ingest_docs, seed=10, kind="text")
+    with _TempStore() as storage:
+        root = str(storage.FORMS_DB_DIR)
+        jobs = [(root, corpus[w::args.workers]) for w in range(args.workers)]
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            t0 = time.perf_counter()
+            saved = sum(pool.map(_ingest_worker, jobs))
+            elapsed = time.perf_counter() - t0
+        report = storage.fsck(deep=True)
+        problems = sum(len(v) if isinstance(v, list) else 0 for v in report.values())
+        return {"workers": args.workers, "docs": saved, "forms_per_s": round(saved / elapsed, 2),
+                "records": report["records"], "fsck_problems": problems}
+
+
+def _disk_footprint(root):
+    """Inodes (files + directories) and allocated bytes under `root`."""
+    inodes = 0
+    allocated = 0
+    for path in Path(root).rglob("*"):
+        st = path.stat()
+        inodes += 1
+        allocated += getattr(st, "st_blocks", 0) * 512 or st.st_size
+    return {"inodes": inodes, "disk_bytes": allocated}
+
+
+def bench_listing(args):
+    """Full load vs. one UI page (list_forms) as a function of store size."""
+    results = {}
+    for size in args.sizes:
+        corpus = make_corpus(size, seed=4, kind="text")
+        with _TempStore() as storage:
+            for fname, data, text in corpus:
+                storage.save_form(data, fname, text)
+            load_all = _timed(storage.load_all_forms_with_names, args.repeat)
+            first_page, cursor = storage.list_forms(limit=50)
+            page = _timed(lambda: storage.list_forms(limit=50), args.repeat)
+            next_page = _timed(lambda: storage.list_forms(cursor=cursor, limit=50), args.repeat)
+            filtered = _timed(lambda: storage.list_forms(limit=50, query="loan mumbai"), args.repeat)
+        results[str(size)] = {"load_all": _percentiles(load_all), "page": _percentiles(page),
+                              "next_page": _percentiles(next_page), "filtered_page": _percentiles(filtered)}
+    return results
+
+
+def bench_prompt(args):
+    """Prompt build time for growing selections, and parse time per output shape."""
+    from src.qa import unified
+
+    results = {"build": {}, "parse": {}}
+    corpus = make_corpus(max(args.prompt_forms), seed=5, kind="text")
+    for k in args.prompt_forms:
+        forms = {fname: text for fname, _, text in corpus[:k]}
+
+        def build():
+            block = unified._label_and_truncate_forms(forms)
+            unified._build_user_prompt(block, "What is the loan amount?")
+
+        results["build"][str(k)] = _percentiles(_timed(build, args.repeat))
+
+    payload = json.dumps({"mode": "single", "file": "form_000001.txt", "answer": "Alex Johnson",
+                          "evidence": [{"file": "form_000001.txt", "snippet": "Full Name: Alex Johnson"}],
+                          "confidence": "HIGH"})
+    shapes = {
+        "direct": payload,
+        "tagged": f"<JSON>\n{payload}\n</JSON>",
+        "fenced": f"Here you go:\n```json\n{payload}\n```",
+        "embedded": f"The answer is {payload} as requested.",
+        "unparseable": "I could not find that information in the forms." * 20,
+    }
+    for name, raw in shapes.items():
+        results["parse"][name] = _percentiles(_timed(lambda: unified._parse_llm_json(raw), args.repeat))
+    return results
+
+
+def bench_query(args):
+    """End-to-end unified_form_query latency with the fake backend."""
+    from src.llm import gemini
+    from src.qa.unified import unified_form_query
+
+    corpus = make_corpus(args.query_forms, seed=6, kind="text")
+    forms = {fname: text for fname, _, text in corpus}
+    fake = FakeGemini(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, seed=6,
+                      latency_per_kchar_ms=args.llm_latency_per_kchar_ms)
+    previous = gemini.set_backend(fake)
+    try:
+        samples = []
+        ok = 0
+        for i in range(args.queries):
+            t0 = time.perf_counter()
+            res = unified_form_query(forms, f"What is the value of field {i}?")
+            samples.append(time.perf_counter() - t0)
+            ok += bool(res.get("success"))
+    finally:
+        gemini.set_backend(previous)
+    result = _percentiles(samples)
+    result.update({"forms": len(forms), "parse_success_rate": round(ok / max(len(samples), 1), 4),
+                   "prompt_chars_per_call": fake.prompt_chars // max(fake.calls, 1),
+                   "llm_latency_ms": args.llm_latency_ms})
+    return result
+
+
+def bench_followup(args):
+    """Follow-up questions: fresh unified_form_query per question vs. a cached-prefix session."""
+    from src.llm import gemini
+    from src.qa import unified
+
+    corpus = make_corpus(args.query_forms, seed=7, kind="text")
+    forms = {fname: text for fname, _, text in corpus}
+    questions = [f"What is the value of field {i}?" for i in range(args.queries)]
+    result = {}
+    modes = {
+        "stateless": lambda q: unified.unified_form_query(forms, q),
+        "session_local": unified.FormQuerySession(forms, use_provider_cache=False, use_templates=False).ask,
+        "session_cached": unified.FormQuerySession(forms, use_templates=False).ask,
+    }
+    for name, ask in modes.items():
+        fake = FakeGemini(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, seed=7,
+                          latency_per_kchar_ms=args.llm_latency_per_kchar_ms)
+        previous = gemini.set_backend(fake)
+        try:
+            unified.clear_forms_contexts()
+            ask(questions[0])  # first question builds the prefix
+            ask(questions[0])  # the first follow-up creates the provider cache
+            fake.calls = fake.prompt_chars = 0
+            samples = _timed_each(ask, questions[1:])
+        finally:
+            unified.clear_forms_contexts()  # fake cache handles must not reach the real API
+            gemini.set_backend(previous)
+        stats = _percentiles(samples)
+        stats["prompt_chars_per_followup"] = fake.prompt_chars // max(fake.calls, 1)
+        result[name] = stats
+    return result
+
+
+def bench_batch(args):
+    """A checklist of questions: one session.ask per question vs. batch_form_query."""
+    from src.llm import gemini
+    from src.qa import unified
+    from src.qa.batch import batch_form_query
+
+    corpus = make_corpus(args.query_forms, seed=8, kind="text")
+    forms = {fname: text for fname, _, text in corpus}
+    questions = [f"What is the value of checklist item {i}?" for i in range(args.batch_questions)]
+    result = {}
+    for name in ("sequential", "batched"):
+        fake = FakeGemini(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, seed=8,
+                          latency_per_kchar_ms=args.llm_latency_per_kchar_ms)
+        previous = gemini.set_backend(fake)
+        try:
+            unified.clear_forms_contexts()
+            session = unified.FormQuerySession(forms, use_provider_cache=False, use_templates=False)
+            t0 = time.perf_counter()
+            if name == "batched":
+                answers = batch_form_query(forms, questions, session=session)
+            else:
+                answers = [session.ask(q) for q in questions]
+            elapsed = time.perf_counter() - t0
+        finally:
+            unified.clear_forms_contexts()
+            gemini.set_backend(previous)
+        result[name] = {
+            "questions": len(questions),
+            "calls": fake.calls,
+            "ms_per_question": round(elapsed * 1000.0 / len(questions), 4),
+            "prompt_chars_per_question": fake.prompt_chars // len(questions),
+            "success_rate": round(sum(1 for a in answers if a.get("success")) / len(questions), 4),
+        }
+    return result
+
+
+def bench_summary(args):
+    """Hierarchical summaries: cold selection, then the same selection plus one form."""
+    from src.llm import gemini
+    from src.qa import summary
+
+    corpus = make_corpus(args.summary_forms + 1, seed=9, kind="text")
+    forms = {fname: text for fname, _, text in corpus[:-1]}
+    fake = FakeGemini(latency_ms=0.0, seed=9)
+    previous_backend = gemini.set_backend(fake)
+    previous_dir = summary.SUMMARY_CACHE_DIR
+    result = {"forms": len(forms),
+              "single_prompt_chars": sum(len(text) for text in forms.values())}
+    try:
+        with tempfile.TemporaryDirectory(prefix="form_bench_summary_") as tmp:
+            summary.SUMMARY_CACHE_DIR = Path(tmp)
+            for name in ("cold", "add_one", "warm"):
+                if name == "add_one":
+                    fname, _, text = corpus[-1]
+                    forms[fname] = text
+                fake.calls = fake.prompt_chars = 0
+                t0 = time.perf_counter()
+                summary.summarize_forms(forms)
+                result[name] = {"calls": fake.calls, "prompt_chars": fake.prompt_chars,
+                                "ms": round((time.perf_counter() - t0) * 1000.0, 3)}
+    finally:
+        summary.SUMMARY_CACHE_DIR = previous_dir
+        gemini.set_backend(previous_backend)
+    return result
+
+
+def bench_replay(args):
+    """Record fake-LLM traffic (questions, a batch, a summary), then replay the log offline."""
+    from src.llm import gemini, replay
+    from src.qa import summary
+    from src.qa.batch import batch_form_query
+    from src.qa.unified import FormQuerySession, unified_form_query
+
+    corpus = make_corpus(args.query_forms, seed=10, kind="text")
+    forms = {fname: text for fname, _, text in corpus}
+    questions = [f"What is the value of field {i}?" for i in range(args.queries)]
+    fake = FakeGemini(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, seed=10,
+                      latency_per_kchar_ms=args.llm_latency_per_kchar_ms)
+    previous_backend = gemini.set_backend(fake)
+    previous_dir = summary.SUMMARY_CACHE_DIR
+    try:
+        with tempfile.TemporaryDirectory(prefix="form_bench_replay_") as tmp:
+            summary.SUMMARY_CACHE_DIR = Path(tmp) / "summaries"
+            log_path = Path(tmp) / "llm_log.jsonl.gz"
+            recorder = replay.record(log_path)
+            t0 = time.perf_counter()
+            for question in questions[:len(questions) // 2]:
+                unified_form_query(forms, question)
+            session = FormQuerySession(forms, use_templates=False)
+            for question in questions[len(questions) // 2:]:
+                session.ask(question)
+            batch_form_query(forms, questions[:10], session=FormQuerySession(forms, use_templates=False))
+            summary.summarize_forms(forms)
+            recorded_s = time.perf_counter() - t0
+            replay.stop_recording(recorder)
+            log_bytes = log_path.stat().st_size
+
+            t0 = time.perf_counter()
+            report = replay.replay(log_path)
+            replay_s = time.perf_counter() - t0
+    finally:
+        summary.SUMMARY_CACHE_DIR = previous_dir
+        gemini.set_backend(previous_backend)
+    return {"requests": report["requests"], "llm_calls": report["llm_calls"], "misses": report["misses"],
+            "log_bytes": log_bytes, "prompt_chars_sent": fake.prompt_chars,
+            "recorded_s": round(recorded_s, 3), "replay_s": round(replay_s, 3),
+            "by_kind": {kind: {"parse_success_rate": info["parse_success_rate"],
+                               "prompt_tokens_mean": info["prompt_tokens"]["mean"],
+                               "replay_total_ms_p50": info["total_ms"]["p50"]}
+                        for kind, info in report["by_kind"].items()}}
+
+
+def bench_retrieval(args):
+    """Semantic index: embedding cost at ingest, batched search, exact vs. IVF on a large matrix."""
+    import numpy as np
+
+    from src.utils import vector_index
+
+    corpus = make_corpus(args.retrieval_forms, seed=10, kind="text")
+    questions = ["How much was requested?", "applicant email address", "date of birth",
+                 "which city does the applicant live in"] * 8
+    result = {"embedder": vector_index.get_embedder().name}
+    with _TempStore() as storage:
+        for name, enabled in (("ingest_without_vectors", False), ("ingest_with_vectors", True)):
+            previous = vector_index.EMBED_AT_INGEST
+            vector_index.EMBED_AT_INGEST = enabled
+            try:
+                samples = _timed_each(lambda item: storage.save_form(item[1], item[0], item[2]), corpus)
+            finally:
+                vector_index.EMBED_AT_INGEST = previous
+            result[name] = _percentiles(samples)
+        index = storage.get_vector_index()
+        result["passages"] = index.rows
+        result["search_batch"] = dict(_percentiles(_timed(lambda: storage.semantic_search(questions, top_k=5),
+                                                          args.repeat)), questions=len(questions))
+
+    # Large store: clustered random unit vectors (real embeddings are clustered too),
+    # exhaustive scan vs. IVF lists
+    rows, dim = args.retrieval_rows, 384
+    rng = np.random.default_rng(10)
+    centers = vector_index._normalize(rng.standard_normal((1000, dim)).astype(np.float32))
+    with tempfile.TemporaryDirectory(prefix="form_bench_vectors_") as tmp:
+        root = Path(tmp)
+        directory = root / vector_index.VECTORS_DIR
+        directory.mkdir()
+        (directory / vector_index.META_FILE).write_text(json.dumps({"model": "random", "dim": dim}))
+        with open(directory / vector_index.VECTORS_FILE, "wb") as f:
+            for start in range(0, rows, 50000):
+                n = min(50000, rows - start)
+                block = centers[rng.integers(0, len(centers), n)]
+                block = block + rng.standard_normal((n, dim)).astype(np.float32) * (0.8 / dim ** 0.5)
+                f.write(vector_index._normalize(block).astype("<f2").tobytes())
+        with open(directory / vector_index.PASSAGES_FILE, "w") as f:
+            f.write(json.dumps({"form_id": "bulk", "row": 0, "passages": [[0, 1]] * rows}) + "\n")
+        index = vector_index.load_vector_index(root)
+        # Queries near stored rows, so the exact top-10 is meaningful
+        picks = rng.choice(rows, size=32, replace=False)
+        queries = np.asarray(index.matrix()[np.sort(picks)], dtype=np.float32)
+        queries = vector_index._normalize(queries + (0.2 / dim ** 0.5) * rng.standard_normal(queries.shape).astype(np.float32))
+        exact = _timed(lambda: index.search(queries, k=10), max(3, args.repeat // 4))
+        _, exact_rows = index.search(queries, k=10)
+        t0 = time.perf_counter()
+        nlist = vector_index.build_ivf(root)
+        build_ms = (time.perf_counter() - t0) * 1000.0
+        previous_min = vector_index.IVF_MIN_ROWS
+        vector_index.IVF_MIN_ROWS = 0
+        try:
+            ivf = _timed(lambda: index.search(queries, k=10), max(3, args.repeat // 4))
+            _, ivf_rows = index.search(queries, k=10)
+        finally:
+            vector_index.IVF_MIN_ROWS = previous_min
+        recall = np.mean([len(set(a) & set(b)) / 10.0 for a, b in zip(exact_rows, ivf_rows)])
+        result["large"] = {"rows": rows, "queries": len(queries), "exact": _percentiles(exact),
+                           "ivf": _percentiles(ivf), "ivf_lists": nlist, "ivf_build_ms": round(build_ms, 1),
+                           "ivf_recall_at_10": round(float(recall), 3)}
+    return result
+
+
+def bench_templates(args):
+    """Repeated field questions over forms of known types: LLM calls and latency with templates."""
+    from src.llm import gemini
+    from src.qa import unified
+
+    corpus = make_corpus(args.template_forms, seed=11, kind="text")
+    questions = ["What is the loan amount?", "What is the applicant's email?", "What is the date of birth?"]
+    fake = FakeGemini(latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, seed=11)
+    previous_backend = gemini.set_backend(fake)
+    result = {"forms": len(corpus), "questions": len(questions)}
+    try:
+        with _TempStore() as storage:
+            form_ids = [storage.save_form(data, fname, text) for fname, data, text in corpus]
+            result["form_types"] = len(storage.get_type_index().types)
+            for use_templates in (False, True):
+                fake.calls = 0
+                samples, local, correct = [], 0, 0
+                for form_id in form_ids:
+                    text = storage.get_form_text(form_id)
+                    session = unified.FormQuerySession({form_id: text}, use_provider_cache=False,
+                                                       use_templates=use_templates)
+                    for question in questions:
+                        t0 = time.perf_counter()
+                        res = session.ask(question)
+                        samples.append(time.perf_counter() - t0)
+                        local += res.get("source") == "template"
+                        answer = (res.get("result") or {}).get("answer") if res.get("success") else None
+                        correct += bool(answer) and f": {answer}" in text
+                name = "with_templates" if use_templates else "llm_only"
+                result[name] = dict(_percentiles(samples), llm_calls=fake.calls, local_answers=local,
+                                    answers_found_in_text=correct)
+            # Filters, ranking and aggregates over the same field must still go to the LLM
+            forms = {form_id: storage.get_form_text(form_id) for form_id in form_ids}
+            session = unified.FormQuerySession(forms, use_provider_cache=False)
+            result["non_lookup_local_answers"] = sum(
+                session.ask(question).get("source") == "template"
+                for question in ("Which forms request a loan amount greater than 500000?",
+                                 "What is the largest loan amount?"))
+    finally:
+        gemini.set_backend(previous_backend)
+    return result
+
+
+def bench_verify(args):
+    """Evidence verification per snippet: exact quotes, OCR-style typos, and fabricated values."""
+    import random
+
+    from src.qa.verify import find_approx
+
+    corpus = make_corpus(args.verify_forms, seed=12, kind="text")
+    rng = random.Random(12)
+    cases = {"exact": [], "typo": [], "fabricated": []}
+    for _, _, text in corpus:
+        lines = [line for line in text.splitlines() if ":" in line]
+        line = rng.choice(lines)
+        cases["exact"].append((text, line))
+        chars = list(line)
+        for _ in range(max(1, len(chars) // 15)):
+            i = rng.randrange(len(chars))
+            if chars[i].isalpha():
+                chars[i] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+        cases["typo"].append((text, "".join(chars)))
+        label = line.split(":", 1)[0]
+        cases["fabricated"].append((text, f"{label}: {rng.randint(10 ** 6, 10 ** 7)}"))
+
+    result = {"snippets_per_case": len(corpus)}
+    for name, items in cases.items():
+        matched = 0
+        samples = []
+        for text, snippet in items:
+            find_approx(text, snippet[:3])  # exclude the one-off trigram index build
+            t0 = time.perf_counter()
+            matched += find_approx(text, snippet) is not None
+            samples.append(time.perf_counter() - t0)
+        stats = _percentiles(samples)
+        result[name] = {"p50_us": round(stats["p50_ms"] * 1000, 1), "p99_us": round(stats["p99_ms"] * 1000, 1),
+                        "matched": matched}
+    return result
+
+
+def _timed_each(fn, items):
+    """Call fn(item) for each item and return the list of durations (seconds)."""
+    samples = []
+    for item in items:
+        t0 = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def bench_upload(args):
+    """Peak RSS ingesting large scanned PDFs: whole-file bytes vs. spooled streaming."""
+    from benchmarks.bench_upload import bench_upload as run
+
+    return run(args.upload_sizes_mb)
+
+
+def bench_import(args):
+    """Cold import time of the library modules (fresh interpreter, -X importtime)."""
+    from benchmarks.bench_import import check_import_budget
+
+    return check_import_budget(runs=5)
+
+
+BENCHMARKS = {
+    "import": bench_import,
+    "ocr": bench_ocr,
+    "ingest": bench_ingest,
+    "upload": bench_upload,
+    "ingest_parallel": bench_ingest_parallel,
+    "listing": bench_listing,
+    "prompt": bench_prompt,
+    "query": bench_query,
+    "followup": bench_followup,
+    "batch": bench_batch,
+    "summary": bench_summary,
+    "replay": bench_replay,
+    "retrieval": bench_retrieval,
+    "templates": bench_templates,
+    "verify": bench_verify,
+}
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except Exception:
+        return None
+
+
+def _flatten(obj, prefix=""):
+    """Flatten nested dicts to {"a.b.c": number} for comparison."""
+    flat = {}
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            flat.update(_flatten(v, f"{prefix}{k}."))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        flat[prefix[:-1]] = obj
+    return flat
+
+
+def compare(baseline, current):
+    """Print relative change of every numeric metric present in both runs."""
+    old = _flatten(baseline.get("results", {}))
+    new = _flatten(current.get("results", {}))
+    print(f"\nComparison vs {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for key in sorted(set(old) & set(new)):
+        if old[key]:
+            delta = (new[key] - old[key]) / old[key] * 100.0
+            print(f"  {key:<45} {old[key]:>12} -> {new[key]:>12}  ({delta:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run offline benchmarks for the form agent.")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="Run a subset of benchmarks")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[10, 100, 1000], help="Store sizes for listing")
+    parser.add_argument("--pages", type=int, default=1, help="Pages per synthetic PDF")
+    parser.add_argument("--ocr-docs", type=int, default=10)
+    parser.add_argument("--ingest-docs", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4, help="Processes for ingest_parallel")
+    parser.add_argument("--prompt-forms", nargs="*", type=int, default=[1, 10, 50])
+    parser.add_argument("--query-forms", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch-questions", type=int, default=40)
+    parser.add_argument("--summary-forms", type=int, default=100)
+    parser.add_argument("--retrieval-forms", type=int, default=200)
+    parser.add_argument("--template-forms", type=int, default=100)
+    parser.add_argument("--verify-forms", type=int, default=500)
+    parser.add_argument("--upload-sizes-mb", nargs="*", type=int, default=[8, 32, 128],
+                        help="File sizes for the upload peak-memory test")
+    parser.add_argument("--retrieval-rows", type=int, default=200000, help="Passages in the large-store search test")
+    parser.add_argument("--llm-latency-ms", type=float, default=20.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=5.0)
+    parser.add_argument("--llm-latency-per-kchar-ms", type=float, default=0.5,
+                        help="Extra fake latency per 1000 prompt characters sent")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions for micro-benchmarks")
+    parser.add_argument("--output", type=Path, help="Result JSON path (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", type=Path, help="Previous result JSON to compare against")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        print(f"Running {name}...")
+        t0 = time.perf_counter()
+        try:
+            results[name] = BENCHMARKS[name](args)
+        except Exception as exc:
+            results[name] = {"error": f"{exc.__class__.__name__}: {exc}"}
+        print(f"  done in {time.perf_counter() - t0:.2f}s: {json.dumps(results[name])[:200]}")
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+    output = args.output or RESULTS_DIR / f"{commit or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(json.loads(args.compare.read_text(encoding="utf-8")), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Synthetic form corpus: deterministic OCR-like text, images and PDFs."""
+
+import io
+import random
+
+FIRST_NAMES = ["Alex", "Priya", "Maria", "John", "Wei", "Fatima", "Carlos", "Aisha", "Liam", "Noor"]
+LAST_NAMES = ["Johnson", "Sharma", "Garcia", "Smith", "Chen", "Khan", "Lopez", "Ahmed", "Brown", "Ali"]
+CITIES = ["Bangalore", "Mumbai", "Delhi", "Chennai", "Pune", "Hyderabad", "Kolkata"]
+FORM_TYPES = ["LOAN APPLICATION FORM", "JOB APPLICATION FORM", "TAX DECLARATION FORM",
+              "INSURANCE CLAIM FORM", "ADMISSION FORM"]
+
+
+def make_form_text(seed, lines_per_page=30, pages=1):
+    """
+    Build OCR-like form text ("Label: value" lines) deterministically from `seed`.
+    Returns a list of page strings.
+    """
+    rng = random.Random(seed)
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    fields = [
+        ("Full Name", name),
+        ("Date of Birth", f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(1960, 2004)}"),
+        ("Address", f"{rng.randint(1, 999)} Park Street, {rng.choice(CITIES)}"),
+        ("Phone", f"+91-{rng.randint(7000000000, 9999999999)}"),
+        ("Email", f"{name.lower().replace(' ', '.')}@example.com"),
+        ("Loan Amount", f"{rng.randint(10, 2000) * 1000}"),
+        ("Application ID", f"APP-{rng.randint(100000, 999999)}"),
+    ]
+    pages_out = []
+    for page_no in range(pages):
+        lines = [rng.choice(FORM_TYPES) if page_no == 0 else f"Page {page_no + 1}", ""]
+        for i in range(lines_per_page):
+            label, value = fields[i % len(fields)]
+            if i >= len(fields):
+                label = f"{label} ({i // len(fields)})"
+            lines.append(f"{label}: {value}")
+        lines.append(f"Signature: {name}")
+        pages_out.append("\n".join(lines))
+    return pages_out
+
+
+def make_form_image(text, width=1240, height=1754, fmt="PNG"):
+    """Render `text` onto a white page image (default A4 at 150 DPI). Returns encoded bytes."""
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    y = 40
+    for line in text.splitlines():
+        draw.text((60, y), line, fill="black")
+        y += 18
+        if y > height - 40:
+            break
+    buf = io.BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def make_form_pdf(pages_text, width=595, height=842):
+    """Build a text PDF with one page per entry of `pages_text` (default A4 in points)."""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for text in pages_text:
+        page = doc.new_page(width=width, height=height)
+        page.insert_text((50, 60), text, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_scanned_pdf(pages_text, width=595, height=842, dpi=150):
+    """Build an image-only PDF ("scan"): each page is a `dpi` bitmap of the text filling the page."""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for text in pages_text:
+        page = doc.new_page(width=width, height=height)
+        image = make_form_image(text, width=int(width * dpi / 72), height=int(height * dpi / 72))
+        page.insert_image(page.rect, stream=image)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_corpus(n, seed=0, kind="text", pages=1, lines_per_page=30):
+    """
+    Generate `n` synthetic forms.
+    kind: "text" (OCR text only), "png" (image bytes), "pdf" (PDF bytes) or
+    "scan" (image-only PDF at 150 DPI).
+    Returns a list of (filename, file_bytes_or_None, ocr_text).
+    """
+    corpus = []
+    for i in range(n):
+        pages_text = make_form_text(seed * 100003 + i, lines_per_page=lines_per_page, pages=pages)
+        text = "\n\n".join(pages_text)
+        if kind == "pdf":
+            corpus.append((f"form_{i:06d}.pdf", make_form_pdf(pages_text), text))
+        elif kind == "scan":
+            corpus.append((f"form_{i:06d}.pdf", make_scanned_pdf(pages_text), text))
+        elif kind == "png":
+            corpus.append((f"form_{i:06d}.png", make_form_image(pages_text[0]), text))
+        else:
+            corpus.append((f"form_{i:06d}.txt", text.encode("utf-8"), text))
+    return corpus
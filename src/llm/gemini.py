@@ -1,10 +1,34 @@
 import os
 import textwrap
-import google.generativeai as genai
-from dotenv import load_dotenv
+import threading
+from contextlib import contextmanager
 
-# Load environment variables
-load_dotenv()
+# google.generativeai and python-dotenv are imported on first use (see _get_genai)
+# so that importing this module stays cheap for code paths that never call the API.
+_genai = None
+_configured_key = None
+_env_loaded = False
+
+
+def _load_env():
+    """Load environment variables from .env once."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def _get_genai(api_key):
+    """Import google.generativeai on first use and (re)configure it for `api_key`."""
+    global _genai, _configured_key
+    if _genai is None:
+        import google.generativeai as genai
+        _genai = genai
+    if api_key != _configured_key:
+        _genai.configure(api_key=api_key)
+        _configured_key = api_key
+    return _genai
 
 # System prompt from Colab notebook - unified system for all query types
 UNIFIED_SYSTEM = textwrap.dedent("""
@@ -66,28 +90,200 @@ Return EXACT JSON:
 Keep the summary clear and focused on the most important information.
 """).strip()
 
+SUMMARY_MERGE_SYSTEM = textwrap.dedent("""
+You are a form summarization assistant. You will be given several JSON summaries, each
+describing one form or a group of forms, labeled with their source.
+
+Merge them into ONE summary of the whole collection:
+- Overall purpose / form types present
+- Key information across forms (names, dates, amounts, identifiers), with their source labels
+- Notable patterns, differences or outliers between forms
+- Missing or incomplete information (keep the source label in each warning)
+
+Use ONLY the provided summaries. Do NOT invent information.
+
+Return EXACT JSON:
+{
+  "summary": "<concise summary of the collection (2-5 sentences)>",
+  "key_fields": {
+    "<field_name>": "<value, or values with source labels, or null>",
+    ...
+  },
+  "warnings": ["<list of missing or incomplete items>"],
+  "form_type": "<type(s) of form or null>"
+}
+""").strip()
+
+
+# Optional replacement backend (e.g. an offline fake for benchmarks).
+# When set, call_gemini forwards every call to it instead of the Gemini API.
+_backend = None
+
+
+def set_backend(backend):
+    """
+    Route call_gemini through `backend` (a callable with call_gemini's signature).
+    Pass None to restore the real Gemini API. Returns the previous backend.
+    """
+    global _backend
+    previous = _backend
+    _backend = backend
+    return previous
+
+
+def get_backend():
+    """The backend installed with set_backend, or None for the real Gemini API."""
+    return _backend
+
+
+# Per-thread request nesting depth (request_scope) and token usage of the last call
+_local = threading.local()
+
+
+@contextmanager
+def request_scope(kind, **inputs):
+    """
+    Mark the calls made inside the block as one request of entry point `kind`
+    (e.g. "unified_form_query") with the given inputs. Backends that record
+    traffic (see src/llm/replay.py) log it so the request can be replayed;
+    others ignore it. Nested scopes (a batch falling back to single questions)
+    belong to the outermost one.
+    """
+    depth = getattr(_local, "depth", 0)
+    begin = getattr(_backend, "begin_request", None) if depth == 0 else None
+    if begin is not None:
+        begin(kind, **inputs)
+    _local.depth = depth + 1
+    try:
+        yield
+    finally:
+        _local.depth = depth
+        end = getattr(_backend, "end_request", None) if depth == 0 else None
+        if end is not None:
+            end()
+
+
+def last_usage():
+    """
+    Token counts of this thread's last real API call: {"prompt_tokens",
+    "output_tokens", "cached_tokens"}, or None if the response had no usage data.
+    """
+    return getattr(_local, "usage", None)
+
+
+def _usage_of(resp):
+    meta = getattr(resp, "usage_metadata", None)
+    if meta is None:
+        return None
+    try:
+        return {"prompt_tokens": int(getattr(meta, "prompt_token_count", 0) or 0),
+                "output_tokens": int(getattr(meta, "candidates_token_count", 0) or 0),
+                "cached_tokens": int(getattr(meta, "cached_content_token_count", 0) or 0)}
+    except (TypeError, ValueError):
+        return None
+
+
+# Explicit context caching only pays off (and is only accepted by the API) above a
+# minimum prompt size; smaller prefixes rely on the provider's implicit prefix cache.
+CACHE_MIN_CHARS = 4096
+
+
+def create_cached_context(system_prompt, static_prompt, model="gemini-flash-lite-latest",
+                          ttl_seconds=3600):
+    """
+    Upload a stable prompt prefix (system prompt + static user content) as cached content.
+    Returns a cache handle to pass as call_gemini(..., cached_content=...), or None when
+    the prefix is too small or the model/provider does not support explicit caching.
+    """
+    if _backend is not None:
+        create = getattr(_backend, "create_cached_context", None)
+        return create(system_prompt, static_prompt, model=model, ttl_seconds=ttl_seconds) if create else None
+    return _create_cached_context_api(system_prompt, static_prompt, model=model, ttl_seconds=ttl_seconds)
+
+
+def _create_cached_context_api(system_prompt, static_prompt, model="gemini-flash-lite-latest",
+                               ttl_seconds=3600):
+    """create_cached_context against the Gemini API, ignoring any backend."""
+    if len(system_prompt) + len(static_prompt) < CACHE_MIN_CHARS:
+        return None
+    _load_env()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY not found in environment variables. Please set it in .env file.")
+    try:
+        genai = _get_genai(api_key)
+        cache = genai.caching.CachedContent.create(
+            model=model,
+            system_instruction=system_prompt,
+            contents=[static_prompt],
+            ttl=ttl_seconds,
+        )
+        return cache.name
+    except Exception as exc:
+        print(f"[create_cached_context] Explicit caching unavailable -> {exc}")
+        return None
+
+
+def delete_cached_context(cached_content):
+    """Delete cached content created by create_cached_context (errors are ignored)."""
+    if not cached_content:
+        return
+    if _backend is not None:
+        delete = getattr(_backend, "delete_cached_context", None)
+        if delete:
+            delete(cached_content)
+        return
+    _delete_cached_context_api(cached_content)
+
+
+def _delete_cached_context_api(cached_content):
+    """delete_cached_context against the Gemini API, ignoring any backend."""
+    try:
+        _load_env()
+        genai = _get_genai(os.getenv("GOOGLE_API_KEY"))
+        genai.caching.CachedContent.get(cached_content).delete()
+    except Exception:
+        pass
 
 
 def call_gemini(system_prompt, user_prompt, model="gemini-flash-lite-latest",
-                max_output_tokens=1024, retries=1, truncate_to=3000):
+                max_output_tokens=1024, retries=1, truncate_to=3000, cached_content=None):
     """
     Robust replacement for the Gemini call in Colab - extracted from notebook.
     - Returns a string: the model text on success, or a JSON-stringified error object on failure.
     - Keeps same simple call shape so you can drop it in place of your old function.
+    - cached_content: handle from create_cached_context; the system prompt and static
+      prefix are then served from the cache and only user_prompt is sent.
     """
+    if _backend is not None:
+        return _backend(system_prompt, user_prompt, model=model,
+                        max_output_tokens=max_output_tokens, retries=retries,
+                        truncate_to=truncate_to, cached_content=cached_content)
+    return _call_api(system_prompt, user_prompt, model=model, max_output_tokens=max_output_tokens,
+                     retries=retries, truncate_to=truncate_to, cached_content=cached_content)
+
+
+def _call_api(system_prompt, user_prompt, model="gemini-flash-lite-latest",
+              max_output_tokens=1024, retries=1, truncate_to=3000, cached_content=None):
+    """call_gemini against the Gemini API, ignoring any backend (see call_gemini)."""
     import json
     import time
-    
+
+    _local.usage = None
+    _load_env()
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         raise ValueError("GOOGLE_API_KEY not found in environment variables. Please set it in .env file.")
     
-    genai.configure(api_key=api_key)
-    prompt_full = system_prompt + "\n\n" + user_prompt
+    genai = _get_genai(api_key)
+    prompt_full = user_prompt if cached_content else system_prompt + "\n\n" + user_prompt
 
     for attempt in range(retries + 1):
         try:
-            model_instance = genai.GenerativeModel(model_name=model)
+            if cached_content:
+                model_instance = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+            else:
+                model_instance = genai.GenerativeModel(model_name=model)
             # On retry, optionally send a truncated prompt to reduce safety/token issues
             send_prompt = prompt_full if attempt == 0 else prompt_full[:truncate_to]
 
@@ -98,6 +294,7 @@ def call_gemini(system_prompt, user_prompt, model="gemini-flash-lite-latest",
                     max_output_tokens=max_output_tokens
                 )
             )
+            _local.usage = _usage_of(resp)
 
             # 1) Preferred fast accessor (may raise if no Part present)
             try:
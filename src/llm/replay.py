@@ -0,0 +1,431 @@
+"""
+Record and replay LLM traffic.
+
+Recording wraps call_gemini (install with record(), or set GEMINI_RECORD_PATH
+for the app) and appends every call to a JSON-lines log: model, config,
+prompts, response, latency and token usage. Entry points open a
+gemini.request_scope(), so the log also holds the inputs of every
+unified_form_query, FormQuerySession.ask, batch_form_query and
+summarize_forms request, and which calls each one made.
+
+Replay (`python -m src.llm.replay LOG`) re-runs those requests against a
+backend that answers each call from the log, at full speed and without
+network, and reports parse success rate, tokens per request and stage
+timings. Prompt or parser changes can then be measured against real traffic:
+calls whose prompt changed are not in the log and are counted as misses.
+Summaries served from the summary cache while recording made no calls, so
+record with an empty SUMMARY_CACHE_DIR to replay the summary path fully.
+
+Log lines (a ".gz" path is gzip-compressed):
+    {"t": "text", "id", "v"}                  a prompt or OCR text, stored once
+    {"t": "request", "seq", "kind", "inputs"}  an entry point and its inputs
+    {"t": "cache", "digest"}                   a provider cache was created
+    {"t": "call", "key", "seq", "model", "max_output_tokens", "system", "user",
+     "cache", "response", "ms", "usage"}
+Texts are referenced by id. A user prompt is logged as [id of the part before
+its question, question part], so forms sent with every question are logged once.
+"""
+
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+
+from . import gemini
+
+RECORD_ENV = "GEMINI_RECORD_PATH"
+CHARS_PER_TOKEN = 4  # token estimate for calls logged without usage data
+_CACHE_HANDLE = "replay:"
+_QUESTION_MARKER = "---QUESTION"
+
+
+def _open(path, mode):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _text_id(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:20]
+
+
+def cache_digest(system_prompt, static_prompt):
+    """Identity of a cached prompt prefix (provider handles differ between runs)."""
+    return _text_id(system_prompt + "\0" + static_prompt)
+
+
+def call_key(model, max_output_tokens, system_prompt, user_prompt, cache=None):
+    """Replay lookup key of a call: everything that determines the response."""
+    return hashlib.sha256(json.dumps([model, max_output_tokens, system_prompt, user_prompt, cache])
+                          .encode("utf-8")).hexdigest()[:32]
+
+
+class Recorder:
+    """
+    Backend (see gemini.set_backend) that logs every call to `path` and forwards
+    it to `inner`: the previously installed backend, or the Gemini API when None.
+    """
+
+    def __init__(self, path, inner=None):
+        self.path = str(path)
+        self.inner = inner
+        self._lock = threading.Lock()
+        self._texts = set()
+        self._caches = {}
+        self._seq = 0
+        if os.path.exists(self.path):
+            for entry in read_log(self.path):
+                if entry["t"] == "text":
+                    self._texts.add(entry["id"])
+                elif entry["t"] == "request":
+                    self._seq = max(self._seq, entry["seq"])
+        # Current request seq per thread (request scopes are per thread, see gemini.request_scope)
+        self._local = threading.local()
+        self._file = _open(self.path, "a")
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _write(self, entries):
+        """Append entries and flush, so a crash loses at most the line being written."""
+        for entry in entries:
+            self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def _ref(self, text, out):
+        """Id of `text`, queueing a text line the first time it is seen."""
+        text_id = _text_id(text)
+        if text_id not in self._texts:
+            self._texts.add(text_id)
+            out.append({"t": "text", "id": text_id, "v": text})
+        return text_id
+
+    def _prompt_ref(self, prompt, out):
+        """[prefix id, question part] of a prompt with a question marker, else a plain text id."""
+        cut = prompt.rfind(_QUESTION_MARKER)
+        if cut <= 0:
+            return self._ref(prompt, out)
+        return [self._ref(prompt[:cut], out), prompt[cut:]]
+
+    def begin_request(self, kind, forms_dict=None, **inputs):
+        logged = dict(inputs)
+        with self._lock:
+            out = []
+            if forms_dict is not None:
+                logged["forms"] = [[str(name), self._ref(text, out)] for name, text in forms_dict.items()]
+            self._seq += 1
+            self._local.request = self._seq
+            out.append({"t": "request", "seq": self._seq, "kind": kind, "inputs": logged, "ts": time.time()})
+            self._write(out)
+        begin = getattr(self.inner, "begin_request", None)
+        if begin is not None:
+            begin(kind, forms_dict=forms_dict, **inputs)
+
+    def end_request(self):
+        self._local.request = None
+        end = getattr(self.inner, "end_request", None)
+        if end is not None:
+            end()
+
+    def create_cached_context(self, system_prompt, static_prompt, **kwargs):
+        if self.inner is None:
+            handle = gemini._create_cached_context_api(system_prompt, static_prompt, **kwargs)
+        else:
+            create = getattr(self.inner, "create_cached_context", None)
+            handle = create(system_prompt, static_prompt, **kwargs) if create else None
+        if handle:
+            digest = cache_digest(system_prompt, static_prompt)
+            with self._lock:
+                self._caches[handle] = digest
+                self._write([{"t": "cache", "digest": digest}])
+        return handle
+
+    def delete_cached_context(self, cached_content):
+        if self.inner is None:
+            gemini._delete_cached_context_api(cached_content)
+        else:
+            delete = getattr(self.inner, "delete_cached_context", None)
+            if delete:
+                delete(cached_content)
+
+    def __call__(self, system_prompt, user_prompt, model="gemini-flash-lite-latest",
+                 max_output_tokens=1024, cached_content=None, **kwargs):
+        t0 = time.perf_counter()
+        if self.inner is None:
+            response = gemini._call_api(system_prompt, user_prompt, model=model,
+                                        max_output_tokens=max_output_tokens,
+                                        cached_content=cached_content, **kwargs)
+            usage = gemini.last_usage()
+        else:
+            response = self.inner(system_prompt, user_prompt, model=model,
+                                  max_output_tokens=max_output_tokens, cached_content=cached_content, **kwargs)
+            usage = None
+        ms = (time.perf_counter() - t0) * 1000.0
+        with self._lock:
+            cache = self._caches.get(cached_content) if cached_content else None
+            out = []
+            entry = {"t": "call", "key": call_key(model, max_output_tokens, system_prompt, user_prompt, cache),
+                     "seq": getattr(self._local, "request", None), "model": model, "max_output_tokens": max_output_tokens,
+                     "system": self._ref(system_prompt, out), "user": self._prompt_ref(user_prompt, out),
+                     "cache": cache, "response": response, "ms": round(ms, 2), "usage": usage}
+            self._write(out + [entry])
+        return response
+
+
+def record(path):
+    """Start logging all calls to `path` (wrapping the current backend). Returns the Recorder."""
+    recorder = Recorder(path, inner=gemini.get_backend())
+    gemini.set_backend(recorder)
+    atexit.register(recorder.close)
+    return recorder
+
+
+def stop_recording(recorder):
+    """Close `recorder`'s log and restore the backend it wrapped."""
+    recorder.close()
+    if gemini.get_backend() is recorder:
+        gemini.set_backend(recorder.inner)
+
+
+def record_from_env():
+    """record() to $GEMINI_RECORD_PATH if it is set and not already recording; returns the Recorder or None."""
+    path = os.getenv(RECORD_ENV)
+    if not path or isinstance(gemini.get_backend(), Recorder):
+        return None
+    return record(path)
+
+
+def read_log(path):
+    """Yield the log's entries; a torn last line (crash while recording) is skipped."""
+    with _open(path, "r") as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        except EOFError:
+            return  # gzip log of a recorder that never closed: flushed lines are all there
+
+
+class Log:
+    """A loaded log: texts by id, requests in order, and calls grouped by request."""
+
+    def __init__(self, path):
+        self.texts = {}
+        self.requests = []
+        self.calls = []
+        self.caches = set()
+        for entry in read_log(path):
+            kind = entry["t"]
+            if kind == "text":
+                self.texts[entry["id"]] = entry["v"]
+            elif kind == "request":
+                self.requests.append(entry)
+            elif kind == "call":
+                self.calls.append(entry)
+            elif kind == "cache":
+                self.caches.add(entry["digest"])
+        self.calls_by_request = defaultdict(list)
+        for call in self.calls:
+            self.calls_by_request[call.get("seq")].append(call)
+
+    def text(self, ref):
+        """A logged text from its id or [prefix id, tail] reference."""
+        if isinstance(ref, list):
+            return self.texts[ref[0]] + ref[1]
+        return self.texts[ref]
+
+    def forms(self, request):
+        return {name: self.texts[text_id] for name, text_id in request["inputs"].get("forms", [])}
+
+
+def call_tokens(call, log):
+    """(prompt_tokens, output_tokens, estimated) of a logged call."""
+    usage = call.get("usage")
+    if usage:
+        return usage["prompt_tokens"], usage["output_tokens"], False
+    sent = len(log.text(call["user"]))
+    if not call.get("cache"):
+        sent += len(log.text(call["system"]))
+    return sent // CHARS_PER_TOKEN, len(call["response"]) // CHARS_PER_TOKEN, True
+
+
+class Replayer:
+    """
+    Backend that answers calls from a Log. Repeated identical calls get the
+    recorded responses in order (the last one is reused once they run out).
+    Unknown calls return an error JSON and are counted in `misses`.
+    With `realtime`, each answer waits for the recorded latency.
+    """
+
+    def __init__(self, log, realtime=False):
+        self.realtime = realtime
+        self.caches = log.caches
+        self.misses = 0
+        self.calls = 0
+        self._answers = defaultdict(deque)
+        for call in log.calls:
+            self._answers[call["key"]].append(call)
+
+    def create_cached_context(self, system_prompt, static_prompt, **kwargs):
+        digest = cache_digest(system_prompt, static_prompt)
+        return _CACHE_HANDLE + digest if digest in self.caches else None
+
+    def __call__(self, system_prompt, user_prompt, model="gemini-flash-lite-latest",
+                 max_output_tokens=1024, cached_content=None, **kwargs):
+        self.calls += 1
+        cache = cached_content[len(_CACHE_HANDLE):] if cached_content else None
+        answers = self._answers.get(call_key(model, max_output_tokens, system_prompt, user_prompt, cache))
+        if not answers:
+            self.misses += 1
+            return json.dumps({"error": "replay_miss"})
+        call = answers.popleft() if len(answers) > 1 else answers[0]
+        if self.realtime:
+            time.sleep(call["ms"] / 1000.0)
+        return call["response"]
+
+
+def _run_request(log, request, sessions):
+    """Re-run one logged request; returns True if its output parsed."""
+    from ..qa.batch import batch_form_query
+    from ..qa.summary import summarize_forms
+    from ..qa.unified import FormQuerySession, unified_form_query
+
+    inputs = dict(request["inputs"])
+    inputs.pop("forms", None)
+    forms = log.forms(request)
+    kind = request["kind"]
+    if kind == "unified_form_query":
+        return bool(unified_form_query(forms, **inputs).get("success"))
+    if kind == "session_ask":
+        question = inputs.pop("question")
+        max_output_tokens = inputs.pop("max_output_tokens", None)
+        key = (json.dumps(request["inputs"].get("forms")), json.dumps(inputs, sort_keys=True))
+        if key not in sessions:
+            sessions[key] = FormQuerySession(forms, use_templates=False, **inputs)
+        return bool(sessions[key].ask(question, max_output_tokens=max_output_tokens).get("success"))
+    if kind == "batch_form_query":
+        session = FormQuerySession(forms, model=inputs.pop("model"),
+                                   per_file_char_limit=inputs.pop("per_file_char_limit"),
+                                   max_output_tokens=inputs.pop("session_max_output_tokens"),
+                                   use_provider_cache=inputs.pop("use_provider_cache"), use_templates=False)
+        results = batch_form_query(forms, inputs.pop("questions"), session=session, **inputs)
+        return all(result.get("success") for result in results)
+    if kind == "summarize_forms":
+        result = summarize_forms(forms, **inputs)
+        return not result.get("raw") and not any(f.get("raw") for f in result.get("forms", []))
+    raise ValueError(f"unknown request kind: {kind}")
+
+
+def _summary(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {"mean": round(statistics.fmean(ordered), 3), "p50": round(ordered[len(ordered) // 2], 3),
+            "p90": round(ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))], 3),
+            "max": round(ordered[-1], 3)}
+
+
+def replay(path, realtime=False, per_request=False):
+    """
+    Re-run every request in the log at `path` against its recorded responses.
+    Template answers and the summary cache are bypassed (a temporary summary
+    cache is used) so each request reaches the LLM path as when it was recorded.
+    Returns a report: per request kind the parse success rate (over requests
+    whose calls were all in the log), tokens per request, recorded LLM latency
+    and replayed stage timings (ms), plus misses.
+    """
+    import tempfile
+    from pathlib import Path
+
+    from ..qa import summary, unified
+
+    log = Log(path)
+    replayer = Replayer(log, realtime=realtime)
+    previous = gemini.set_backend(replayer)
+    previous_cache_dir = summary.SUMMARY_CACHE_DIR
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="replay_summary_") as tmp:
+            summary.SUMMARY_CACHE_DIR = Path(tmp)
+            unified.clear_forms_contexts()
+            sessions = {}
+            for request in log.requests:
+                unified.reset_stage_stats()
+                misses = replayer.misses
+                t0 = time.perf_counter()
+                ok = _run_request(log, request, sessions)
+                total_ms = (time.perf_counter() - t0) * 1000.0
+                stats = unified.get_stage_stats()
+                recorded = log.calls_by_request.get(request["seq"], [])
+                tokens = [call_tokens(call, log) for call in recorded]
+                rows.append({
+                    "seq": request["seq"], "kind": request["kind"], "parsed": ok,
+                    "misses": replayer.misses - misses, "llm_calls": stats["llm_calls"],
+                    "recorded_calls": len(recorded),
+                    "prompt_tokens": sum(t[0] for t in tokens), "output_tokens": sum(t[1] for t in tokens),
+                    "tokens_estimated": any(t[2] for t in tokens),
+                    "recorded_llm_ms": round(sum(call["ms"] for call in recorded), 2),
+                    "stages_ms": {name: round(stats[name + "_s"] * 1000.0, 3)
+                                  for name in ("prompt", "llm", "parse", "verify")},
+                    "total_ms": round(total_ms, 3),
+                })
+    finally:
+        unified.clear_forms_contexts()
+        summary.SUMMARY_CACHE_DIR = previous_cache_dir
+        gemini.set_backend(previous)
+
+    report = {"requests": len(rows), "llm_calls": replayer.calls, "misses": replayer.misses,
+              "unattributed_calls": len(log.calls_by_request.get(None, [])), "by_kind": {}}
+    for kind in sorted({row["kind"] for row in rows}):
+        group = [row for row in rows if row["kind"] == kind]
+        # Requests with missing calls got placeholder answers: leave them out of the parse rate
+        replayed = [row for row in group if not row["misses"]]
+        report["by_kind"][kind] = {
+            "requests": len(group),
+            "replayed": len(replayed),
+            "parse_success_rate": (round(sum(row["parsed"] for row in replayed) / len(replayed), 4)
+                                   if replayed else None),
+            "misses": sum(row["misses"] for row in group),
+            "prompt_tokens": _summary([row["prompt_tokens"] for row in group]),
+            "output_tokens": _summary([row["output_tokens"] for row in group]),
+            "tokens_estimated": any(row["tokens_estimated"] for row in group),
+            "recorded_llm_ms": _summary([row["recorded_llm_ms"] for row in group]),
+            "stages_ms": {name: _summary([row["stages_ms"][name] for row in group])
+                          for name in ("prompt", "llm", "parse", "verify")},
+            "total_ms": _summary([row["total_ms"] for row in group]),
+        }
+    if per_request:
+        report["per_request"] = rows
+    return report
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay a recorded LLM log offline and report "
+                                                 "parse success, tokens and stage timings.")
+    parser.add_argument("log", help="Log written while recording (GEMINI_RECORD_PATH or replay.record())")
+    parser.add_argument("--realtime", action="store_true", help="Wait for the recorded latency of each call")
+    parser.add_argument("--per-request", action="store_true", help="Include one row per request")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = json.dumps(replay(args.log, realtime=args.realtime, per_request=args.per_request), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,173 @@
+import hashlib
 import io
-import fitz  # PyMuPDF
-from PIL import Image
-import pytesseract
+import json
+import math
+import time
+import zlib
+from pathlib import Path
 
+from ..utils import blobstore
+
+# fitz (PyMuPDF), PIL and pytesseract are imported inside the functions that need
+# them, so importing this module does not pay their start-up cost.
+
+# PDF pages are rendered at TARGET_DPI, but never above the resolution of a
+# full-page scan embedded in the page (upscaling a scan adds no detail), never
+# below MIN_DPI, and never above MAX_RENDER_PIXELS for huge pages.
+TARGET_DPI = 200
+MIN_DPI = 100
+MAX_RENDER_PIXELS = 24_000_000
+# Embedded images covering at least this fraction of the page count as the scan
+SCAN_COVERAGE = 0.5
+
+# Optional cache of rendered grayscale pages, keyed by (file hash, page, dpi);
+# set to a directory (e.g. Path("data/raster_cache")) to enable. Entries are a
+# JSON header line plus zlib-compressed 8-bit pixels, which load several times
+# faster than PNG; the adaptive DPI chosen for a page is cached too, so a hit
+# does not open the PDF at all.
+RASTER_CACHE_DIR = None
+
+# Pages OCR'd per file by ocr_path(); None streams every page, one at a time
+MAX_PAGES = 1
+
+# Legacy rendering (fixed zoom 2.0, RGB), used as the baseline for bytes saved
+_LEGACY_ZOOM = 2.0
+
+_render_stats = {"pages": 0, "renders": 0, "cache_hits": 0, "render_s": 0.0,
+                 "bitmap_bytes": 0, "bytes_saved": 0}
+
+
+def get_render_stats():
+    """
+    Counters since the last reset: pages requested, actual renders, cache hits,
+    render_s (seconds rasterizing or loading from cache), bitmap_bytes produced,
+    and bytes_saved versus the old fixed zoom=2.0 RGB bitmaps.
+    """
+    return dict(_render_stats)
+
+
+def reset_render_stats():
+    for key in _render_stats:
+        _render_stats[key] = 0.0 if key == "render_s" else 0
+
+
+def page_dpi(page, target_dpi=TARGET_DPI):
+    """Effective render DPI for a PyMuPDF page (see TARGET_DPI)."""
+    rect = page.rect
+    page_area = max(rect.width * rect.height, 1.0)
+    dpi = float(target_dpi)
+
+    # Scanned pages: don't render beyond the scan's own resolution
+    scan_dpi = None
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        w_pt, h_pt = abs(x1 - x0), abs(y1 - y0)
+        if w_pt * h_pt < SCAN_COVERAGE * page_area or not info.get("width") or not info.get("height"):
+            continue
+        native = min(info["width"] / (w_pt / 72.0), info["height"] / (h_pt / 72.0))
+        scan_dpi = max(scan_dpi or 0.0, native)
+    if scan_dpi:
+        dpi = min(dpi, scan_dpi)
+    dpi = max(dpi, MIN_DPI)
+
+    # Huge pages: cap the bitmap size
+    max_dpi = 72.0 * math.sqrt(MAX_RENDER_PIXELS / page_area)
+    return int(round(min(dpi, max_dpi)))
+
+
+def _cache_path(cache_dir, file_sha, page_no, dpi):
+    return Path(cache_dir) / file_sha[:2] / f"{file_sha}-p{page_no}-{dpi}.gray"
+
+
+def _cache_get(cache_dir, file_sha, page_no, dpi):
+    """(image, header) from the raster cache, or None. dpi=None looks up the adaptive DPI."""
+    from PIL import Image
+
+    try:
+        if dpi is None:
+            dpi = int(_cache_path(cache_dir, file_sha, page_no, f"auto{TARGET_DPI}").read_text())
+        with open(_cache_path(cache_dir, file_sha, page_no, dpi), "rb") as f:
+            header = json.loads(f.readline())
+            pixels = zlib.decompress(f.read())
+        return Image.frombytes("L", (header["width"], header["height"]), pixels), header
+    except (OSError, ValueError, KeyError, zlib.error):
+        return None
+
+
+def _cache_put(cache_dir, file_sha, page_no, img, header, auto):
+    header_line = json.dumps(header).encode("utf-8") + b"\n"
+    blobstore.write_atomic(_cache_path(cache_dir, file_sha, page_no, header["dpi"]),
+                           header_line + zlib.compress(img.tobytes(), 1), durable=False)
+    if auto:
+        blobstore.write_atomic(_cache_path(cache_dir, file_sha, page_no, f"auto{TARGET_DPI}"),
+                               str(header["dpi"]), durable=False)
+
+
+def render_pdf_page(pdf_bytes, page_no=0, dpi=None, cache_dir=None, doc=None, file_sha=None):
+    """
+    Render one PDF page as a grayscale PIL.Image ("L").
+    - dpi: fixed render DPI (default: page_dpi() of the page)
+    - cache_dir: raster cache directory (default: RASTER_CACHE_DIR; None disables)
+    - doc: an already opened fitz document for `pdf_bytes` (avoids re-parsing);
+      with doc and file_sha, pdf_bytes may be None (e.g. a document opened by path)
+    - file_sha: SHA-256 of the file, used as the cache key (default: hash of pdf_bytes)
+    Returns (image, info) with info = {"dpi", "width", "height", "render_ms", "cached"}.
+    """
+    t0 = time.perf_counter()
+    cache_dir = RASTER_CACHE_DIR if cache_dir is None else cache_dir
+    if cache_dir and file_sha is None:
+        if pdf_bytes is None:
+            raise ValueError("render_pdf_page needs file_sha for the raster cache when pdf_bytes is None")
+        file_sha = hashlib.sha256(pdf_bytes).hexdigest()
+    hit = _cache_get(cache_dir, file_sha, page_no, dpi) if cache_dir else None
+    if hit is not None:
+        img, header = hit
+    else:
+        import fitz  # PyMuPDF
+        from PIL import Image
+
+        own_doc = doc is None
+        if own_doc:
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            page = doc.load_page(page_no)
+            render_dpi = int(dpi or page_dpi(page))
+            zoom = render_dpi / 72.0
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+            img = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+            pix = None  # frombytes copied the samples; drop MuPDF's buffer now
+            header = {"dpi": render_dpi, "width": img.width, "height": img.height,
+                      "page_width": page.rect.width, "page_height": page.rect.height}
+        finally:
+            if own_doc:
+                doc.close()
+        if cache_dir:
+            _cache_put(cache_dir, file_sha, page_no, img, header, auto=dpi is None)
+
+    elapsed = time.perf_counter() - t0
+    bitmap_bytes = img.width * img.height
+    legacy_bytes = int(header["page_width"] * _LEGACY_ZOOM) * int(header["page_height"] * _LEGACY_ZOOM) * 3
+    _render_stats["pages"] += 1
+    _render_stats["cache_hits" if hit is not None else "renders"] += 1
+    _render_stats["render_s"] += elapsed
+    _render_stats["bitmap_bytes"] += bitmap_bytes
+    _render_stats["bytes_saved"] += legacy_bytes - bitmap_bytes
+    return img, {"dpi": header["dpi"], "width": img.width, "height": img.height,
+                 "render_ms": round(elapsed * 1000.0, 3), "cached": hit is not None}
+
+
+def pdf_first_page_to_pil(pdf_bytes, zoom=None):
+    """
+    Convert first page of PDF to PIL.Image (if PDF) - from notebook.
+    With `zoom`, renders RGB at that fixed zoom as before; otherwise grayscale at
+    the adaptive DPI (see render_pdf_page).
+    """
+    if zoom is None:
+        return render_pdf_page(pdf_bytes, 0)[0]
+
+    import fitz  # PyMuPDF
+    from PIL import Image
 
-def pdf_first_page_to_pil(pdf_bytes, zoom=2.0):
-    """Convert first page of PDF to PIL.Image (if PDF) - from notebook."""
     doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     page = doc.load_page(0)
     mat = fitz.Matrix(zoom, zoom)
@@ -26,6 +188,9 @@ def ocr_file(file_bytes: bytes, filename: str) -> str:
     Returns:
         Extracted text as a string
     """
+    from PIL import Image
+    import pytesseract
+
     # detect pdf by extension
     if filename.lower().endswith(".pdf"):
         img = pdf_first_page_to_pil(file_bytes)
@@ -35,3 +200,59 @@ def ocr_file(file_bytes: bytes, filename: str) -> str:
     text = pytesseract.image_to_string(img, lang='eng')
     return text
 
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def iter_page_images(path, filename, max_pages=MAX_PAGES, file_sha=None, cache_dir=None):
+    """
+    Yield page images of the file at `path` one at a time, so memory holds one
+    page bitmap rather than the whole file. PDFs are opened by path (MuPDF reads
+    the file on demand) and its decoded-image store is trimmed after each page;
+    images are read frame by frame (multi-page TIFFs). `max_pages=None` yields all.
+    With the raster cache on, `file_sha` is the cache key (hashed from `path` if None).
+    """
+    from PIL import Image
+
+    if filename.lower().endswith(".pdf"):
+        import fitz  # PyMuPDF
+
+        cache_dir = RASTER_CACHE_DIR if cache_dir is None else cache_dir
+        if cache_dir and file_sha is None:
+            file_sha = file_sha256(path)
+        with fitz.open(path, filetype="pdf") as doc:
+            count = doc.page_count if max_pages is None else min(doc.page_count, max_pages)
+            for page_no in range(count):
+                img, _ = render_pdf_page(None, page_no, cache_dir=cache_dir, doc=doc, file_sha=file_sha)
+                fitz.TOOLS.store_shrink(100)
+                yield img
+                img.close()
+        return
+
+    with Image.open(path) as im:
+        count = getattr(im, "n_frames", 1)
+        count = count if max_pages is None else min(count, max_pages)
+        for frame in range(count):
+            im.seek(frame)
+            img = im.convert("RGB")
+            yield img
+            img.close()
+
+
+def ocr_path(path, filename, max_pages=MAX_PAGES, file_sha=None):
+    """
+    Like ocr_file(), but reads the file from disk page by page (see
+    iter_page_images), so peak memory does not grow with the file size.
+    Page texts are joined with form feeds.
+    """
+    import pytesseract
+
+    texts = [pytesseract.image_to_string(img, lang='eng')
+             for img in iter_page_images(path, filename, max_pages, file_sha)]
+    return "\f".join(texts)
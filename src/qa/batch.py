@@ -0,0 +1,206 @@
+"""
+Batched multi-question queries over one form set.
+
+A checklist of N questions is packed into as few calls as the output token
+budget allows. All calls share the same cached forms prefix (see
+FormQuerySession); each call asks for one result slot per question id, and the
+slots are split back into per-question results with the usual provenance shape.
+
+CLI:
+    python -m src.qa.batch questions.txt [--forms FORM_ID ...] [--output results.json]
+"""
+
+import argparse
+import json
+import sys
+
+from ..llm.gemini import request_scope
+from .unified import FormQuerySession
+
+BATCH_INSTRUCTIONS = """BATCH MODE: Answer EVERY question above independently, using the output schema
+from the system prompt for each answer (single-form object or multi-form array).
+Return ONE JSON object inside the <JSON> markers, with exactly one entry per question id:
+{"answers": [ {"id": "<question id>", "result": <answer object or array>}, ... ]}"""
+
+# call_gemini errors that smaller batches cannot fix (the call itself failed after its retries)
+API_ERRORS = {"exception_calling_api", "unknown_failure"}
+
+
+def _estimate_tokens(text):
+    """Rough token estimate (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def plan_batches(questions, max_output_tokens=8192, tokens_per_answer=256, max_questions_per_call=25):
+    """
+    Split question indices into batches that fit the output token budget.
+    Each question reserves `tokens_per_answer` output tokens (plus its own length,
+    since answers often echo the question). Returns a list of index lists.
+    """
+    batches = []
+    current = []
+    used = 0
+    for idx, question in enumerate(questions):
+        cost = tokens_per_answer + _estimate_tokens(question)
+        if current and (used + cost > max_output_tokens or len(current) >= max_questions_per_call):
+            batches.append(current)
+            current, used = [], 0
+        current.append(idx)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _build_batch_prompt(questions, indices):
+    lines = [f"[Q{idx + 1}] {questions[idx]}" for idx in indices]
+    return "---QUESTIONS---\n" + "\n".join(lines) + "\n\n" + BATCH_INSTRUCTIONS + "\n"
+
+
+def _split_answers(parsed, indices):
+    """
+    Map a parsed batch reply to {question_index: result}.
+    Accepts {"answers": [...]} or a bare list of {"id", "result"} entries.
+    """
+    result = parsed.get("result") if parsed.get("success") else None
+    if isinstance(result, dict):
+        result = result.get("answers")
+    if not isinstance(result, list):
+        return {}
+    wanted = {f"Q{idx + 1}": idx for idx in indices}
+    answers = {}
+    for entry in result:
+        if not isinstance(entry, dict):
+            continue
+        qid = str(entry.get("id", "")).strip().strip("[]").upper()
+        if qid in wanted and "result" in entry:
+            answers[wanted[qid]] = entry["result"]
+    return answers
+
+
+def _api_error(parsed):
+    """The error name if `parsed` is a failed API call rather than a model reply, else None."""
+    result = parsed.get("result") if parsed.get("success") else None
+    if isinstance(result, dict) and result.get("error") in API_ERRORS:
+        return result["error"]
+    return None
+
+
+def _run_batch(session, questions, indices, tokens_per_answer, results):
+    """
+    Run one batch; split it in half (down to single questions) if the reply is
+    malformed or incomplete. A failed API call fails the whole batch unsplit.
+    """
+    budget = sum(tokens_per_answer + _estimate_tokens(questions[i]) for i in indices)
+    if len(indices) == 1:
+        idx = indices[0]
+        res = session.ask(questions[idx], max_output_tokens=max(budget, session.max_output_tokens))
+        results[idx] = dict(res, question=questions[idx])
+        return
+
+    parsed = session.query(_build_batch_prompt(questions, indices), max_output_tokens=budget)
+    if _api_error(parsed):
+        for idx in indices:
+            results[idx] = dict(parsed, question=questions[idx])
+        return
+    answers = _split_answers(parsed, indices)
+    missing = [idx for idx in indices if idx not in answers]
+    for idx, answer in answers.items():
+        results[idx] = session.verify({"success": True, "result": answer, "raw": parsed.get("raw"),
+                                       "question": questions[idx]})
+        session.learn(questions[idx], results[idx])
+    if missing:
+        if len(missing) == len(indices):
+            # Nothing usable (truncated or malformed reply): retry in two halves
+            half = len(missing) // 2
+            _run_batch(session, questions, missing[:half], tokens_per_answer, results)
+            _run_batch(session, questions, missing[half:], tokens_per_answer, results)
+        else:
+            _run_batch(session, questions, missing, tokens_per_answer, results)
+
+
+def batch_form_query(forms_dict, questions, model="gemini-flash-lite-latest", per_file_char_limit=3000,
+                     max_output_tokens=8192, tokens_per_answer=256, max_questions_per_call=25,
+                     session=None):
+    """
+    Answer many questions over the same forms with as few LLM calls as possible.
+    - forms_dict: {filename: ocr_text}
+    - questions: list of question strings
+    - session: optional FormQuerySession to reuse (its forms prefix/cache is shared)
+    Returns a list aligned with `questions`; each item has the unified_form_query
+    shape ({"success", "result", "raw"} or {"success": False, "error", "raw"}) plus "question".
+    """
+    questions = list(questions)
+    if not questions:
+        return []
+    session = session or FormQuerySession(forms_dict, model=model, per_file_char_limit=per_file_char_limit)
+    results = [None] * len(questions)
+    # Questions a learned template answers locally never reach the LLM
+    remaining = []
+    for idx, question in enumerate(questions):
+        local = session.answer_locally(question)
+        if local is not None:
+            results[idx] = session.verify(dict(local, question=question))
+        else:
+            remaining.append(idx)
+    pending = [questions[idx] for idx in remaining]
+    with request_scope("batch_form_query", forms_dict=session.forms_dict, questions=pending,
+                       model=session.model, per_file_char_limit=session.per_file_char_limit,
+                       max_output_tokens=max_output_tokens, tokens_per_answer=tokens_per_answer,
+                       max_questions_per_call=max_questions_per_call,
+                       session_max_output_tokens=session.max_output_tokens,
+                       use_provider_cache=session.use_provider_cache):
+        for batch in plan_batches(pending, max_output_tokens=max_output_tokens,
+                                  tokens_per_answer=tokens_per_answer,
+                                  max_questions_per_call=max_questions_per_call):
+            indices = [remaining[i] for i in batch]
+            _run_batch(session, questions, indices, tokens_per_answer, results)
+    return results
+
+
+def load_questions(path):
+    """Read questions from a .json list or a text file (one per line, '#' comments)."""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    if str(path).lower().endswith(".json"):
+        return [str(q) for q in json.loads(content)]
+    return [line.strip() for line in content.splitlines() if line.strip() and not line.strip().startswith("#")]
+
+
+def main(argv=None):
+    from ..utils.storage import load_all_forms_with_names
+
+    parser = argparse.ArgumentParser(description="Ask a list of questions over saved forms in batched calls.")
+    parser.add_argument("questions", help="Questions file (.txt one per line, or .json list)")
+    parser.add_argument("--forms", nargs="*", help="Form IDs to query (default: all saved forms)")
+    parser.add_argument("--model", default="gemini-flash-lite-latest")
+    parser.add_argument("--max-output-tokens", type=int, default=8192)
+    parser.add_argument("--tokens-per-answer", type=int, default=256)
+    parser.add_argument("--output", help="Write results as JSON to this path (default: stdout)")
+    args = parser.parse_args(argv)
+
+    forms_with_names = load_all_forms_with_names()
+    if args.forms:
+        unknown = [fid for fid in args.forms if fid not in forms_with_names]
+        if unknown:
+            parser.error(f"Unknown form id(s): {', '.join(unknown)}")
+        forms_with_names = {fid: forms_with_names[fid] for fid in args.forms}
+    if not forms_with_names:
+        parser.error("No saved forms found. Upload forms first.")
+    forms_dict = {fid: info["ocr_text"] for fid, info in forms_with_names.items()}
+
+    results = batch_form_query(forms_dict, load_questions(args.questions), model=args.model,
+                               max_output_tokens=args.max_output_tokens,
+                               tokens_per_answer=args.tokens_per_answer)
+    out = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(out)
+        ok = sum(1 for r in results if r.get("success"))
+        print(f"{ok}/{len(results)} questions answered -> {args.output}")
+    else:
+        sys.stdout.write(out + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Incremental form summaries.
+
+Each form is summarized once and cached on disk, keyed by a hash of its OCR
+text (so edits/re-OCR invalidate it automatically). Multi-form summaries are
+built by merging cached per-form summaries hierarchically: summaries are put in
+a stable order and cut into small groups at content-defined boundaries, each
+group is merged with one cheap call, and the process repeats until one summary
+is left. Adding a form to a selection only changes the groups on its path to
+the root, so it costs one new summary plus a few small merges.
+"""
+
+import hashlib
+import json
+import time
+from pathlib import Path
+
+from ..llm.gemini import call_gemini, request_scope, SUMMARY_SYSTEM, SUMMARY_MERGE_SYSTEM
+from ..utils import blobstore
+from .unified import _parse_llm_json, _stage
+
+SUMMARY_CACHE_DIR = Path("data/summary_cache")
+
+
+def _key(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8") + b"\0")
+    return h.hexdigest()
+
+
+def _cache_get(key):
+    path = SUMMARY_CACHE_DIR / f"{key}.json"
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _cache_put(key, summary):
+    blobstore.write_atomic(SUMMARY_CACHE_DIR / f"{key}.json", json.dumps(summary, ensure_ascii=False),
+                           durable=False)
+
+
+def _parse_summary(raw):
+    """Parse a summary reply; non-JSON replies are kept as plain text with "raw": True."""
+    parsed = _parse_llm_json(raw)
+    if parsed["success"] and isinstance(parsed["result"], dict) and "error" not in parsed["result"]:
+        return parsed["result"], True
+    return {"summary": raw, "raw": True}, False
+
+
+def _ask(system_prompt, user_prompt, model, t0):
+    """One summary call and parse, timed into the stage stats (prompt time counted from t0)."""
+    t0 = _stage("prompt", t0)
+    raw = call_gemini(system_prompt, user_prompt, model=model)
+    t0 = _stage("llm", t0)
+    result = _parse_summary(raw)
+    _stage("parse", t0)
+    return result
+
+
+def summarize_form(ocr_text, filename, model="gemini-flash-lite-latest", char_limit=30000):
+    """
+    Summarize one form (SUMMARY_SYSTEM schema), using the per-form cache.
+    The cache key covers the OCR text and model, not the filename.
+    """
+    t0 = time.perf_counter()
+    key = _key("form", model, str(char_limit), ocr_text)
+    cached = _cache_get(key)
+    if cached is not None:
+        return dict(cached, cache_key=key)
+
+    user_prompt = f"""Form: {filename}
+
+OCR Text:
+{ocr_text[:char_limit]}
+
+Generate a comprehensive summary of this form."""
+    summary, ok = _ask(SUMMARY_SYSTEM, user_prompt, model, t0)
+    if ok:
+        _cache_put(key, summary)
+    return dict(summary, cache_key=key)
+
+
+def _compact(summary):
+    """Summary fields that are passed on to a merge prompt."""
+    return {k: summary.get(k) for k in ("summary", "key_fields", "warnings", "form_type") if summary.get(k)}
+
+
+def _merge(nodes, model):
+    """Merge [(label, summary)] into one summary with one LLM call (cached by child keys)."""
+    t0 = time.perf_counter()
+    key = _key("merge", model, *[f"{label}\0{summary['cache_key']}" for label, summary in nodes])
+    cached = _cache_get(key)
+    if cached is not None:
+        return dict(cached, cache_key=key)
+
+    parts = [f"--- Summary: {label} ---\n{json.dumps(_compact(summary), ensure_ascii=False)}\n"
+             for label, summary in nodes]
+    user_prompt = "Summaries:\n\n" + "\n".join(parts) + "\nMerge these into one summary of the collection."
+    summary, ok = _ask(SUMMARY_MERGE_SYSTEM, user_prompt, model, t0)
+    if ok:
+        _cache_put(key, summary)
+    return dict(summary, cache_key=key)
+
+
+def _group(nodes, fanout):
+    """
+    Cut nodes into groups at content-defined boundaries.
+    A group ends after a node whose cache key hashes to 0 mod `fanout` (once it has
+    at least two members) or when it reaches 2 * fanout members, so inserting a node
+    only changes the group it lands in.
+    """
+    groups, current = [], []
+    for node in nodes:
+        current.append(node)
+        boundary = int(node[1]["cache_key"][:8], 16) % fanout == 0
+        if (boundary and len(current) >= 2) or len(current) >= 2 * fanout:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
+def summarize_forms(forms_dict, names=None, model="gemini-flash-lite-latest", fanout=8):
+    """
+    Summarize one or many forms.
+    - forms_dict: {form_id_or_filename: ocr_text}
+    - names: optional {form_id: display filename} used as labels in prompts
+    Returns the SUMMARY_SYSTEM-shaped dict for the whole selection, plus
+    "forms": [{"file": label, **per_form_summary}] for multi-form selections.
+    """
+    names = names or {}
+    with request_scope("summarize_forms", forms_dict=forms_dict, names=names, model=model, fanout=fanout):
+        return _summarize_forms(forms_dict, names, model, fanout)
+
+
+def _summarize_forms(forms_dict, names, model, fanout):
+    leaves = []
+    for form_id, ocr_text in forms_dict.items():
+        label = names.get(form_id, form_id)
+        leaves.append((label, summarize_form(ocr_text, label, model=model)))
+    if not leaves:
+        return {"summary": "No forms selected.", "key_fields": {}, "warnings": [], "form_type": None}
+    if len(leaves) == 1:
+        return leaves[0][1]
+
+    # Stable order independent of selection order, so merges are reused across selections
+    nodes = sorted(leaves, key=lambda node: (node[1]["cache_key"], node[0]))
+    while len(nodes) > 1:
+        merged = []
+        for group in _group(nodes, fanout):
+            if len(group) == 1:
+                merged.append(group[0])
+            else:
+                # Label depends only on the members, so unchanged groups keep their merge cache key
+                label = "group: " + "; ".join(label for label, _ in group)
+                merged.append((label[:200], _merge(group, model)))
+        nodes = merged
+
+    result = dict(nodes[0][1])
+    result["forms"] = [dict(summary, file=label) for label, summary in leaves]
+    return result
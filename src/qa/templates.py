@@ -0,0 +1,297 @@
+"""
+Per-form-type extraction templates learned from prior answers.
+
+When the LLM answers a plain field lookup about one form with HIGH confidence
+and the answer is the whole value of a "label: value" line in that form, the label is
+compiled into an anchored regex and stored for the form's type (see
+src/utils/form_types.py) under a normalized key of the question. The next time
+the same question is asked about a form of that type, the regex extracts the
+value locally; the LLM is only called when a template misses. Questions that
+filter, compare, rank or aggregate (see is_lookup) are never learned or served.
+
+Templates live in `templates.json` in the forms store:
+    {form_type: {question_key: [{"label", "pattern", "hits", "misses", "learned"}, ...]}}
+"hits" counts LLM answers that confirmed a pattern, "misses" template misses.
+Answering never writes: misses are counted in memory and saved with the next
+learned pattern (learning runs after the LLM answer and may fail harmlessly).
+"""
+
+import json
+import re
+import threading
+import time
+
+TEMPLATES_FILE = "templates.json"
+MAX_PATTERNS_PER_KEY = 3
+MAX_LABEL_WORDS = 6
+
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "what", "whats", "which", "who", "whose",
+    "of", "in", "on", "for", "to", "from", "this", "that", "these", "form", "forms", "file",
+    "files", "document", "please", "tell", "me", "give", "show", "find", "s", "does", "do",
+    "listed", "given", "mentioned", "stated", "provided",
+}
+# Words that make a question more than a field lookup (filters, ordering, aggregates)
+_NOT_LOOKUP = {
+    "which", "than", "greater", "greatest", "larger", "largest", "bigger", "biggest", "higher",
+    "highest", "lower", "lowest", "smaller", "smallest", "more", "most", "less", "least", "fewer",
+    "fewest", "above", "below", "over", "under", "exceed", "exceeds", "exceeding", "between",
+    "maximum", "minimum", "max", "min", "top", "bottom", "rank", "ranked", "sort", "sorted",
+    "earliest", "latest", "oldest", "newest", "average", "avg", "mean", "median", "sum",
+    "combined", "count", "many", "compare", "compared", "difference", "only", "without",
+}
+_WORD = re.compile(r"[a-z0-9]+")
+
+_cache = {"path": None, "mtime": None, "templates": {}}
+# Template misses not yet written: (form_type, key, pattern) -> count
+_pending_misses = {}
+_pending_lock = threading.Lock()
+
+
+def question_key(question, exclude=()):
+    """
+    Normalized key of a question: sorted content words without stopwords or
+    words of `exclude` (e.g. the file name), so "What is the Loan Amount in
+    form_3.pdf?" and "loan amount?" share a key.
+    """
+    excluded = set()
+    for text in exclude:
+        excluded.update(_WORD.findall(str(text).lower()))
+    words = {w for w in _WORD.findall(question.lower()) if w not in _STOPWORDS and w not in excluded}
+    return " ".join(sorted(words))
+
+
+def is_lookup(question):
+    """True if `question` only asks for a field's value (no filter, comparison, ordering or aggregate)."""
+    return not _NOT_LOOKUP.intersection(_WORD.findall(question.lower()))
+
+
+def _normalize_value(value):
+    return " ".join(str(value).split()).strip(" .,;").casefold()
+
+
+def compile_label(label, separator):
+    """Anchored, case-insensitive regex for a value that follows `label` and `separator` on one line."""
+    words = re.findall(r"\w+", label)
+    sep = re.escape(separator) if separator else ""
+    return (r"(?im)^[^\S\n]*" + r"[^\w\n]{0,3}".join(re.escape(w) for w in words)
+            + r"[^\S\n]*" + sep + r"[^\S\n]*(?P<value>\S[^\n]*?)[^\S\n]*$")
+
+
+def learn_pattern(ocr_text, answer):
+    """
+    Find a "label<sep> value" line whose value is exactly `answer` and return
+    {"label", "pattern"} for it, or None. The pattern is only kept if its first
+    match in `ocr_text` extracts `answer` (so it cannot pick a different field).
+    """
+    wanted = _normalize_value(answer)
+    if not wanted:
+        return None
+    for match in re.finditer(r"(?m)^[^\S\n]*(?P<label>[^\n:#=]{1,60}?)[^\S\n]*(?P<sep>[:#=]|-)[^\S\n]*(?P<value>[^\n]+)$",
+                             ocr_text):
+        if _normalize_value(match.group("value")) != wanted:
+            continue
+        label = match.group("label")
+        if not re.search(r"[A-Za-z]", label) or len(re.findall(r"\w+", label)) > MAX_LABEL_WORDS:
+            continue
+        pattern = compile_label(label, match.group("sep"))
+        check = re.search(pattern, ocr_text)
+        if check and _normalize_value(check.group("value")) == wanted:
+            return {"label": " ".join(label.split()), "pattern": pattern}
+    return None
+
+
+def extract(ocr_text, entries):
+    """Apply a key's patterns (best first). Returns (entry, value, line) or None."""
+    for entry in entries:
+        match = re.search(entry["pattern"], ocr_text)
+        if match:
+            return entry, match.group("value"), match.group(0).strip()
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Template store (templates.json in the forms store)
+# ---------------------------------------------------------------------------
+
+def _path():
+    from ..utils import storage
+
+    return storage.FORMS_DB_DIR / TEMPLATES_FILE
+
+
+def load_templates():
+    """All templates, re-read only when templates.json changes."""
+    path = _path()
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if _cache["path"] != str(path) or _cache["mtime"] != mtime:
+        templates = {}
+        if mtime is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    templates = json.load(f)
+            except (OSError, ValueError):
+                templates = {}
+        _cache.update(path=str(path), mtime=mtime, templates=templates)
+    return _cache["templates"]
+
+
+def _update_templates(update):
+    """Read-modify-write templates.json under the store lock; `update(templates)` edits in place."""
+    from ..utils import blobstore, storage
+
+    with blobstore.store_lock(storage.FORMS_DB_DIR):
+        _cache["mtime"] = None
+        templates = load_templates()
+        update(templates)
+        blobstore.write_atomic(_path(), json.dumps(templates, ensure_ascii=False, indent=1, sort_keys=True))
+        _cache["mtime"] = None
+
+
+def _count_miss(form_type, key, pattern):
+    """Remember a template miss in memory; it is saved by the next _record()."""
+    with _pending_lock:
+        _pending_misses[(form_type, key, pattern)] = _pending_misses.get((form_type, key, pattern), 0) + 1
+
+
+def _record(form_type, key, learned):
+    """
+    Add a learned pattern (or count a confirmation if it is already known), and
+    save the pending misses. Local hits and misses are not written on the
+    answering path, so answering stays read-only.
+    """
+    with _pending_lock:
+        misses = dict(_pending_misses)
+        _pending_misses.clear()
+
+    def update(templates):
+        touched = {(form_type, key)} | {(ft, k) for ft, k, _ in misses}
+        for ft, k, pattern in misses:
+            for entry in templates.get(ft, {}).get(k, []):
+                if entry["pattern"] == pattern:
+                    entry["misses"] += misses[(ft, k, pattern)]
+        entries = templates.setdefault(form_type, {}).setdefault(key, [])
+        known = False
+        for entry in entries:
+            if entry["pattern"] == learned["pattern"]:
+                entry["hits"] += 1
+                known = True
+        if not known:
+            entries.append(dict(learned, hits=1, misses=0, learned=time.time()))
+        # Most reliable first; drop patterns that keep missing
+        for ft, k in touched:
+            ranked = templates.get(ft, {}).get(k)
+            if ranked:
+                ranked.sort(key=lambda e: (e["misses"] - e["hits"], -e.get("learned", 0)))
+                del ranked[MAX_PATTERNS_PER_KEY:]
+
+    try:
+        _update_templates(update)
+    except BaseException:
+        # Not saved: keep the misses for the next attempt
+        with _pending_lock:
+            for miss, count in misses.items():
+                _pending_misses[miss] = _pending_misses.get(miss, 0) + count
+        raise
+
+
+# ---------------------------------------------------------------------------
+# Question path
+# ---------------------------------------------------------------------------
+
+def _form_info(form_id, ocr_text):
+    """(form_type, display name) of a form; type is matched from layout if it is not stored (read-only)."""
+    from ..utils import storage
+    from ..utils.form_types import layout_signature
+
+    index = storage.get_type_index(backfill=False)
+    form_type = index.form_type.get(form_id)
+    if form_type is None:
+        form_type = index.match(*layout_signature(ocr_text))
+    return form_type, storage.get_form_filename(form_id) or form_id
+
+
+def _target_forms(forms_dict, question, names):
+    """Forms a question names explicitly (by form ID, file name or file stem), else all."""
+    q = question.lower()
+    named = [fid for fid in forms_dict
+             if str(fid).lower() in q or names[fid].lower() in q
+             or (len(names[fid].rsplit(".", 1)[0]) > 3 and names[fid].rsplit(".", 1)[0].lower() in q)]
+    return named or list(forms_dict)
+
+
+def answer_locally(forms_dict, question):
+    """
+    Try to answer `question` from learned templates without the LLM.
+    Every targeted form must have a template hit; returns a unified_form_query
+    style dict ({"success": True, "result": ..., "raw": None, "source": "template"})
+    or None on any miss.
+    """
+    if not forms_dict or not is_lookup(question):
+        return None
+    templates = load_templates()
+    if not templates:
+        return None
+    info = {fid: _form_info(fid, text) for fid, text in forms_dict.items()}
+    names = {fid: name for fid, (_, name) in info.items()}
+    targets = _target_forms(forms_dict, question, names)
+    exclude = [names[fid] for fid in forms_dict] + [str(fid) for fid in forms_dict]
+    key = question_key(question, exclude)
+    if not key:
+        return None
+
+    hits = []
+    for fid in targets:
+        form_type = info[fid][0]
+        entries = templates.get(form_type, {}).get(key) if form_type else None
+        found = extract(forms_dict[fid], entries) if entries else None
+        if found is None:
+            if entries:
+                _count_miss(form_type, key, entries[0]["pattern"])
+            return None
+        hits.append((fid, form_type, found))
+
+    if len(hits) == 1:
+        fid, _, (entry, value, line) = hits[0]
+        result = {"mode": "single", "file": fid, "answer": value,
+                  "evidence": [{"file": fid, "snippet": line}], "confidence": "HIGH"}
+    else:
+        result = [{"file": fid, "extracted": {_field_name(entry["label"]): value},
+                   "evidence": [{"snippet": line}], "confidence": "HIGH"}
+                  for fid, _, (entry, value, line) in hits]
+    return {"success": True, "result": result, "raw": None, "source": "template"}
+
+
+def _field_name(label):
+    return "_".join(_WORD.findall(label.lower())) or "value"
+
+
+def learn_from_answer(forms_dict, question, parsed):
+    """
+    Learn a template from a parsed LLM answer to a plain field lookup: only
+    HIGH-confidence single-form answers are used (a multi-form list may be the
+    result of a filter the question does not spell out). Returns the number of
+    patterns learned (0 or 1).
+    """
+    if not parsed.get("success") or not is_lookup(question):
+        return 0
+    result = parsed.get("result")
+    if not isinstance(result, dict) or result.get("mode") != "single":
+        return 0
+    fid, answer = result.get("file"), result.get("answer")
+    if result.get("confidence") != "HIGH" or fid not in forms_dict or answer in (None, "") \
+            or isinstance(answer, (dict, list)):
+        return 0
+    form_type, _ = _form_info(fid, forms_dict[fid])
+    if form_type is None:
+        return 0
+    names = [_form_info(f, t)[1] for f, t in forms_dict.items()]
+    key = question_key(question, names + [str(f) for f in forms_dict])
+    pattern = learn_pattern(forms_dict[fid], answer) if key else None
+    if not pattern:
+        return 0
+    _record(form_type, key, learned=pattern)
+    return 1
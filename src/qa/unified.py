@@ -1,6 +1,49 @@
+import hashlib
 import json
 import re
-from ..llm.gemini import call_gemini, UNIFIED_SYSTEM
+import time
+from collections import OrderedDict
+from ..llm.gemini import call_gemini, create_cached_context, delete_cached_context, request_scope, UNIFIED_SYSTEM
+from .verify import verify_result
+
+# Output instructions used by the context/session mode. They come before the forms
+# block so that everything except the question is a stable, cacheable prefix.
+CONTEXT_INSTRUCTIONS = """IMPORTANT: Output JSON ONLY.
+Wrap the output JSON inside the markers:
+
+<JSON>
+{ ... }
+</JSON>
+
+Do NOT include any text outside these markers."""
+
+# Time spent per stage of the question and summary paths since the last reset:
+# prompt building, LLM calls, JSON parsing and evidence verification
+_stage_stats = {"llm_calls": 0, "prompt_s": 0.0, "llm_s": 0.0, "parse_s": 0.0, "verify_s": 0.0}
+
+
+def get_stage_stats():
+    """Counters since the last reset: llm_calls and seconds per stage (prompt/llm/parse/verify)."""
+    return dict(_stage_stats)
+
+
+def reset_stage_stats():
+    for key in _stage_stats:
+        _stage_stats[key] = 0 if key == "llm_calls" else 0.0
+
+
+def _stage(name, t0):
+    """Add the time since `t0` to stage `name`; returns the current time for the next stage."""
+    now = time.perf_counter()
+    _stage_stats[name + "_s"] += now - t0
+    if name == "llm":
+        _stage_stats["llm_calls"] += 1
+    return now
+
+
+# Memo of built forms contexts: digest -> {"static_prompt", "cached_content", "expires_at", "uses"}
+_CONTEXT_CACHE = OrderedDict()
+_CONTEXT_CACHE_SIZE = 16
 
 
 def _label_and_truncate_forms(forms_dict, per_file_char_limit=3000):
@@ -14,18 +57,10 @@ def _label_and_truncate_forms(forms_dict, per_file_char_limit=3000):
     return "\n".join(parts)
 
 
-def unified_form_query(forms_dict, question, model="gemini-flash-lite-latest",
-                     per_file_char_limit=3000, max_output_tokens=1024):
+def _build_user_prompt(labeled_block, question):
     """
-    Unified query: ask question over one or many forms.
-    - forms_dict: {filename: ocr_text}
-    - question: user question string
-    Returns parsed JSON (python object) or raw string if parsing failed.
+    Build the user prompt: labeled files block, question and output instructions.
     """
-    # 1) Build labeled files block (truncated)
-    labeled_block = _label_and_truncate_forms(forms_dict, per_file_char_limit=per_file_char_limit)
-
-    # 2) Build user prompt
     user_prompt = f"""FILES:
     {labeled_block}
     ---QUESTION---
@@ -40,11 +75,208 @@ def unified_form_query(forms_dict, question, model="gemini-flash-lite-latest",
 
     Do NOT include any text outside these markers.
     """
+    return user_prompt
+
+
+def _forms_digest(forms_dict, per_file_char_limit, model):
+    """Stable digest of a form selection (names, texts, truncation limit, model)."""
+    h = hashlib.sha256(f"{model}\0{per_file_char_limit}".encode("utf-8"))
+    for fname, txt in forms_dict.items():
+        h.update(b"\0" + str(fname).encode("utf-8") + b"\0" + txt.encode("utf-8"))
+    return h.hexdigest()
+
+
+def get_forms_context(forms_dict, model="gemini-flash-lite-latest", per_file_char_limit=3000,
+                      use_provider_cache=True, ttl_seconds=3600):
+    """
+    Build (or reuse) the static prompt prefix for a form selection.
+    The labeled block is built once per selection and memoized. The provider-side
+    cache is only created on the second question for a selection (a one-off
+    question would pay for the upload and storage without ever reusing it), and
+    is deleted when the entry is evicted or the cache is replaced.
+    Returns {"digest", "static_prompt", "cached_content", "expires_at", "uses"}.
+    """
+    digest = _forms_digest(forms_dict, per_file_char_limit, model)
+    ctx = _CONTEXT_CACHE.get(digest)
+    if ctx is None:
+        labeled_block = _label_and_truncate_forms(forms_dict, per_file_char_limit=per_file_char_limit)
+        ctx = {
+            "digest": digest,
+            "static_prompt": f"{CONTEXT_INSTRUCTIONS}\n\nFILES:\n{labeled_block}",
+            "cached_content": None,
+            "expires_at": 0.0,
+            "uses": 0,
+        }
+        _CONTEXT_CACHE[digest] = ctx
+        while len(_CONTEXT_CACHE) > _CONTEXT_CACHE_SIZE:
+            _, evicted = _CONTEXT_CACHE.popitem(last=False)
+            delete_cached_context(evicted["cached_content"])
+    else:
+        _CONTEXT_CACHE.move_to_end(digest)
+
+    # (Re)create the provider-side cache from the first follow-up on, when missing or about to expire
+    ctx["uses"] += 1
+    if use_provider_cache and ctx["uses"] > 1 and ctx["expires_at"] - 60 < time.time():
+        delete_cached_context(ctx["cached_content"])
+        ctx["cached_content"] = create_cached_context(UNIFIED_SYSTEM, ctx["static_prompt"],
+                                                      model=model, ttl_seconds=ttl_seconds)
+        # Don't retry unsupported/too-small prefixes on every question
+        ctx["expires_at"] = time.time() + ttl_seconds
+    return ctx
+
+
+def clear_forms_contexts():
+    """Forget all memoized forms contexts and delete their provider-side caches."""
+    while _CONTEXT_CACHE:
+        _, ctx = _CONTEXT_CACHE.popitem(last=False)
+        delete_cached_context(ctx["cached_content"])
+
+
+class FormQuerySession:
+    """
+    Ask follow-up questions over a fixed selection of forms.
+
+    The system prompt, output instructions and labeled forms block form a stable
+    prefix that is built once; only the question changes between calls. With
+    provider caching, follow-up calls send just the question. With templates,
+    questions already answered for forms of the same type are extracted locally
+    (see templates.py) and HIGH-confidence answers teach new templates. Evidence
+    is checked against the OCR text before anything is learned (see verify.py).
+    """
+
+    def __init__(self, forms_dict, model="gemini-flash-lite-latest", per_file_char_limit=3000,
+                 max_output_tokens=1024, use_provider_cache=True, ttl_seconds=3600, use_templates=True,
+                 verify_evidence=True):
+        self.forms_dict = dict(forms_dict)
+        self.use_templates = use_templates
+        self.verify_evidence = verify_evidence
+        self.model = model
+        self.per_file_char_limit = per_file_char_limit
+        self.max_output_tokens = max_output_tokens
+        self.use_provider_cache = use_provider_cache
+        self.ttl_seconds = ttl_seconds
+
+    def context(self):
+        """Return the (memoized) forms context for this session's selection."""
+        return get_forms_context(self.forms_dict, model=self.model,
+                                 per_file_char_limit=self.per_file_char_limit,
+                                 use_provider_cache=self.use_provider_cache,
+                                 ttl_seconds=self.ttl_seconds)
+
+    def ask(self, question, max_output_tokens=None):
+        """
+        Ask one question; returns the same dict shape as unified_form_query
+        (plus "source": "template" when answered from a learned template).
+        """
+        local = self.answer_locally(question)
+        if local is not None:
+            return self.verify(local)
+        with request_scope("session_ask", forms_dict=self.forms_dict, question=question, model=self.model,
+                           per_file_char_limit=self.per_file_char_limit,
+                           max_output_tokens=max_output_tokens or self.max_output_tokens,
+                           use_provider_cache=self.use_provider_cache):
+            parsed = self.verify(self.query(f"---QUESTION---\n{question}\n", max_output_tokens=max_output_tokens))
+        self.learn(question, parsed)
+        return parsed
+
+    def verify(self, parsed):
+        """Check evidence snippets against this session's OCR texts (in place)."""
+        if self.verify_evidence:
+            t0 = time.perf_counter()
+            verify_result(parsed, self.forms_dict)
+            _stage("verify", t0)
+        return parsed
+
+    def answer_locally(self, question):
+        """Template answer for `question`, or None (templates disabled or a miss)."""
+        if not self.use_templates:
+            return None
+        from . import templates
+        return templates.answer_locally(self.forms_dict, question)
+
+    def learn(self, question, parsed):
+        """Learn extraction templates from a parsed answer (best effort)."""
+        if not self.use_templates:
+            return
+        from . import templates
+        try:
+            templates.learn_from_answer(self.forms_dict, question, parsed)
+        except OSError:
+            pass  # read-only store: keep answering, just don't learn
+
+    def query(self, variable_prompt, max_output_tokens=None):
+        """
+        Send `variable_prompt` after the cached forms prefix and parse the JSON reply.
+        Used by ask() and by the batch API, which only differ in the variable part.
+        """
+        t0 = time.perf_counter()
+        ctx = self.context()
+        max_output_tokens = max_output_tokens or self.max_output_tokens
+        if ctx["cached_content"]:
+            user_prompt = variable_prompt
+        else:
+            user_prompt = f"{ctx['static_prompt']}\n{variable_prompt}"
+        t0 = _stage("prompt", t0)
+        raw_out = call_gemini(UNIFIED_SYSTEM, user_prompt, model=self.model,
+                              max_output_tokens=max_output_tokens,
+                              cached_content=ctx["cached_content"])
+        t0 = _stage("llm", t0)
+        parsed = _parse_llm_json(raw_out)
+        t0 = _stage("parse", t0)
+        if ctx["cached_content"] and isinstance(parsed.get("result"), dict) \
+                and parsed["result"].get("error") == "exception_calling_api":
+            # Cached content may have expired server-side: fall back to the full prefix
+            delete_cached_context(ctx["cached_content"])
+            ctx["cached_content"] = None
+            raw_out = call_gemini(UNIFIED_SYSTEM, f"{ctx['static_prompt']}\n{variable_prompt}",
+                                  model=self.model, max_output_tokens=max_output_tokens)
+            t0 = _stage("llm", t0)
+            parsed = _parse_llm_json(raw_out)
+            _stage("parse", t0)
+        return parsed
+
+
+def unified_form_query(forms_dict, question, model="gemini-flash-lite-latest",
+                     per_file_char_limit=3000, max_output_tokens=1024, verify_evidence=True):
+    """
+    Unified query: ask question over one or many forms.
+    - forms_dict: {filename: ocr_text}
+    - question: user question string
+    - verify_evidence: check evidence snippets against the OCR text (see verify.py)
+    Returns parsed JSON (python object) or raw string if parsing failed.
+    """
+    t0 = time.perf_counter()
+
+    # 1) Build labeled files block (truncated)
+    labeled_block = _label_and_truncate_forms(forms_dict, per_file_char_limit=per_file_char_limit)
+
+    # 2) Build user prompt
+    user_prompt = _build_user_prompt(labeled_block, question)
+    t0 = _stage("prompt", t0)
 
     # 3) Call Gemini (uses your call_gemini wrapper)
-    raw_out = call_gemini(UNIFIED_SYSTEM, user_prompt, model=model, max_output_tokens=max_output_tokens)
+    with request_scope("unified_form_query", forms_dict=forms_dict, question=question, model=model,
+                       per_file_char_limit=per_file_char_limit, max_output_tokens=max_output_tokens,
+                       verify_evidence=verify_evidence):
+        raw_out = call_gemini(UNIFIED_SYSTEM, user_prompt, model=model, max_output_tokens=max_output_tokens)
+    t0 = _stage("llm", t0)
 
     # 4) Try to parse JSON safely with multiple extraction strategies
+    parsed = _parse_llm_json(raw_out)
+    t0 = _stage("parse", t0)
+
+    # 5) Check evidence snippets locally; unmatched citations lower the confidence
+    if verify_evidence:
+        verify_result(parsed, forms_dict)
+        _stage("verify", t0)
+    return parsed
+
+
+def _parse_llm_json(raw_out):
+    """
+    Parse model output into JSON using several extraction strategies.
+    Returns {"success": True, "result": ..., "raw": ...} or an error dict.
+    """
     # Strategy 1: Try direct parsing
     try:
         parsed = json.loads(raw_out.strip())
@@ -136,4 +368,3 @@ def unified_form_query(forms_dict, question, model="gemini-flash-lite-latest",
     
     # All strategies failed: return error with raw output
     return {"success": False, "error": "Could not parse LLM output as JSON", "raw": raw_out}
-
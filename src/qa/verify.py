@@ -0,0 +1,229 @@
+"""
+Local verification of evidence snippets in query results.
+
+Every evidence snippet is looked up in the OCR text of the file it cites,
+allowing a few edits (the model often fixes OCR typos or spacing when quoting).
+Lookups use a trigram index of the text to find candidate windows, then
+bit-parallel edit distance (Myers) inside each window, so a snippet costs
+microseconds instead of a second LLM call. Matches get character offsets into
+the OCR text; answers with unmatched evidence get their confidence lowered.
+"""
+
+import re
+from collections import OrderedDict
+
+Q = 3
+MAX_EDIT_RATIO = 0.2
+MAX_CANDIDATES = 5
+_LEVELS = ["LOW", "MEDIUM", "HIGH"]
+_NUMBER = re.compile(r"\d+")
+
+# Trigram indexes of recently checked texts (str hashes are cached, so lookups are cheap)
+_INDEX_CACHE = OrderedDict()
+_INDEX_CACHE_SIZE = 64
+
+
+def _normalize(text):
+    """Casefolded text with whitespace runs collapsed, plus each char's offset in `text`."""
+    chars, offsets = [], []
+    in_space = True
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            if not in_space:
+                chars.append(" ")
+                offsets.append(i)
+            in_space = True
+            continue
+        for folded in ch.casefold():
+            chars.append(folded)
+            offsets.append(i)
+        in_space = False
+    if chars and chars[-1] == " ":
+        chars.pop()
+        offsets.pop()
+    return "".join(chars), offsets
+
+
+def _text_index(text):
+    """(normalized text, offsets, trigram -> positions) for `text`, cached."""
+    entry = _INDEX_CACHE.get(text)
+    if entry is None:
+        norm, offsets = _normalize(text)
+        grams = {}
+        for i in range(len(norm) - Q + 1):
+            grams.setdefault(norm[i:i + Q], []).append(i)
+        entry = (norm, offsets, grams)
+        _INDEX_CACHE[text] = entry
+        while len(_INDEX_CACHE) > _INDEX_CACHE_SIZE:
+            _INDEX_CACHE.popitem(last=False)
+    else:
+        _INDEX_CACHE.move_to_end(text)
+    return entry
+
+
+def _best_end(pattern, text):
+    """
+    Myers' bit-parallel approximate matching: lowest edit distance of `pattern`
+    against any substring of `text`, and the end index of the last such substring
+    (so ties prefer the longer match, e.g. "Lopez" over "Lope" for "Lopes").
+    """
+    m = len(pattern)
+    peq = {}
+    for i, ch in enumerate(pattern):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    best, best_end = m, 0
+    for j, ch in enumerate(text):
+        eq = peq.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        # Matches may start anywhere in the text, so row 0 stays 0 (no carry-in)
+        ph = (ph << 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        if score <= best:
+            best, best_end = score, j + 1
+    return best, best_end
+
+
+def _start(pattern, text, lo, end, dist):
+    """Start of the best match of `pattern` ending at `end`, found by matching it reversed."""
+    back_lo = max(lo, end - len(pattern) - dist)
+    _, back_len = _best_end(pattern[::-1], text[back_lo:end][::-1])
+    return end - back_len
+
+
+def _numbers_match(pattern, text, start, end):
+    """Every number in the snippet appears whole in the matched text (no "1000" for "100000")."""
+    while start > 0 and text[start - 1].isdigit():
+        start -= 1
+    while end < len(text) and text[end].isdigit():
+        end += 1
+    found = set(_NUMBER.findall(text[start:end]))
+    return all(num in found for num in _NUMBER.findall(pattern))
+
+
+def find_approx(text, snippet, max_edit_ratio=MAX_EDIT_RATIO):
+    """
+    Locate `snippet` in `text` allowing up to len(snippet) * max_edit_ratio edits
+    (case and whitespace are ignored), except in numbers, which must match whole.
+    Returns {"start", "end", "distance", "similarity"} with offsets into `text`, or None.
+    """
+    pattern, _ = _normalize(snippet)
+    if not pattern:
+        return None
+    norm, offsets, grams = _text_index(text)
+    m = len(pattern)
+    k = int(m * max_edit_ratio) if m >= 8 else 0
+
+    found = None
+    pos = norm.find(pattern)
+    while pos != -1 and found is None:
+        if _numbers_match(pattern, norm, pos, pos + m):
+            found = (0, pos, pos + m)
+        pos = norm.find(pattern, pos + 1)
+    if found is None:
+        windows = []
+        threshold = (m - Q + 1) - k * Q  # q-gram lemma: shared trigrams of any match within k edits
+        if threshold > 0:
+            votes = {}
+            for i in range(m - Q + 1):
+                for p in grams.get(pattern[i:i + Q], ()):
+                    bucket = (p - i) // (k + 1)
+                    votes[bucket] = votes.get(bucket, 0) + 1
+            # A match's diagonals span at most two adjacent buckets
+            scored = sorted(((votes.get(b, 0) + votes.get(b + 1, 0), b) for b in votes), reverse=True)
+            for count, bucket in scored[:MAX_CANDIDATES]:
+                if count < threshold:
+                    break
+                start = bucket * (k + 1)
+                windows.append((max(0, start - k), min(len(norm), start + 2 * (k + 1) + m + k)))
+        else:
+            windows.append((0, len(norm)))  # too short/noisy for the filter: scan the whole text
+        candidates = []
+        for lo, hi in windows:
+            dist, end = _best_end(pattern, norm[lo:hi])
+            if dist <= k:
+                candidates.append((dist, lo, lo + end))
+        # Closest first; a window whose numbers differ (e.g. another "Amount (2):" line) is skipped
+        for dist, lo, end in sorted(candidates):
+            start = _start(pattern, norm, lo, end, dist)
+            if _numbers_match(pattern, norm, start, end):
+                found = (dist, start, end)
+                break
+    if found is None:
+        return None
+    dist, start, end = found
+    return {"start": offsets[start], "end": offsets[end - 1] + 1, "distance": dist,
+            "similarity": round(1.0 - dist / m, 3)}
+
+
+def _downgrade(confidence, levels):
+    if confidence not in _LEVELS:
+        return "LOW"
+    return _LEVELS[max(0, _LEVELS.index(confidence) - levels)]
+
+
+def _check_evidence(evidence, default_file, forms_dict):
+    """Attach "match" to each evidence item; returns (checked, matched)."""
+    checked = matched = 0
+    for ev in evidence:
+        if not isinstance(ev, dict) or not str(ev.get("snippet") or "").strip():
+            continue
+        checked += 1
+        cited = ev.get("file") or default_file
+        match = None
+        if cited in forms_dict:
+            match = find_approx(forms_dict[cited], str(ev["snippet"]))
+        else:
+            # Unknown or missing file label: accept a match in exactly the one form that has it
+            hits = [(fid, m) for fid, m in ((fid, find_approx(text, str(ev["snippet"])))
+                                            for fid, text in forms_dict.items()) if m]
+            if len(hits) == 1:
+                match = dict(hits[0][1], file=hits[0][0])
+        ev["match"] = match
+        matched += match is not None
+    return checked, matched
+
+
+def _verify_answer(answer, default_file, forms_dict):
+    checked, matched = _check_evidence(answer.get("evidence") or [], default_file, forms_dict)
+    answer["verification"] = {"checked": checked, "matched": matched}
+    if checked and matched < checked:
+        answer["confidence"] = _downgrade(answer.get("confidence"), 2 if matched == 0 else 1)
+    return checked, matched
+
+
+def verify_result(parsed, forms_dict):
+    """
+    Check the evidence of a parsed unified_form_query result against `forms_dict`
+    ({file label: ocr_text}) in place. Each evidence item gets "match" ({"start",
+    "end", "distance", "similarity"[, "file"]} or None), each answer gets
+    "verification": {"checked", "matched"}, and confidence drops one level when
+    some evidence is not found (two when none is). Returns `parsed`.
+    """
+    if not parsed.get("success"):
+        return parsed
+    result = parsed.get("result")
+    totals = [0, 0]
+    if isinstance(result, dict) and result.get("mode") == "single":
+        answers = [(result, result.get("file"))]
+    elif isinstance(result, list):
+        answers = [(item, item.get("file")) for item in result if isinstance(item, dict)]
+    else:
+        return parsed
+    for answer, default_file in answers:
+        checked, matched = _verify_answer(answer, default_file, forms_dict)
+        totals[0] += checked
+        totals[1] += matched
+    parsed["verification"] = {"checked": totals[0], "matched": totals[1]}
+    return parsed
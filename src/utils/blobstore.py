@@ -0,0 +1,526 @@
+"""
+Content-addressed blob store used by the forms store.
+
+Layout under the store root:
+    blobs/<sha[:2]>/<sha256>   original uploads, stored once per distinct content
+    blobs/spool/*.tmp          uploads being streamed in (see spool())
+    segments/seg-NNNNNN.pack   OCR texts, compressed and appended back to back
+    index.jsonl                one JSON record per form: filename, blob hash and
+                               the (segment, offset, length, codec) of its text
+
+Texts are compressed with zstd when the `zstandard` package is installed and
+with zlib otherwise; the codec is stored per record so both can be read back.
+Segments are read through mmap, and bulk reads are ordered by (segment, offset)
+so loading many forms is sequential I/O.
+
+Writes are crash-safe and multi-process safe:
+- blobs are written to a temp file and renamed into place (atomic, idempotent);
+- segment and index appends happen under an exclusive lock on `<root>/.lock`;
+- a form's text is appended and fsynced *before* its index record, so
+  index.jsonl is the commit log: a record exists only for fully written data.
+  A crash leaves at worst unreferenced bytes/blobs or a torn last index line,
+  which readers ignore and fsck() repairs.
+"""
+
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import time
+import zlib
+from pathlib import Path
+
+try:  # optional, faster and smaller than zlib
+    import zstandard as _zstd
+except ImportError:  # pragma: no cover - depends on environment
+    _zstd = None
+
+INDEX_FILE = "index.jsonl"
+BLOBS_DIR = "blobs"
+SEGMENTS_DIR = "segments"
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+LOCK_FILE = ".lock"
+# fsync segment and index appends (set False for bulk imports that can be re-run)
+FSYNC = True
+# Unreferenced blobs / temp files younger than this may belong to a write in progress
+ORPHAN_GRACE_SECONDS = 3600
+SPOOL_DIR = "spool"
+SPOOL_CHUNK = 1024 * 1024
+
+# Per-root caches: parsed index records and open segment mmaps
+_index_cache = {}
+_mmaps = {}
+
+
+def default_codec():
+    return "zstd" if _zstd is not None else "zlib"
+
+
+def compress(data, codec=None):
+    codec = codec or default_codec()
+    if codec == "zstd":
+        return _zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(data), codec
+    if codec == "zlib":
+        return zlib.compress(data, ZLIB_LEVEL), codec
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        if _zstd is None:
+            raise RuntimeError("Form text was stored with zstd; install the 'zstandard' package to read it")
+        return _zstd.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+# ---------------------------------------------------------------------------
+# Locking and durable appends
+# ---------------------------------------------------------------------------
+
+@contextlib.contextmanager
+def store_lock(root):
+    """
+    Exclusive inter-process lock on the store (flock on POSIX, msvcrt on Windows).
+    Hold it only around appends; hashing, compression and blob writes happen outside.
+    """
+    Path(root).mkdir(parents=True, exist_ok=True)
+    with open(Path(root) / LOCK_FILE, "a+b") as f:
+        if os.name == "nt":  # pragma: no cover - Windows
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def sync(f):
+    """Flush `f` to the OS and, unless FSYNC is off, to disk."""
+    f.flush()
+    if FSYNC:
+        os.fsync(f.fileno())
+
+
+def write_atomic(path, data, durable=True):
+    """
+    Replace `path` with `data` (bytes or str) via a temp file renamed over it, so
+    readers see the old or the new content and never a partial file.
+    durable=False skips the fsync (for caches that are cheap to rebuild).
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{time.monotonic_ns()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        if durable:
+            sync(f)
+    os.replace(tmp, path)
+
+
+def load_appended(path, cache, new_index, add, key=None):
+    """
+    Bring an in-memory index of an append-only JSON-lines file up to date.
+    `cache` is a dict owned by the caller; only lines appended since the previous
+    call are parsed and applied with add(index, entry). The index starts over from
+    new_index() when the file was replaced or truncated, or when `key` changes.
+    A torn last line is left for the next call. Returns the index.
+    """
+    path = Path(path)
+    try:
+        st = path.stat()
+        ident, size = (str(path), st.st_ino, key), st.st_size
+    except FileNotFoundError:
+        ident, size = (str(path), None, key), 0
+    if cache.get("ident") != ident or size < cache["pos"]:
+        cache.update(ident=ident, pos=0, index=new_index())
+    if size > cache["pos"]:
+        with open(path, "rb") as f:
+            f.seek(cache["pos"])
+            chunk = f.read(size - cache["pos"])
+        # Only consume complete lines; a partial last line is picked up next time
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            add(cache["index"], entry)
+        cache["pos"] += end
+    return cache["index"]
+
+
+def repair_torn_tail(path):
+    """
+    Truncate a line-oriented file back to its last complete line.
+    Returns the number of bytes removed (0 if the file was intact or missing).
+    """
+    try:
+        f = open(path, "r+b")
+    except FileNotFoundError:
+        return 0
+    with f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return 0
+        # Scan backwards for the last newline
+        pos = size
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            idx = chunk.rfind(b"\n")
+            if idx != -1:
+                pos = pos - step + idx + 1
+                break
+            pos -= step
+        f.truncate(pos)
+        sync(f)
+        return size - pos
+
+
+def append_line(path, line):
+    """
+    Durably append one line (caller holds store_lock). A torn last line left by a
+    crashed writer is cut off first, so it cannot corrupt the new line.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    repair_torn_tail(path)
+    with open(path, "ab") as f:
+        f.write(line.encode("utf-8") + b"\n")
+        sync(f)
+
+
+# ---------------------------------------------------------------------------
+# Original files (content-addressed blobs)
+# ---------------------------------------------------------------------------
+
+def blob_path(root, sha):
+    return Path(root) / BLOBS_DIR / sha[:2] / sha
+
+
+def _reuse_blob(path):
+    """
+    Mark an existing blob as just written (so fsck's orphan sweep, which skips
+    recent files, leaves it alone until the record referencing it is committed).
+    Returns False if there is no such blob.
+    """
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def put_blob(root, data):
+    """
+    Store `data` under its SHA-256 (if identical content is already stored it is
+    only touched, see _reuse_blob). Returns (sha, size).
+    """
+    sha = hashlib.sha256(data).hexdigest()
+    path = blob_path(root, sha)
+    if not _reuse_blob(path):
+        write_atomic(path, data)
+    return sha, len(data)
+
+
+def spool(root, stream, chunk_size=SPOOL_CHUNK):
+    """
+    Copy a binary stream into a temp file inside the store, `chunk_size` bytes at
+    a time, hashing as it goes, so large uploads never sit in memory whole.
+    Returns (path, sha, size); hand the path to put_blob_file() (or unlink it).
+    """
+    spool_dir = Path(root) / BLOBS_DIR / SPOOL_DIR
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    path = spool_dir / f"upload.{os.getpid()}.{time.monotonic_ns()}.tmp"
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+            sync(f)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path, h.hexdigest(), size
+
+
+def put_blob_file(root, path, sha=None):
+    """
+    Move a file (e.g. from spool()) into the blob store by renaming it; it must be
+    on the same filesystem. If the content is already stored the file is deleted.
+    Cheap enough to call under store_lock when `sha` is given. Returns (sha, size).
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    if sha is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(SPOOL_CHUNK), b""):
+                h.update(chunk)
+        sha = h.hexdigest()
+    target = blob_path(root, sha)
+    if _reuse_blob(target):
+        path.unlink()
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+    return sha, size
+
+
+def read_blob(root, sha):
+    with open(blob_path(root, sha), "rb") as f:
+        return f.read()
+
+
+# ---------------------------------------------------------------------------
+# Packed, compressed OCR text segments
+# ---------------------------------------------------------------------------
+
+def _segments_dir(root):
+    return Path(root) / SEGMENTS_DIR
+
+
+def _current_segment(root):
+    """Name of the segment to append to (a new one once the last is full)."""
+    seg_dir = _segments_dir(root)
+    seg_dir.mkdir(parents=True, exist_ok=True)
+    existing = sorted(p.name for p in seg_dir.glob("seg-*.pack"))
+    if existing:
+        last = existing[-1]
+        if (seg_dir / last).stat().st_size < SEGMENT_MAX_BYTES:
+            return last
+        number = int(last[4:-5]) + 1
+    else:
+        number = 0
+    return f"seg-{number:06d}.pack"
+
+
+def encode_text(text, codec=None):
+    """
+    Compress `text` for a segment (done outside the lock).
+    Returns {"payload", "codec", "text_sha"}.
+    """
+    raw = text.encode("utf-8")
+    payload, codec = compress(raw, codec)
+    return {"payload": payload, "codec": codec, "text_sha": hashlib.sha256(raw).hexdigest()}
+
+
+def append_encoded(root, encoded):
+    """
+    Append an encode_text() payload to the current segment (caller holds store_lock).
+    Returns a location dict: {"seg", "offset", "length", "codec", "text_sha"}.
+    """
+    seg = _current_segment(root)
+    with open(_segments_dir(root) / seg, "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(encoded["payload"])
+        sync(f)
+    return {"seg": seg, "offset": offset, "length": len(encoded["payload"]),
+            "codec": encoded["codec"], "text_sha": encoded["text_sha"]}
+
+
+def _segment_view(root, seg, end):
+    """mmap of a segment that covers at least `end` bytes (remapped after appends)."""
+    path = str(_segments_dir(root) / seg)
+    mm = _mmaps.get(path)
+    if mm is None or len(mm) < end:
+        if mm is not None:
+            mm.close()
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _mmaps[path] = mm
+    return mm
+
+
+def read_text(root, record):
+    """Read and decompress the OCR text referenced by an index record."""
+    offset, length = record["offset"], record["length"]
+    mm = _segment_view(root, record["seg"], offset + length)
+    return decompress(mm[offset:offset + length], record["codec"]).decode("utf-8")
+
+
+# ---------------------------------------------------------------------------
+# Index (form_id -> filename, blob and text location)
+# ---------------------------------------------------------------------------
+
+def append_record(root, record):
+    """Append (commit) one form record to the index (caller holds store_lock)."""
+    append_line(Path(root) / INDEX_FILE, json.dumps(record, ensure_ascii=False))
+
+
+def _apply_record(records, record):
+    """Apply one index.jsonl line to {form_id: record}."""
+    if record.get("deleted"):
+        records.pop(record.get("form_id"), None)
+    else:
+        records[record["form_id"]] = record
+
+
+def load_records(root):
+    """
+    All form records in ingest order, as {form_id: record}.
+    Only bytes appended since the previous call are parsed; later records for the
+    same form_id replace earlier ones, and {"form_id", "deleted": true} removes it.
+    """
+    path = Path(root) / INDEX_FILE
+    return load_appended(path, _index_cache.setdefault(str(path), {}), dict, _apply_record)
+
+
+def index_version(root):
+    """Opaque value that changes whenever load_records(root) would return new data."""
+    load_records(root)
+    cache = _index_cache[str(Path(root) / INDEX_FILE)]
+    return cache["ident"], cache["pos"]
+
+
+def read_texts(root, records):
+    """Read many texts in (segment, offset) order. Returns {form_id: text}."""
+    ordered = sorted(records, key=lambda r: (r["seg"], r["offset"]))
+    return {r["form_id"]: read_text(root, r) for r in ordered}
+
+
+# ---------------------------------------------------------------------------
+# Consistency check / crash recovery
+# ---------------------------------------------------------------------------
+
+def fsck(root, repair=False, deep=False):
+    """
+    Check the blob store for crash damage (caller holds store_lock).
+
+    Checks: torn/corrupt index lines, records whose text range is missing or (with
+    `deep`) fails to decompress or match its hash, missing blobs, uncommitted bytes
+    at segment tails, and unreferenced blobs or stale temp files older than
+    ORPHAN_GRACE_SECONDS. With `repair`, torn tails and corrupt lines are removed,
+    unreadable records get a tombstone, uncommitted segment tails are truncated and
+    orphans are deleted. Missing blobs are only reported.
+    """
+    root = Path(root)
+    report = {"records": 0, "torn_index_bytes": 0, "corrupt_index_lines": 0, "bad_records": [],
+              "missing_blobs": [], "uncommitted_segment_bytes": 0, "orphan_segment_bytes": 0,
+              "orphan_blobs": [], "stale_temp_files": []}
+    index_path = root / INDEX_FILE
+
+    # 1) Index: torn last line and unparseable lines
+    if repair:
+        report["torn_index_bytes"] = repair_torn_tail(index_path)
+    good_lines, records, all_records = [], {}, []
+    if index_path.exists():
+        with open(index_path, "rb") as f:
+            data = f.read()
+        if not repair and data and not data.endswith(b"\n"):
+            report["torn_index_bytes"] = len(data) - (data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+        for line in data.splitlines():
+            try:
+                record = json.loads(line)
+                record["form_id"]
+            except (ValueError, KeyError, TypeError):
+                report["corrupt_index_lines"] += 1
+                continue
+            good_lines.append(line)
+            if record.get("deleted"):
+                records.pop(record["form_id"], None)
+            else:
+                records[record["form_id"]] = record
+                all_records.append(record)
+        if repair and report["corrupt_index_lines"]:
+            write_atomic(index_path, b"".join(line + b"\n" for line in good_lines))
+            _index_cache.pop(str(index_path), None)
+    report["records"] = len(records)
+
+    # 2) Records: text range (and content with `deep`) and blob presence
+    seg_dir = _segments_dir(root)
+    seg_sizes = {p.name: p.stat().st_size for p in seg_dir.glob("seg-*.pack")} if seg_dir.exists() else {}
+    for form_id, record in records.items():
+        problem = None
+        end = record.get("offset", 0) + record.get("length", 0)
+        if record.get("seg") not in seg_sizes:
+            problem = "segment missing"
+        elif end > seg_sizes[record["seg"]]:
+            problem = "text range beyond end of segment"
+        elif deep:
+            try:
+                text = read_text(root, record)
+                if hashlib.sha256(text.encode("utf-8")).hexdigest() != record.get("text_sha"):
+                    problem = "text hash mismatch"
+            except Exception as exc:
+                problem = f"text unreadable: {exc}"
+        if problem:
+            report["bad_records"].append({"form_id": form_id, "problem": problem})
+        blob = blob_path(root, record["file_sha"])
+        if not blob.exists():
+            report["missing_blobs"].append(form_id)
+        elif deep:
+            with open(blob, "rb") as f:
+                if hashlib.sha256(f.read()).hexdigest() != record["file_sha"]:
+                    report["missing_blobs"].append(form_id)
+    if repair:
+        for bad in report["bad_records"]:
+            append_record(root, {"form_id": bad["form_id"], "deleted": True, "reason": bad["problem"]})
+
+    # 3) Segments: bytes written by transactions that never committed
+    committed = {}
+    for record in all_records:
+        ranges = committed.setdefault(record.get("seg"), [])
+        ranges.append((record.get("offset", 0), record.get("offset", 0) + record.get("length", 0)))
+    for seg, size in seg_sizes.items():
+        ranges = committed.get(seg, [])
+        end = max((e for _, e in ranges), default=0)
+        used = sum(e - s for s, e in set(ranges))
+        if size > end:
+            report["uncommitted_segment_bytes"] += size - end
+            if repair:
+                mm = _mmaps.pop(str(seg_dir / seg), None)
+                if mm is not None:
+                    mm.close()
+                with open(seg_dir / seg, "r+b") as f:
+                    f.truncate(end)
+                    sync(f)
+        report["orphan_segment_bytes"] += max(0, min(size, end) - used)
+
+    # 4) Blobs nobody references, and temp files left by crashed writers
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    referenced = {r["file_sha"] for r in all_records}
+    for path in (root / BLOBS_DIR).glob("*/*") if (root / BLOBS_DIR).exists() else []:
+        if path.stat().st_mtime > cutoff:
+            continue
+        if path.name.endswith(".tmp"):
+            report["stale_temp_files"].append(str(path.relative_to(root)))
+        elif path.name not in referenced:
+            report["orphan_blobs"].append(path.name)
+        else:
+            continue
+        if repair:
+            path.unlink()
+    return report
@@ -0,0 +1,235 @@
+"""
+Near-duplicate detection for saved forms.
+
+Each form's OCR text gets a MinHash signature over word 3-gram shingles at
+ingest. Signatures are appended to `fingerprints.jsonl` in the forms store and
+indexed with banded LSH, so finding near-duplicates of a new form only touches
+forms that share at least one band instead of scanning the whole store.
+
+CLI (rebuild fingerprints for an existing store and report duplicate groups):
+    python -m src.utils.dedup [--threshold 0.85] [--rebuild]
+"""
+
+import json
+import re
+import struct
+import zlib
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+DEFAULT_THRESHOLD = 0.85
+FINGERPRINTS_FILE = "fingerprints.jsonl"
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _permutations():
+    """Fixed (a, b) pairs for the universal hash family, identical in every process."""
+    perms = []
+    state = 0x9E3779B97F4A7C15
+    for _ in range(NUM_PERM):
+        state = (state * 6364136223846793005 + 1442695040888963407) & ((1 << 64) - 1)
+        a = (state >> 3) % (_MERSENNE_PRIME - 1) + 1
+        state = (state * 6364136223846793005 + 1442695040888963407) & ((1 << 64) - 1)
+        b = (state >> 3) % _MERSENNE_PRIME
+        perms.append((a, b))
+    return perms
+
+
+_PERMS = _permutations()
+_perm_arrays = None
+
+
+def _mod_mersenne(v, np):
+    """`v % (2**61 - 1)` for a uint64 array, without overflow."""
+    p = np.uint64(_MERSENNE_PRIME)
+    v = (v & p) + (v >> np.uint64(61))
+    return np.where(v >= p, v - p, v)
+
+
+def _get_perm_arrays(np):
+    """_PERMS as uint64 column vectors (a split into high and low 32 bits, b)."""
+    global _perm_arrays
+    if _perm_arrays is None:
+        a = np.array([a for a, _ in _PERMS], dtype=np.uint64)[:, None]
+        b = np.array([b for _, b in _PERMS], dtype=np.uint64)[:, None]
+        _perm_arrays = (a >> np.uint64(32), a & np.uint64(_MAX_HASH), b)
+    return _perm_arrays
+
+
+def _shingles(text):
+    """Set of crc32 hashes of normalized word 3-grams."""
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8"))
+            for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash(text):
+    """
+    MinHash signature of `text` as a tuple of NUM_PERM 32-bit ints,
+    or None when the text has no words (blank OCR is never a duplicate).
+    """
+    hashes = _shingles(text)
+    if not hashes:
+        return None
+    import numpy as np
+
+    # (a * x + b) mod p for every permutation and shingle at once. a * x does not fit
+    # in 64 bits, so a is split as a_hi * 2**32 + a_lo and 2**61 == 1 (mod p) is used
+    # to fold a_hi * x * 2**32 back below p.
+    a_hi, a_lo, b = _get_perm_arrays(np)
+    x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))[None, :]
+    hi = a_hi * x
+    hi = (hi >> np.uint64(29)) + ((hi & np.uint64((1 << 29) - 1)) << np.uint64(32))
+    lo = _mod_mersenne(a_lo * x, np)
+    values = _mod_mersenne(_mod_mersenne(hi, np) + lo + b, np)
+    return tuple(int(v) & _MAX_HASH for v in values.min(axis=1))
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def encode_signature(sig):
+    return struct.pack(f"<{NUM_PERM}I", *sig).hex()
+
+
+def decode_signature(value):
+    return struct.unpack(f"<{NUM_PERM}I", bytes.fromhex(value))
+
+
+class DedupIndex:
+    """
+    In-memory banded LSH index over MinHash signatures.
+    `duplicate_of` maps flagged forms to the form they duplicate.
+    """
+
+    def __init__(self):
+        self.signatures = {}
+        self.duplicate_of = {}
+        self._buckets = [dict() for _ in range(BANDS)]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def add(self, form_id, sig, duplicate_of=None):
+        if duplicate_of:
+            self.duplicate_of[form_id] = duplicate_of
+        if sig is None:
+            return
+        self.signatures[form_id] = sig
+        for band, buckets in enumerate(self._buckets):
+            key = sig[band * ROWS:(band + 1) * ROWS]
+            buckets.setdefault(key, []).append(form_id)
+
+    def remove(self, form_id):
+        """Drop a deleted form; forms flagged as its duplicates stop being flagged."""
+        sig = self.signatures.pop(form_id, None)
+        self.duplicate_of.pop(form_id, None)
+        for flagged in [f for f, original in self.duplicate_of.items() if original == form_id]:
+            del self.duplicate_of[flagged]
+        if sig is None:
+            return
+        for band, buckets in enumerate(self._buckets):
+            key = sig[band * ROWS:(band + 1) * ROWS]
+            ids = buckets.get(key)
+            if ids and form_id in ids:
+                ids.remove(form_id)
+                if not ids:
+                    del buckets[key]
+
+    def add_entry(self, entry):
+        """Apply one fingerprints.jsonl record ({"form_id", "deleted": true} removes the form)."""
+        if entry.get("deleted"):
+            self.remove(entry["form_id"])
+            return
+        sig = decode_signature(entry["sig"]) if entry.get("sig") else None
+        self.add(entry["form_id"], sig, entry.get("duplicate_of"))
+
+    def candidates(self, sig):
+        """Form IDs sharing at least one LSH band with `sig`."""
+        found = set()
+        for band, buckets in enumerate(self._buckets):
+            found.update(buckets.get(sig[band * ROWS:(band + 1) * ROWS], ()))
+        return found
+
+    def query(self, sig, threshold=DEFAULT_THRESHOLD):
+        """Return [(form_id, similarity)] of indexed forms at or above `threshold`, best first."""
+        if sig is None:
+            return []
+        matches = []
+        for form_id in self.candidates(sig):
+            sim = similarity(sig, self.signatures[form_id])
+            if sim >= threshold:
+                matches.append((form_id, sim))
+        return sorted(matches, key=lambda m: (-m[1], m[0]))
+
+    def find_duplicate(self, sig, threshold=DEFAULT_THRESHOLD):
+        """
+        Best near-duplicate for `sig`, resolved to the original form (never to a
+        form that is itself flagged as a duplicate). Returns (form_id, similarity) or None.
+        """
+        for form_id, sim in self.query(sig, threshold):
+            return self.duplicate_of.get(form_id, form_id), sim
+        return None
+
+    def groups(self, threshold=DEFAULT_THRESHOLD):
+        """All near-duplicate groups (lists of 2+ form IDs) via LSH candidates + union-find."""
+        parent = {}
+
+        def find(x):
+            while parent.get(x, x) != x:
+                parent[x] = parent.get(parent[x], parent[x])
+                x = parent[x]
+            return x
+
+        for form_id, sig in self.signatures.items():
+            for other, _ in self.query(sig, threshold):
+                if other != form_id:
+                    ra, rb = find(form_id), find(other)
+                    if ra != rb:
+                        parent[max(ra, rb)] = min(ra, rb)
+        members = {}
+        for form_id in self.signatures:
+            members.setdefault(find(form_id), []).append(form_id)
+        return [sorted(ids) for ids in members.values() if len(ids) > 1]
+
+
+def fingerprint_line(form_id, sig, duplicate_of=None):
+    """One fingerprints.jsonl line (without newline)."""
+    entry = {"form_id": form_id, "sig": encode_signature(sig) if sig else None}
+    if duplicate_of:
+        entry["duplicate_of"] = duplicate_of
+    return json.dumps(entry)
+
+
+def main(argv=None):
+    import argparse
+
+    from . import storage
+
+    parser = argparse.ArgumentParser(description="Find near-duplicate forms in the forms store.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Recompute fingerprints for every stored form and re-flag duplicates")
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        flagged = storage.rebuild_fingerprints(threshold=args.threshold)
+        print(f"Rebuilt fingerprints; {flagged} form(s) flagged as near-duplicates.")
+    index = storage.get_dedup_index()
+    groups = index.groups(args.threshold)
+    print(f"{len(index)} fingerprinted form(s), {len(groups)} near-duplicate group(s).")
+    for group in groups:
+        print("  " + ", ".join(f"{fid} ({storage.get_form_filename(fid)})" for fid in group))
+
+
+if __name__ == "__main__":
+    main()
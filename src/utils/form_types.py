@@ -0,0 +1,98 @@
+"""
+Form-type detection by layout fingerprint.
+
+A form's layout is its heading (first line without a "label: value" shape) and
+the set of field labels on "label: value" lines, normalized so that numbering
+and OCR noise ("Loan Amount (1):", "LOAN  AMOUNT:") collapse together. Forms
+with the same heading and overlapping labels (Jaccard >= TYPE_THRESHOLD) share
+a type. Assignments are appended to `form_types.jsonl` in the forms store at
+ingest; the first form of a new type also records the type's heading and labels.
+
+No LLM call is needed, so every saved form gets a type even without an API key.
+"""
+
+import json
+import re
+import zlib
+
+FORM_TYPES_FILE = "form_types.jsonl"
+TYPE_THRESHOLD = 0.5
+MAX_LABEL_WORDS = 6
+
+_LABEL_LINE = re.compile(r"^\s*([^:\n]{1,60}?)\s*:\s*\S")
+_WORD = re.compile(r"[a-z]+")
+
+
+def normalize_label(label):
+    """Lowercase letters-only words of a label ("Loan Amount (1)" -> "loan amount")."""
+    return " ".join(_WORD.findall(label.lower()))
+
+
+def layout_signature(ocr_text):
+    """
+    (heading, labels) of a form: `heading` is the normalized first non-label
+    line (or ""), `labels` the sorted distinct normalized field labels.
+    """
+    heading = None
+    labels = set()
+    for line in ocr_text.splitlines():
+        if not line.strip():
+            continue
+        match = _LABEL_LINE.match(line)
+        label = normalize_label(match.group(1)) if match else ""
+        if match and label and len(label.split()) <= MAX_LABEL_WORDS:
+            labels.add(label)
+            if heading is None:
+                heading = ""
+        elif heading is None:
+            heading = normalize_label(line)
+    return heading or "", sorted(labels)
+
+
+def _jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def type_id_for(heading, labels):
+    """Readable, stable id for a new type: heading slug plus a hash of its labels."""
+    slug = "-".join(heading.split()[:5]) or "form"
+    return f"{slug}-{zlib.crc32(json.dumps(labels).encode('utf-8')):08x}"
+
+
+class TypeIndex:
+    """Known types (id -> heading, labels) and per-form assignments."""
+
+    def __init__(self):
+        self.types = {}
+        self.form_type = {}
+
+    def add(self, form_id, form_type, heading=None, labels=None):
+        if labels is not None and form_type not in self.types:
+            self.types[form_type] = {"heading": heading or "", "labels": set(labels)}
+        self.form_type[form_id] = form_type
+
+    def add_entry(self, entry):
+        """Apply one form_types.jsonl record."""
+        self.add(entry["form_id"], entry["form_type"], entry.get("heading"), entry.get("labels"))
+
+    def match(self, heading, labels):
+        """Best known type for a layout, or None."""
+        labels = set(labels)
+        best, best_sim = None, TYPE_THRESHOLD
+        for form_type, info in self.types.items():
+            if info["heading"] != heading:
+                continue
+            sim = _jaccard(labels, info["labels"])
+            if sim >= best_sim:
+                best, best_sim = form_type, sim
+        return best
+
+
+def form_type_line(form_id, form_type, heading=None, labels=None):
+    """One form_types.jsonl line (without newline); heading/labels only for a new type."""
+    entry = {"form_id": form_id, "form_type": form_type}
+    if labels is not None:
+        entry.update(heading=heading, labels=list(labels))
+    return json.dumps(entry, ensure_ascii=False)
@@ -0,0 +1,92 @@
+"""
+Inverted term index for filtering forms by filename or content.
+
+Each saved form appends one line to `terms.jsonl` in the forms store with the
+distinct terms of its filename and OCR text. The index is loaded incrementally
+(like the fingerprint index) and answers "forms containing all these terms"
+by intersecting posting sets, smallest first, so filtering a page of a large
+store does not read any OCR text.
+"""
+
+import bisect
+import json
+import re
+
+TERMS_FILE = "terms.jsonl"
+MAX_TERMS_PER_FORM = 4000
+_TERM = re.compile(r"[a-z0-9]{2,}")
+
+
+def tokenize(text):
+    """Distinct lowercase alphanumeric terms (2+ characters) in `text`."""
+    return set(_TERM.findall(text.lower()))
+
+
+def form_terms(filename, ocr_text):
+    """Terms indexed for one form: filename terms plus up to MAX_TERMS_PER_FORM content terms."""
+    terms = tokenize(filename)
+    content = tokenize(ocr_text)
+    if len(content) > MAX_TERMS_PER_FORM:
+        content = set(sorted(content, key=lambda t: (-len(t), t))[:MAX_TERMS_PER_FORM])
+    return sorted(terms | content)
+
+
+def terms_line(form_id, terms):
+    """One terms.jsonl line (without newline)."""
+    return json.dumps({"form_id": form_id, "terms": terms}, ensure_ascii=False)
+
+
+class TermIndex:
+    """In-memory postings: term -> set of form IDs."""
+
+    def __init__(self):
+        self.postings = {}
+        self.indexed = set()
+        self._sorted_terms = None  # rebuilt lazily for prefix lookups
+
+    def add(self, form_id, terms):
+        self.indexed.add(form_id)
+        for term in terms:
+            ids = self.postings.get(term)
+            if ids is None:
+                ids = self.postings[term] = set()
+                self._sorted_terms = None
+            ids.add(form_id)
+
+    def add_entry(self, entry):
+        """Apply one terms.jsonl record."""
+        self.add(entry["form_id"], entry.get("terms", []))
+
+    def _prefix_matches(self, prefix):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self.postings)
+        matched = set()
+        i = bisect.bisect_left(self._sorted_terms, prefix)
+        while i < len(self._sorted_terms) and self._sorted_terms[i].startswith(prefix):
+            matched |= self.postings[self._sorted_terms[i]]
+            i += 1
+        return matched
+
+    def search(self, query):
+        """
+        Form IDs whose filename or text contains every term of `query`.
+        The last query term also matches as a prefix, so partial typing works.
+        """
+        terms = sorted(tokenize(query))
+        if not terms:
+            return None  # no filter
+        words = _TERM.findall(query.lower())
+        last = words[-1] if words else None
+        sets = []
+        for term in terms:
+            if term == last:
+                sets.append(self._prefix_matches(term))
+            else:
+                sets.append(self.postings.get(term, set()))
+        sets.sort(key=len)
+        result = set(sets[0])
+        for other in sets[1:]:
+            result &= other
+            if not result:
+                break
+        return result
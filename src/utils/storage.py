@@ -1,43 +1,378 @@
+import base64
+import bisect
+import json
+import os
+import time
 import uuid
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+
+from . import blobstore, vector_index
+from .dedup import DEFAULT_THRESHOLD, FINGERPRINTS_FILE, DedupIndex, fingerprint_line, minhash
+from .form_types import FORM_TYPES_FILE, TypeIndex, form_type_line, layout_signature, type_id_for
+from .search_index import TERMS_FILE, TermIndex, form_terms, terms_line
 
 
 FORMS_DB_DIR = Path("data/forms_db")
 
+# Forms are stored in a content-addressed blob store (see blobstore.py). Stores
+# written by older versions keep one directory per form_id with the original file
+# and ocr_text.txt; those are still read, and migrate_legacy_forms() converts them.
+LEGACY_OCR_FILE = "ocr_text.txt"
+LOST_FOUND_DIR = "lost+found"
+
+# Near-duplicate, term and form-type indexes; only lines appended since the last call are read
+_dedup_cache = {}
+_terms_cache = {}
+_types_cache = {}
+
+# Sorted listing keys per (store version, sort order, filter)
+_listing_cache = {}
+_LISTING_CACHE_SIZE = 8
+
+
+def _fingerprints_path() -> Path:
+    return FORMS_DB_DIR / FINGERPRINTS_FILE
+
+
+def get_dedup_index() -> DedupIndex:
+    """
+    Get the near-duplicate (MinHash/LSH) index for the current store.
+    
+    Returns:
+        DedupIndex loaded from fingerprints.jsonl (kept up to date incrementally)
+    """
+    return blobstore.load_appended(_fingerprints_path(), _dedup_cache, DedupIndex, DedupIndex.add_entry)
+
+
+def _terms_path() -> Path:
+    return FORMS_DB_DIR / TERMS_FILE
+
+
+def get_term_index() -> TermIndex:
+    """
+    Get the filename/content term index for the current store.
+    Forms saved before the index existed are indexed on first use.
+    
+    Returns:
+        TermIndex loaded from terms.jsonl (kept up to date incrementally)
+    """
+    path = _terms_path()
+    index = blobstore.load_appended(path, _terms_cache, TermIndex, TermIndex.add_entry)
+    missing = [entry for entry in _listing_entries() if entry["form_id"] not in index.indexed]
+    if missing:
+        lines = [terms_line(e["form_id"], form_terms(e["filename"], get_form_text(e["form_id"]) or ""))
+                 for e in missing]
+        with blobstore.store_lock(FORMS_DB_DIR):
+            for line in lines:
+                blobstore.append_line(path, line)
+        return get_term_index()
+    return index
+
+
+def _types_path() -> Path:
+    return FORMS_DB_DIR / FORM_TYPES_FILE
+
+
+def _load_type_index() -> TypeIndex:
+    return blobstore.load_appended(_types_path(), _types_cache, TypeIndex, TypeIndex.add_entry)
+
+
+def _record_form_type(form_id: str, heading: str, labels: List[str]) -> str:
+    """Assign a form to a known type or register a new one (caller holds the store lock)."""
+    form_type = _load_type_index().match(heading, labels)
+    if form_type is None:
+        form_type = type_id_for(heading, labels)
+        line = form_type_line(form_id, form_type, heading, labels)
+    else:
+        line = form_type_line(form_id, form_type)
+    blobstore.append_line(_types_path(), line)
+    _load_type_index()
+    return form_type
+
+
+def get_type_index(backfill: bool = True) -> TypeIndex:
+    """
+    Get the form-type index (layout fingerprints) for the current store.
+    Forms saved before types were detected are assigned on first use.
+    
+    Args:
+        backfill: If False, return the stored assignments as they are (never writes)
+    
+    Returns:
+        TypeIndex loaded from form_types.jsonl (kept up to date incrementally)
+    """
+    index = _load_type_index()
+    if not backfill:
+        return index
+    version = (str(FORMS_DB_DIR), blobstore.index_version(FORMS_DB_DIR), len(_legacy_form_dirs()))
+    if _types_cache.get("checked") == version:
+        return index
+    missing = [entry["form_id"] for entry in _listing_entries() if entry["form_id"] not in index.form_type]
+    if missing:
+        layouts = [(form_id, layout_signature(get_form_text(form_id) or "")) for form_id in missing]
+        with blobstore.store_lock(FORMS_DB_DIR):
+            for form_id, (heading, labels) in layouts:
+                if form_id not in _load_type_index().form_type:
+                    _record_form_type(form_id, heading, labels)
+        index = _load_type_index()
+    _types_cache["checked"] = version
+    return index
+
+
+def get_form_type(form_id: str) -> Optional[str]:
+    """
+    Get the detected type of a stored form.
+    
+    Args:
+        form_id: The form ID
+    
+    Returns:
+        Form type ID (e.g. "loan-application-form-1a2b3c4d"), or None if the form does not exist
+    """
+    form_type = _load_type_index().form_type.get(form_id)
+    if form_type is None and get_form_text(form_id) is not None:
+        form_type = get_type_index().form_type.get(form_id)
+    return form_type
+
+
+def get_vector_index() -> "vector_index.VectorIndex":
+    """
+    Get the semantic passage index for the current store.
+    Forms saved without vectors are embedded on first use; a store built with a
+    different embedder is rebuilt, and stale IVF lists are retrained.
+    
+    Returns:
+        VectorIndex (kept up to date incrementally)
+    """
+    embedder = vector_index.get_embedder()
+    meta = vector_index.read_meta(FORMS_DB_DIR)
+    if meta is not None and (meta.get("model"), meta.get("dim")) != (embedder.name, embedder.dim):
+        rebuild_vector_index()
+    
+    index = vector_index.load_vector_index(FORMS_DB_DIR)
+    missing = [entry["form_id"] for entry in _listing_entries() if entry["form_id"] not in index.form_rows]
+    if missing:
+        embedded = [(form_id, vector_index.embed_form(get_form_text(form_id) or "", embedder))
+                    for form_id in missing]
+        with blobstore.store_lock(FORMS_DB_DIR):
+            for form_id, (passages, vectors) in embedded:
+                vector_index.append_form(FORMS_DB_DIR, form_id, passages, vectors, embedder)
+        index = vector_index.load_vector_index(FORMS_DB_DIR)
+    if vector_index.ivf_is_stale(FORMS_DB_DIR):
+        with blobstore.store_lock(FORMS_DB_DIR):
+            if vector_index.ivf_is_stale(FORMS_DB_DIR):
+                vector_index.build_ivf(FORMS_DB_DIR)
+    return index
+
+
+def rebuild_vector_index() -> int:
+    """
+    Re-embed every stored form with the current embedder.
+    
+    Returns:
+        Number of passages indexed
+    """
+    FORMS_DB_DIR.mkdir(parents=True, exist_ok=True)
+    with blobstore.store_lock(FORMS_DB_DIR):
+        forms = ((entry["form_id"], get_form_text(entry["form_id"]) or "") for entry in _listing_entries())
+        return vector_index.build(FORMS_DB_DIR, forms)
+
 
-def save_form(file_bytes: bytes, filename: str, ocr_text: str) -> str:
+def semantic_search(questions: List[str], top_k: int = 5, form_ids: Optional[List[str]] = None,
+                    include_duplicates: bool = False) -> List[List[dict]]:
+    """
+    Find the forms whose passages best match each question (batched over questions).
+    
+    Args:
+        questions: Question strings
+        top_k: Number of forms to return per question
+        form_ids: Optional form IDs to restrict the search to
+        include_duplicates: Also return forms flagged as near-duplicates
+    
+    Returns:
+        One list per question of {"form_id", "score", "offset", "length", "snippet"},
+        best form first; offset/length locate the best passage in the form's OCR text
+    """
+    if not questions:
+        return []
+    index = get_vector_index()
+    valid = {entry["form_id"] for entry in _listing_entries()}
+    if not include_duplicates:
+        valid -= set(get_dedup_index().duplicate_of)
+    if form_ids is not None:
+        valid &= set(form_ids)
+    
+    positions = {form_id: pos for pos, form_id in enumerate(index.form_ids)}
+    form_filter = {positions[f] for f in valid if f in positions} if form_ids is not None else None
+    # Several passages of one form can rank high; over-fetch before collapsing to forms
+    scores, rows = index.search(vector_index.get_embedder().embed(list(questions)),
+                                k=top_k * 8, form_filter=form_filter)
+    row_form = index.row_form()
+    
+    results = []
+    for q_scores, q_rows in zip(scores, rows):
+        hits = {}
+        for score, row in zip(q_scores, q_rows):
+            if row < 0:
+                continue
+            form_id = index.form_ids[row_form[row]]
+            if form_id in valid and form_id not in hits:
+                first_row, passages = index.form_rows[form_id]
+                offset, length = passages[row - first_row]
+                hits[form_id] = {"form_id": form_id, "score": float(score), "offset": offset, "length": length}
+                if len(hits) == top_k:
+                    break
+        for hit in hits.values():
+            text = get_form_text(hit["form_id"]) or ""
+            hit["snippet"] = text[hit["offset"]:hit["offset"] + hit["length"]]
+        results.append(list(hits.values()))
+    return results
+
+
+def _record_fingerprint(form_id: str, sig, duplicate_of: Optional[str]) -> None:
+    """Append a fingerprint (caller holds the store lock)."""
+    blobstore.append_line(_fingerprints_path(), fingerprint_line(form_id, sig, duplicate_of))
+
+
+def get_duplicate_of(form_id: str) -> Optional[str]:
+    """
+    Get the original form a form was flagged as a near-duplicate of.
+    
+    Args:
+        form_id: The form ID
+    
+    Returns:
+        form_id of the original, or None if the form is not a duplicate
+    """
+    return get_dedup_index().duplicate_of.get(form_id)
+
+
+def save_form(file_bytes: Optional[bytes], filename: str, ocr_text: str,
+              on_duplicate: str = "flag", dedup_threshold: float = DEFAULT_THRESHOLD,
+              file_path: Optional[Path] = None, file_sha: Optional[str] = None) -> str:
     """
     Save uploaded form file and OCR text to forms_db.
     
     Args:
-        file_bytes: Original file content
+        file_bytes: Original file content (None when file_path is given)
         filename: Original filename
         ocr_text: Extracted OCR text
+        on_duplicate: What to do when the OCR text is a near-duplicate of a saved form:
+            "flag" saves it but marks it as a duplicate (excluded from queries by default),
+            "merge" saves nothing and returns the existing form's ID,
+            "keep" saves it as a normal form
+        dedup_threshold: Minimum estimated Jaccard similarity to count as a near-duplicate
+        file_path: Spooled upload (see spool_upload) to move into the store instead of
+            copying file_bytes; save_form takes ownership and moves or deletes it
+        file_sha: SHA-256 of file_path if already known (skips re-hashing)
     
     Returns:
-        form_id: Unique identifier for the saved form
+        form_id: Unique identifier for the saved form (or the existing form when merged)
     """
-    # Generate unique form ID
-    form_id = str(uuid.uuid4())
+    if on_duplicate not in ("flag", "merge", "keep"):
+        raise ValueError(f"on_duplicate must be 'flag', 'merge' or 'keep', got {on_duplicate!r}")
     
-    # Create form directory
-    form_dir = FORMS_DB_DIR / form_id
-    form_dir.mkdir(parents=True, exist_ok=True)
+    # Fingerprint OCR text; skip all writes if it will be merged anyway
+    sig = minhash(ocr_text)
+    if on_duplicate == "merge":
+        match = get_dedup_index().find_duplicate(sig, dedup_threshold)
+        if match:
+            if file_path is not None:
+                Path(file_path).unlink(missing_ok=True)
+            return match[0]
     
-    # Save original file
-    file_path = form_dir / filename
-    with open(file_path, 'wb') as f:
-        f.write(file_bytes)
+    # Expensive work outside the lock: blob write (atomic rename), compression, terms.
+    # A spooled file is only renamed, which is cheap, so it is moved under the lock.
+    if file_path is None:
+        file_sha, file_size = blobstore.put_blob(FORMS_DB_DIR, file_bytes)
+    encoded = blobstore.encode_text(ocr_text)
+    terms = form_terms(filename, ocr_text)
+    heading, labels = layout_signature(ocr_text)
+    passages = vectors = None
+    if vector_index.EMBED_AT_INGEST:
+        try:
+            passages, vectors = vector_index.embed_form(ocr_text)
+        except Exception:
+            pass  # the form is embedded on the next semantic search instead
     
-    # Save OCR text
-    ocr_path = form_dir / "ocr_text.txt"
-    with open(ocr_path, 'w', encoding='utf-8') as f:
-        f.write(ocr_text)
+    with blobstore.store_lock(FORMS_DB_DIR):
+        # Re-check for near-duplicates against everything committed so far
+        duplicate_of = None
+        if on_duplicate != "keep":
+            match = get_dedup_index().find_duplicate(sig, dedup_threshold)
+            if match:
+                if on_duplicate == "merge":
+                    # Drop what was stored for this upload unless a committed form shares it
+                    # (a concurrent save of the same bytes re-writes its blob under the lock)
+                    if file_path is not None:
+                        Path(file_path).unlink(missing_ok=True)
+                    elif all(r.get("file_sha") != file_sha for r in _records().values()):
+                        blobstore.blob_path(FORMS_DB_DIR, file_sha).unlink(missing_ok=True)
+                    return match[0]
+                duplicate_of = match[0]
+        
+        # fsck (which holds the lock) may have swept a reused orphan blob before we touched it
+        if file_path is not None:
+            file_sha, file_size = blobstore.put_blob_file(FORMS_DB_DIR, file_path, sha=file_sha)
+        elif not blobstore.blob_path(FORMS_DB_DIR, file_sha).exists():
+            blobstore.put_blob(FORMS_DB_DIR, file_bytes)
+        
+        # Generate unique form ID
+        form_id = str(uuid.uuid4())
+        
+        # Text is appended and synced first; the index record then commits the form
+        location = blobstore.append_encoded(FORMS_DB_DIR, encoded)
+        record = {"form_id": form_id, "filename": filename, "file_sha": file_sha,
+                  "file_size": file_size, "text_len": len(ocr_text), "created": time.time()}
+        record.update(location)
+        blobstore.append_record(FORMS_DB_DIR, record)
+        
+        _record_fingerprint(form_id, sig, duplicate_of)
+        blobstore.append_line(_terms_path(), terms_line(form_id, terms))
+        _record_form_type(form_id, heading, labels)
+        if passages is not None:
+            try:
+                vector_index.append_form(FORMS_DB_DIR, form_id, passages, vectors)
+            except Exception:
+                pass  # the form is committed; get_vector_index backfills it
     
     return form_id
 
 
+def spool_upload(stream) -> Tuple[Path, str, int]:
+    """
+    Stream an upload into a temp file inside the forms store in fixed-size chunks.
+    
+    Args:
+        stream: Binary file-like object (e.g. an open file or an upload)
+    
+    Returns:
+        (path, sha256, size): pass path/sha to ocr_path() and save_form(file_path=..., file_sha=...)
+    """
+    return blobstore.spool(FORMS_DB_DIR, stream)
+
+
+def _records() -> Dict[str, dict]:
+    """Index records of forms in the blob store, in ingest order."""
+    return blobstore.load_records(FORMS_DB_DIR)
+
+
+def _legacy_form_dirs():
+    """Per-form directories written by older versions (contain ocr_text.txt)."""
+    if not FORMS_DB_DIR.exists():
+        return []
+    return [d for d in FORMS_DB_DIR.iterdir()
+            if d.is_dir() and (d / LEGACY_OCR_FILE).exists()]
+
+
+def _legacy_filename(form_dir: Path) -> Optional[str]:
+    for file_path in form_dir.iterdir():
+        if file_path.is_file() and file_path.name != LEGACY_OCR_FILE:
+            return file_path.name
+    return None
+
+
 def get_form_filename(form_id: str) -> str:
     """
     Get the original filename for a form_id.
@@ -48,22 +383,67 @@ def get_form_filename(form_id: str) -> str:
     Returns:
         Original filename or form_id if not found
     """
+    record = _records().get(form_id)
+    if record is not None:
+        return record["filename"]
+    
     form_dir = FORMS_DB_DIR / form_id
     if not form_dir.exists() or not form_dir.is_dir():
         return form_id
     
-    # Find the original file (exclude ocr_text.txt)
-    for file_path in form_dir.iterdir():
-        if file_path.is_file() and file_path.name != "ocr_text.txt":
-            return file_path.name
+    return _legacy_filename(form_dir) or form_id
+
+
+def get_form_text(form_id: str) -> Optional[str]:
+    """
+    Get the OCR text of one form.
     
-    return form_id
+    Args:
+        form_id: The form ID
+    
+    Returns:
+        OCR text, or None if the form does not exist
+    """
+    record = _records().get(form_id)
+    if record is not None:
+        return blobstore.read_text(FORMS_DB_DIR, record)
+    
+    ocr_path = FORMS_DB_DIR / form_id / LEGACY_OCR_FILE
+    if ocr_path.exists():
+        with open(ocr_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    return None
 
 
-def load_all_forms_with_names() -> Dict[str, Dict[str, str]]:
+def get_form_file(form_id: str) -> Optional[bytes]:
+    """
+    Get the original uploaded file of one form.
+    
+    Args:
+        form_id: The form ID
+    
+    Returns:
+        File content, or None if the form does not exist
+    """
+    record = _records().get(form_id)
+    if record is not None:
+        return blobstore.read_blob(FORMS_DB_DIR, record["file_sha"])
+    
+    form_dir = FORMS_DB_DIR / form_id
+    filename = _legacy_filename(form_dir) if form_dir.is_dir() else None
+    if filename is None:
+        return None
+    with open(form_dir / filename, 'rb') as f:
+        return f.read()
+
+
+def load_all_forms_with_names(include_duplicates: bool = False) -> Dict[str, Dict[str, str]]:
     """
     Load all forms with their filenames.
     
+    Args:
+        include_duplicates: Also return forms flagged as near-duplicates
+    
     Returns:
         Dictionary mapping form_id to {'filename': str, 'ocr_text': str}
     """
@@ -72,24 +452,340 @@ def load_all_forms_with_names() -> Dict[str, Dict[str, str]]:
     if not FORMS_DB_DIR.exists():
         return forms_dict
     
-    # Iterate through all form directories
-    for form_dir in FORMS_DB_DIR.iterdir():
-        if form_dir.is_dir():
-            form_id = form_dir.name
-            ocr_path = form_dir / "ocr_text.txt"
-            
-            if ocr_path.exists():
-                # Get filename
-                filename = get_form_filename(form_id)
-                
-                # Read OCR text
-                with open(ocr_path, 'r', encoding='utf-8') as f:
-                    ocr_text = f.read()
-                
-                forms_dict[form_id] = {
-                    'filename': filename,
-                    'ocr_text': ocr_text
-                }
+    duplicate_of = {} if include_duplicates else get_dedup_index().duplicate_of
+    
+    # Blob store: read texts in segment order (sequential I/O)
+    records = _records()
+    selected = [r for fid, r in records.items() if fid not in duplicate_of]
+    for form_id, ocr_text in blobstore.read_texts(FORMS_DB_DIR, selected).items():
+        forms_dict[form_id] = {
+            'filename': records[form_id]['filename'],
+            'ocr_text': ocr_text
+        }
+    
+    # Legacy per-form directories
+    for form_dir in _legacy_form_dirs():
+        form_id = form_dir.name
+        if form_id in duplicate_of or form_id in forms_dict:
+            continue
+        with open(form_dir / LEGACY_OCR_FILE, 'r', encoding='utf-8') as f:
+            ocr_text = f.read()
+        forms_dict[form_id] = {
+            'filename': _legacy_filename(form_dir) or form_id,
+            'ocr_text': ocr_text
+        }
     
     return forms_dict
 
+
+def _listing_entries() -> List[dict]:
+    """Lightweight metadata (no OCR text) of every stored form, in ingest order."""
+    entries = [{"form_id": fid, "filename": r["filename"], "created": r.get("created", 0.0),
+                "text_len": r.get("text_len"), "file_size": r.get("file_size")}
+               for fid, r in _records().items()]
+    seen = {e["form_id"] for e in entries} if entries else set()
+    legacy = []
+    for form_dir in _legacy_form_dirs():
+        if form_dir.name not in seen:
+            legacy.append({"form_id": form_dir.name, "filename": _legacy_filename(form_dir) or form_dir.name,
+                           "created": form_dir.stat().st_mtime, "text_len": None, "file_size": None})
+    return entries + sorted(legacy, key=lambda e: e["created"])
+
+
+def _sort_key(entry: dict, sort: str):
+    if sort == "filename":
+        return [entry["filename"].lower(), entry["form_id"]]
+    return [entry["created"], entry["form_id"]]
+
+
+def _encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def _sorted_listing(sort: str, query: Optional[str], include_duplicates: bool):
+    """(sorted keys, entries by form_id) for a sort order and filter, cached per store version."""
+    legacy_count = len(_legacy_form_dirs())
+    get_dedup_index()  # bring the duplicate flags up to date before keying on them
+    cache_key = (str(FORMS_DB_DIR), blobstore.index_version(FORMS_DB_DIR), legacy_count,
+                 (_dedup_cache["ident"], _dedup_cache["pos"]) if not include_duplicates else None,
+                 sort, (query or "").strip().lower(), include_duplicates)
+    cached = _listing_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    entries = _listing_entries()
+    if not include_duplicates:
+        duplicate_of = get_dedup_index().duplicate_of
+        entries = [e for e in entries if e["form_id"] not in duplicate_of]
+    if query and query.strip():
+        matches = get_term_index().search(query)
+        if matches is not None:
+            entries = [e for e in entries if e["form_id"] in matches]
+    by_id = {e["form_id"]: e for e in entries}
+    keys = sorted(_sort_key(e, sort) for e in entries)
+    
+    if len(_listing_cache) >= _LISTING_CACHE_SIZE:
+        _listing_cache.pop(next(iter(_listing_cache)))
+    _listing_cache[cache_key] = (keys, by_id)
+    return keys, by_id
+
+
+def count_forms(include_duplicates: bool = False) -> int:
+    """
+    Count stored forms without reading any OCR text.
+    
+    Args:
+        include_duplicates: Also count forms flagged as near-duplicates
+    
+    Returns:
+        Number of forms
+    """
+    keys, _ = _sorted_listing("created", None, include_duplicates)
+    return len(keys)
+
+
+def list_forms(cursor: Optional[str] = None, limit: int = 50, sort: str = "created",
+               descending: Optional[bool] = None, query: Optional[str] = None,
+               include_duplicates: bool = False) -> Tuple[List[dict], Optional[str]]:
+    """
+    List one page of forms (metadata only, no OCR text).
+    
+    Args:
+        cursor: Opaque cursor from the previous page (None for the first page)
+        limit: Page size
+        sort: "created" (ingest time) or "filename"
+        descending: Sort direction (default: newest first for "created", A-Z for "filename")
+        query: Optional filter; every term must appear in the filename or OCR text
+        include_duplicates: Also list forms flagged as near-duplicates
+    
+    Returns:
+        (items, next_cursor): items are dicts with form_id, filename, created,
+        text_len, file_size and duplicate_of; next_cursor is None on the last page
+    """
+    if sort not in ("created", "filename"):
+        raise ValueError(f"sort must be 'created' or 'filename', got {sort!r}")
+    if descending is None:
+        descending = sort == "created"
+    
+    keys, by_id = _sorted_listing(sort, query, include_duplicates)
+    if descending:
+        end = bisect.bisect_left(keys, _decode_cursor(cursor)) if cursor else len(keys)
+        page_keys = keys[max(0, end - limit):end][::-1]
+        has_more = end - limit > 0
+    else:
+        start = bisect.bisect_right(keys, _decode_cursor(cursor)) if cursor else 0
+        page_keys = keys[start:start + limit]
+        has_more = start + limit < len(keys)
+    
+    duplicate_of = get_dedup_index().duplicate_of
+    items = [dict(by_id[key[1]], duplicate_of=duplicate_of.get(key[1])) for key in page_keys]
+    next_cursor = _encode_cursor(page_keys[-1]) if has_more and page_keys else None
+    return items, next_cursor
+
+
+def get_form_preview(form_id: str, chars: int = 500) -> str:
+    """
+    Get the first characters of a form's OCR text (for on-demand previews).
+    
+    Args:
+        form_id: The form ID
+        chars: Maximum preview length
+    
+    Returns:
+        Preview text ("..." appended when truncated), or "" if the form does not exist
+    """
+    text = get_form_text(form_id) or ""
+    return text[:chars] + "..." if len(text) > chars else text
+
+
+def _form_created(form_id: str) -> float:
+    record = _records().get(form_id)
+    if record is not None:
+        return record.get("created", 0.0)
+    return (FORMS_DB_DIR / form_id).stat().st_mtime
+
+
+def rebuild_fingerprints(threshold: float = DEFAULT_THRESHOLD) -> int:
+    """
+    Recompute fingerprints for every stored form and re-flag near-duplicates.
+    Forms are visited oldest first, so the earliest copy stays the original.
+    
+    Args:
+        threshold: Minimum estimated Jaccard similarity to count as a near-duplicate
+    
+    Returns:
+        Number of forms flagged as duplicates
+    """
+    forms = load_all_forms_with_names(include_duplicates=True)
+    order = sorted(forms, key=lambda fid: (_form_created(fid), fid))
+    
+    lines = []
+    index = DedupIndex()
+    flagged = 0
+    for form_id in order:
+        sig = minhash(forms[form_id]['ocr_text'])
+        match = index.find_duplicate(sig, threshold)
+        duplicate_of = match[0] if match else None
+        flagged += bool(duplicate_of)
+        lines.append(fingerprint_line(form_id, sig, duplicate_of) + "\n")
+        index.add(form_id, sig, duplicate_of)
+    
+    path = _fingerprints_path()
+    with blobstore.store_lock(FORMS_DB_DIR):
+        blobstore.write_atomic(path, "".join(lines))
+    _dedup_cache.clear()
+    return flagged
+
+
+def migrate_legacy_forms() -> int:
+    """
+    Move forms from legacy per-form directories into the blob store,
+    keeping their form IDs. Each directory is removed once its record is written.
+    
+    Returns:
+        Number of forms migrated
+    """
+    migrated = 0
+    for form_dir in sorted(_legacy_form_dirs(), key=lambda d: d.stat().st_mtime):
+        form_id = form_dir.name
+        filename = _legacy_filename(form_dir)
+        file_bytes = b""
+        if filename is not None:
+            with open(form_dir / filename, 'rb') as f:
+                file_bytes = f.read()
+        with open(form_dir / LEGACY_OCR_FILE, 'r', encoding='utf-8') as f:
+            ocr_text = f.read()
+        
+        file_sha, file_size = blobstore.put_blob(FORMS_DB_DIR, file_bytes)
+        encoded = blobstore.encode_text(ocr_text)
+        with blobstore.store_lock(FORMS_DB_DIR):
+            if form_id not in _records():
+                location = blobstore.append_encoded(FORMS_DB_DIR, encoded)
+                record = {"form_id": form_id, "filename": filename or form_id, "file_sha": file_sha,
+                          "file_size": file_size, "text_len": len(ocr_text),
+                          "created": form_dir.stat().st_mtime}
+                record.update(location)
+                blobstore.append_record(FORMS_DB_DIR, record)
+                if form_id not in get_dedup_index().signatures:
+                    _record_fingerprint(form_id, minhash(ocr_text), None)
+        
+        for file_path in form_dir.iterdir():
+            file_path.unlink()
+        form_dir.rmdir()
+        migrated += 1
+    return migrated
+
+
+def fsck(repair: bool = False, deep: bool = False) -> Dict[str, object]:
+    """
+    Check the forms store for damage from crashes or interrupted writes.
+    Runs under the store lock, so it is safe while other processes ingest.
+    
+    Args:
+        repair: Fix what can be fixed (see blobstore.fsck), fingerprint forms whose
+            fingerprint was lost, drop fingerprints of deleted forms, trim torn
+            terms/form-type/passages tails, and move incomplete legacy directories to lost+found/
+        deep: Also decompress every text and verify text/blob hashes
+    
+    Returns:
+        Report dictionary (counts and lists of problems found)
+    """
+    if not FORMS_DB_DIR.exists():
+        return {"records": 0}
+    
+    with blobstore.store_lock(FORMS_DB_DIR):
+        report = blobstore.fsck(FORMS_DB_DIR, repair=repair, deep=deep)
+        
+        # Fingerprints: torn tail, committed forms that never got one, and fingerprints of
+        # deleted (tombstoned) forms, which near-duplicate checks must no longer match
+        path = _fingerprints_path()
+        report["torn_fingerprint_bytes"] = blobstore.repair_torn_tail(path) if repair else 0
+        fingerprinted = set()
+        if path.exists():
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        if entry.get("deleted"):
+                            fingerprinted.discard(entry["form_id"])
+                        else:
+                            fingerprinted.add(entry["form_id"])
+                    except (ValueError, KeyError):
+                        continue
+        records = _records()
+        missing = [fid for fid in records if fid not in fingerprinted]
+        report["unfingerprinted"] = missing
+        live = {entry["form_id"] for entry in _listing_entries()}
+        report["stale_fingerprints"] = sorted(fingerprinted - live)
+        if repair:
+            for form_id in missing:
+                text = blobstore.read_text(FORMS_DB_DIR, records[form_id])
+                _record_fingerprint(form_id, minhash(text), None)
+            for form_id in report["stale_fingerprints"]:
+                blobstore.append_line(path, json.dumps({"form_id": form_id, "deleted": True}))
+        
+        # Term and type indexes: only a torn tail needs fixing; missing entries are backfilled on first use
+        report["torn_terms_bytes"] = blobstore.repair_torn_tail(_terms_path()) if repair else 0
+        report["torn_form_type_bytes"] = blobstore.repair_torn_tail(_types_path()) if repair else 0
+        
+        # Vector index: torn passages line; uncommitted rows are overwritten by the next append
+        passages_path = FORMS_DB_DIR / vector_index.VECTORS_DIR / vector_index.PASSAGES_FILE
+        report["torn_passages_bytes"] = blobstore.repair_torn_tail(passages_path) if repair else 0
+        
+        # Legacy per-form directories left without ocr_text.txt
+        reserved = {blobstore.BLOBS_DIR, blobstore.SEGMENTS_DIR, vector_index.VECTORS_DIR, LOST_FOUND_DIR}
+        incomplete = [d for d in FORMS_DB_DIR.iterdir()
+                      if d.is_dir() and d.name not in reserved and not (d / LEGACY_OCR_FILE).exists()]
+        report["incomplete_legacy_dirs"] = [d.name for d in incomplete]
+        if repair and incomplete:
+            lost_found = FORMS_DB_DIR / LOST_FOUND_DIR
+            lost_found.mkdir(exist_ok=True)
+            for form_dir in incomplete:
+                os.replace(form_dir, lost_found / form_dir.name)
+    
+    return report
+
+
+def main(argv=None):
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Forms store maintenance.")
+    parser.add_argument("command", choices=["migrate", "fsck", "ingest"],
+                        help="migrate: move legacy per-form directories into the blob store; "
+                             "fsck: check the store for crash damage; "
+                             "ingest: OCR and save files, streaming them page by page")
+    parser.add_argument("paths", nargs="*", help="ingest: files to ingest")
+    parser.add_argument("--repair", action="store_true", help="fsck: fix problems that can be fixed")
+    parser.add_argument("--deep", action="store_true", help="fsck: verify every text and blob hash")
+    parser.add_argument("--max-pages", type=int, help="ingest: OCR at most this many pages per file")
+    args = parser.parse_args(argv)
+    
+    if args.command == "ingest":
+        from ..ocr.ocr import MAX_PAGES, ocr_path
+        
+        for path in args.paths:
+            with open(path, 'rb') as f:
+                spooled, sha, size = spool_upload(f)
+            try:
+                text = ocr_path(spooled, path, max_pages=args.max_pages or MAX_PAGES, file_sha=sha)
+            except BaseException:
+                spooled.unlink(missing_ok=True)
+                raise
+            form_id = save_form(None, Path(path).name, text, file_path=spooled, file_sha=sha)
+            print(f"{path}: {size} bytes, {len(text)} chars -> {form_id}")
+    elif args.command == "migrate":
+        print(f"Migrated {migrate_legacy_forms()} form(s) into the blob store.")
+    elif args.command == "fsck":
+        report = fsck(repair=args.repair, deep=args.deep)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
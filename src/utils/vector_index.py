@@ -0,0 +1,498 @@
+"""
+Semantic retrieval index over OCR passages.
+
+Each saved form's OCR text is cut into passages of a few lines, embedded with a
+small CPU-only model and appended to the forms store:
+
+    vectors/meta.json        embedder name and dimension
+    vectors/vectors.f16      float16 row-major matrix (one row per passage), memory-mapped
+    vectors/passages.jsonl   one line per form: first row and (offset, length) of each passage
+    vectors/ivf.npz          optional inverted-file lists (see build_ivf)
+
+passages.jsonl is the commit log: rows past the last committed line are left
+over from an interrupted write and are overwritten by the next append.
+
+Search is exact (chunked matrix products with a running top-k) unless an IVF
+file exists, in which case only the `nprobe` closest lists plus rows appended
+since the IVF was built are scanned.
+
+The embedder is sentence-transformers' all-MiniLM-L6-v2 when that package is
+installed and the model loads; otherwise a hashed word/character n-gram
+embedder is used, which is fast and dependency-free but only lexical.
+set_embedder() plugs in others.
+
+CLI (rebuild the index, build IVF lists, or try a query):
+    python -m src.utils.vector_index [--rebuild] [--build-ivf] [--query "how much was requested"]
+"""
+
+import io
+import json
+import os
+import re
+import zlib
+from pathlib import Path
+
+from . import blobstore
+
+VECTORS_DIR = "vectors"
+META_FILE = "meta.json"
+VECTORS_FILE = "vectors.f16"
+PASSAGES_FILE = "passages.jsonl"
+IVF_FILE = "ivf.npz"
+
+# Embed forms in save_form (with the default hashing embedder this costs ~1.5 ms per
+# form). Forms that were not embedded at ingest are backfilled by get_vector_index.
+EMBED_AT_INGEST = True
+
+PASSAGE_CHARS = 400
+SEARCH_CHUNK_ROWS = 65536
+# Stores with at least this many passages use the IVF lists when they exist
+IVF_MIN_ROWS = 50000
+IVF_NPROBE = 8
+# Rebuild IVF lists when more than this fraction of rows was appended after they were built
+IVF_MAX_TAIL = 0.2
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+HASHING_DIM = 384
+
+_WORD = re.compile(r"[a-z0-9]+")
+_embedder = None
+
+
+# ---------------------------------------------------------------------------
+# Embedders
+# ---------------------------------------------------------------------------
+
+class HashingEmbedder:
+    """
+    Dependency-free fallback: signed feature hashing of words and character
+    3-grams, log-scaled and L2-normalized. Lexical only (no paraphrase matching),
+    but robust to OCR typos and cheap enough to run on every ingest.
+    """
+
+    name = f"hashing-ngram-{HASHING_DIM}"
+    dim = HASHING_DIM
+
+    def _features(self, text):
+        words = _WORD.findall(text.lower())
+        feats = list(words)
+        for word in words:
+            padded = f"#{word}#"
+            feats.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return feats
+
+    def embed(self, texts):
+        import numpy as np
+
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feat in self._features(text):
+                h = zlib.crc32(feat.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        np.copysign(np.log1p(np.abs(out)), out, out=out)
+        return _normalize(out)
+
+
+class SentenceTransformerEmbedder:
+    """Small local transformer (all-MiniLM-L6-v2 by default), run on CPU."""
+
+    def __init__(self, model_name=DEFAULT_MODEL):
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.name = model_name
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        import numpy as np
+
+        vectors = self._model.encode(list(texts), batch_size=64, normalize_embeddings=True,
+                                     convert_to_numpy=True, show_progress_bar=False)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+
+
+def _normalize(matrix):
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def get_embedder():
+    """
+    The active embedder: sentence-transformers if installed and its model loads
+    (it may need a download), else HashingEmbedder.
+    """
+    global _embedder
+    if _embedder is None:
+        try:
+            _embedder = SentenceTransformerEmbedder()
+        except ImportError:
+            _embedder = HashingEmbedder()
+        except Exception as exc:
+            print(f"[vector_index] Could not load {DEFAULT_MODEL}, using hashed n-grams -> {exc}")
+            _embedder = HashingEmbedder()
+    return _embedder
+
+
+def set_embedder(embedder):
+    """
+    Replace the embedder (any object with `name`, `dim` and `embed(texts) -> float32
+    array of L2-normalized rows`). Returns the previous one. Stores built with a
+    different embedder are rebuilt on next use.
+    """
+    global _embedder
+    previous, _embedder = _embedder, embedder
+    return previous
+
+
+# ---------------------------------------------------------------------------
+# Passages
+# ---------------------------------------------------------------------------
+
+def split_passages(text, max_chars=PASSAGE_CHARS):
+    """
+    Cut text into passages of whole lines, up to `max_chars` each (longer lines
+    are split). Returns [(offset, length)] into `text`; blank text has none.
+    """
+    passages = []
+    start = end = 0
+    for match in re.finditer(r"[^\n]*\n?", text):
+        line_start, line_end = match.span()
+        if line_start == line_end:
+            break
+        if end - start + (line_end - line_start) > max_chars and end > start:
+            passages.append((start, end - start))
+            start = line_start
+        end = line_end
+        while end - start > max_chars:
+            passages.append((start, max_chars))
+            start += max_chars
+    if end > start:
+        passages.append((start, end - start))
+    return [(off, length) for off, length in passages if text[off:off + length].strip()]
+
+
+def embed_form(ocr_text, embedder=None):
+    """Passages and their vectors for one form: ([(offset, length)], float32 array)."""
+    import numpy as np
+
+    embedder = embedder or get_embedder()
+    passages = split_passages(ocr_text)
+    if not passages:
+        return passages, np.zeros((0, embedder.dim), dtype=np.float32)
+    return passages, embedder.embed([ocr_text[off:off + length] for off, length in passages])
+
+
+# ---------------------------------------------------------------------------
+# On-disk index
+# ---------------------------------------------------------------------------
+
+def _dir(root):
+    return Path(root) / VECTORS_DIR
+
+
+def read_meta(root):
+    try:
+        with open(_dir(root) / META_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(directory, embedder):
+    blobstore.write_atomic(directory / META_FILE, json.dumps({"model": embedder.name, "dim": embedder.dim}))
+
+
+def append_form(root, form_id, passages, vectors, embedder=None, committed_rows=None):
+    """
+    Durably append one form's passage vectors (caller holds store_lock).
+    Vectors are written and synced before the passages.jsonl line that commits
+    them. Returns False (and writes nothing) when the store was built with a
+    different embedder.
+    """
+    embedder = embedder or get_embedder()
+    directory = _dir(root)
+    meta = read_meta(root)
+    if meta is None:
+        _write_meta(directory, embedder)
+    elif meta.get("model") != embedder.name or meta.get("dim") != embedder.dim:
+        return False
+
+    if committed_rows is None:
+        committed_rows = load_vector_index(root).rows
+    row_bytes = embedder.dim * 2
+    path = directory / VECTORS_FILE
+    with open(path, "ab") as f:
+        pass
+    with open(path, "r+b") as f:
+        # Drop rows from an interrupted append that were never committed
+        f.truncate(committed_rows * row_bytes)
+        f.seek(committed_rows * row_bytes)
+        f.write(vectors.astype("<f2").tobytes())
+        blobstore.sync(f)
+    line = json.dumps({"form_id": form_id, "row": committed_rows, "passages": [list(p) for p in passages]})
+    blobstore.append_line(directory / PASSAGES_FILE, line)
+    return True
+
+
+class VectorIndex:
+    """
+    Passage rows loaded from passages.jsonl plus a read-only float16 memmap.
+    `row_form[i]` is the position in `form_ids` of the form owning row i.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.meta = read_meta(root)
+        self.form_ids = []
+        self.form_rows = {}  # form_id -> (first row, passages)
+        self.rows = 0
+        self._row_form = []
+        self._matrix = None
+        self._ivf = None
+        self._ivf_mtime = None
+
+    @property
+    def dim(self):
+        return self.meta["dim"] if self.meta else 0
+
+    def add(self, form_id, row, passages):
+        if form_id in self.form_rows:
+            return
+        pos = len(self.form_ids)
+        self.form_ids.append(form_id)
+        self.form_rows[form_id] = (row, passages)
+        self._row_form.extend([pos] * len(passages))
+        self.rows = max(self.rows, row + len(passages))
+        self._matrix = None
+
+    def add_entry(self, entry):
+        """Apply one passages.jsonl record."""
+        self.add(entry["form_id"], entry["row"], [tuple(p) for p in entry["passages"]])
+
+    def matrix(self):
+        """Memory-mapped (rows, dim) float16 matrix of committed rows."""
+        import numpy as np
+
+        if self._matrix is None:
+            if not self.rows:
+                return np.zeros((0, self.dim), dtype=np.float16)
+            self._matrix = np.memmap(_dir(self.root) / VECTORS_FILE, dtype="<f2", mode="r",
+                                     shape=(self.rows, self.dim))
+        return self._matrix
+
+    def row_form(self):
+        import numpy as np
+
+        return np.asarray(self._row_form, dtype=np.int64)
+
+    def _load_ivf(self):
+        import numpy as np
+
+        path = _dir(self.root) / IVF_FILE
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._ivf = None
+            return None
+        if self._ivf_mtime != mtime:
+            with np.load(path) as data:
+                self._ivf = {k: data[k] for k in data.files}
+            self._ivf_mtime = mtime
+        return self._ivf
+
+    def _candidate_rows(self, queries, form_filter, nprobe):
+        """Row ids to scan for each query, or None for an exhaustive scan."""
+        import numpy as np
+
+        if form_filter is not None:
+            allowed = np.isin(self.row_form(), np.fromiter(form_filter, dtype=np.int64))
+            rows = np.flatnonzero(allowed)
+            return [rows] * len(queries)
+        ivf = self._load_ivf() if self.rows >= IVF_MIN_ROWS else None
+        if ivf is None:
+            return None
+        trained = int(ivf["trained_rows"])
+        tail = np.arange(trained, self.rows, dtype=np.int64)
+        probes = np.argsort(-(queries @ ivf["centroids"].T), axis=1)[:, :nprobe]
+        offsets, order = ivf["offsets"], ivf["order"]
+        out = []
+        for lists in probes:
+            parts = [order[offsets[c]:offsets[c + 1]] for c in lists]
+            out.append(np.concatenate(parts + [tail]))
+        return out
+
+    def search(self, queries, k=10, form_filter=None, nprobe=IVF_NPROBE):
+        """
+        Top-k passage rows for each query vector.
+        - queries: float32 array (m, dim) of normalized vectors
+        - form_filter: optional set of positions in `form_ids` to restrict to
+        Returns (scores, rows): two (m, k') arrays sorted best first, k' <= k.
+        """
+        import numpy as np
+
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        matrix = self.matrix()
+        m = len(queries)
+        best_scores = np.full((m, 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((m, 0), dtype=np.int64)
+        if not self.rows or not m:
+            return best_scores, best_rows
+
+        candidates = self._candidate_rows(queries, form_filter, nprobe)
+        if candidates is None:
+            # Exhaustive: all queries against one chunk of rows at a time, keeping a running top-k
+            for start in range(0, self.rows, SEARCH_CHUNK_ROWS):
+                chunk = np.asarray(matrix[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+                scores = queries @ chunk.T
+                rows = np.broadcast_to(np.arange(start, start + len(chunk)), scores.shape)
+                best_scores, best_rows = _merge_topk(best_scores, best_rows, scores, rows, k)
+            return best_scores, best_rows
+
+        out_scores = np.full((m, k), -np.inf, dtype=np.float32)
+        out_rows = np.full((m, k), -1, dtype=np.int64)
+        for i, rows in enumerate(candidates):
+            if not len(rows):
+                continue
+            rows = np.sort(rows)
+            scores = np.asarray(matrix[rows], dtype=np.float32) @ queries[i]
+            s, r = _merge_topk(best_scores[i:i + 1], best_rows[i:i + 1], scores[None, :], rows[None, :], k)
+            out_scores[i, :s.shape[1]], out_rows[i, :s.shape[1]] = s[0], r[0]
+        width = min(k, max((len(r) for r in candidates), default=0))
+        return out_scores[:, :width], out_rows[:, :width]
+
+
+def _merge_topk(best_scores, best_rows, scores, rows, k):
+    """Keep the k best of (running best, new chunk) per query, sorted best first."""
+    import numpy as np
+
+    all_scores = np.concatenate([best_scores, scores], axis=1)
+    all_rows = np.concatenate([best_rows, rows], axis=1)
+    if all_scores.shape[1] > k:
+        top = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        all_scores = np.take_along_axis(all_scores, top, axis=1)
+        all_rows = np.take_along_axis(all_rows, top, axis=1)
+    order = np.argsort(-all_scores, axis=1, kind="stable")
+    return np.take_along_axis(all_scores, order, axis=1), np.take_along_axis(all_rows, order, axis=1)
+
+
+_index_cache = {}
+
+
+def load_vector_index(root):
+    """
+    VectorIndex for the store at `root`; only passages.jsonl lines appended since
+    the last call are read. A torn last line is left for the next call.
+    """
+    path = _dir(root) / PASSAGES_FILE
+    return blobstore.load_appended(path, _index_cache.setdefault(str(path), {}), lambda: VectorIndex(root),
+                                   VectorIndex.add_entry, key=json.dumps(read_meta(root), sort_keys=True))
+
+
+def build(root, forms, embedder=None):
+    """
+    Rebuild the index from scratch (caller holds store_lock).
+    - forms: iterable of (form_id, ocr_text)
+    The new index is written beside the old one and swapped in with renames.
+    Returns the number of passages indexed.
+    """
+    import shutil
+
+    embedder = embedder or get_embedder()
+    directory = _dir(root)
+    tmp = directory.with_name(f"{VECTORS_DIR}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    _write_meta(tmp, embedder)
+    rows = 0
+    with open(tmp / VECTORS_FILE, "wb") as vf, open(tmp / PASSAGES_FILE, "w", encoding="utf-8") as pf:
+        for form_id, ocr_text in forms:
+            passages, vectors = embed_form(ocr_text, embedder)
+            vf.write(vectors.astype("<f2").tobytes())
+            pf.write(json.dumps({"form_id": form_id, "row": rows, "passages": [list(p) for p in passages]}) + "\n")
+            rows += len(passages)
+        blobstore.sync(vf)
+        blobstore.sync(pf)
+    old = directory.with_name(f"{VECTORS_DIR}.{os.getpid()}.old")
+    if directory.exists():
+        os.replace(directory, old)
+    os.replace(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+    _index_cache.pop(str(directory / PASSAGES_FILE), None)
+    return rows
+
+
+def build_ivf(root, nlist=None, iterations=10, seed=0):
+    """
+    Cluster the stored vectors with k-means (nlist ~ sqrt(rows)) and write the
+    inverted lists to ivf.npz. Rows appended later are scanned exhaustively
+    until the lists are rebuilt. Returns nlist (0 if the index is empty).
+    """
+    import numpy as np
+
+    index = load_vector_index(root)
+    matrix = index.matrix()
+    n = index.rows
+    if not n:
+        return 0
+    nlist = nlist or max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False))
+    train = np.asarray(matrix[sample], dtype=np.float32)
+    centroids = train[rng.choice(len(train), size=min(nlist, len(train)), replace=False)]
+    for _ in range(iterations):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        for c in range(len(centroids)):
+            members = train[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+
+    assign = np.empty(n, dtype=np.int64)
+    for start in range(0, n, SEARCH_CHUNK_ROWS):
+        chunk = np.asarray(matrix[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+        assign[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    order = np.argsort(assign, kind="stable")
+    offsets = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+    buf = io.BytesIO()
+    np.savez(buf, centroids=centroids.astype(np.float32), order=order, offsets=offsets,
+             trained_rows=np.int64(n))
+    blobstore.write_atomic(_dir(root) / IVF_FILE, buf.getvalue())
+    return len(centroids)
+
+
+def ivf_is_stale(root):
+    """True when IVF lists exist but too many rows were appended after they were built."""
+    index = load_vector_index(root)
+    ivf = index._load_ivf()
+    return ivf is not None and index.rows > int(ivf["trained_rows"]) * (1 + IVF_MAX_TAIL)
+
+
+def main(argv=None):
+    import argparse
+
+    from . import storage
+
+    parser = argparse.ArgumentParser(description="Semantic passage index over the forms store.")
+    parser.add_argument("--rebuild", action="store_true", help="Re-embed every stored form")
+    parser.add_argument("--build-ivf", action="store_true", help="Build IVF lists for faster search")
+    parser.add_argument("--query", help="Show the best matching forms for a question")
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        print(f"Indexed {storage.rebuild_vector_index()} passage(s) with {get_embedder().name}.")
+    if args.build_ivf:
+        with blobstore.store_lock(storage.FORMS_DB_DIR):
+            print(f"Built {build_ivf(storage.FORMS_DB_DIR)} IVF list(s).")
+    index = storage.get_vector_index()
+    print(f"{len(index.form_ids)} form(s), {index.rows} passage(s), model {(index.meta or {}).get('model')}.")
+    if args.query:
+        for hit in storage.semantic_search([args.query], top_k=args.top_k)[0]:
+            print(f"  {hit['score']:.3f}  {storage.get_form_filename(hit['form_id'])} ({hit['form_id']})")
+            print(f"         {hit['snippet'][:120]!r}")
+
+
+if __name__ == "__main__":
+    main()
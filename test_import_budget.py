@@ -0,0 +1,20 @@
+"""Import-time budget check for the src modules (see benchmarks/bench_import.py)."""
+
+import sys
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from benchmarks.bench_import import check_import_budget
+
+
+def test_import_budget():
+    """Library modules import within budget and load heavy dependencies lazily."""
+    result = check_import_budget(runs=3)
+    assert not result["violations"], "; ".join(result["violations"])
+
+
+if __name__ == "__main__":
+    test_import_budget()
+    print("✅ import time within budget")